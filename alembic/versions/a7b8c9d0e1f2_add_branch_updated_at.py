@@ -0,0 +1,26 @@
+"""添加 branches.updated_at
+
+Revision ID: a7b8c9d0e1f2
+Revises: f6a7b8c9d0e1
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7b8c9d0e1f2'
+down_revision = 'f6a7b8c9d0e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """添加 updated_at 并以 created_at 回填"""
+    op.add_column('branches', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute("UPDATE branches SET updated_at = COALESCE(created_at, now())")
+
+
+def downgrade():
+    op.drop_column('branches', 'updated_at')
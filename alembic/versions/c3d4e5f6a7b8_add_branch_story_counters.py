@@ -0,0 +1,62 @@
+"""添加分支/故事反规范化计数列
+
+Revision ID: c3d4e5f6a7b8
+Revises: b2c3d4e5f6a7
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d4e5f6a7b8'
+down_revision = 'b2c3d4e5f6a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """添加计数列并按现有数据回填"""
+    op.add_column('branches', sa.Column('segments_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('branches', sa.Column('active_bots_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('branches', sa.Column('last_segment_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('branches', sa.Column('last_sequence_order', sa.Integer(), nullable=False, server_default='0'))
+    
+    op.add_column('stories', sa.Column('branches_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('stories', sa.Column('segments_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('stories', sa.Column('bots_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('stories', sa.Column('last_activity_at', sa.DateTime(timezone=True), nullable=True))
+    
+    # 回填分支计数
+    op.execute("""
+        UPDATE branches SET
+            segments_count = (SELECT COUNT(*) FROM segments s WHERE s.branch_id = branches.id),
+            active_bots_count = (SELECT COUNT(*) FROM bot_branch_membership m WHERE m.branch_id = branches.id),
+            last_segment_at = (SELECT MAX(s.created_at) FROM segments s WHERE s.branch_id = branches.id),
+            last_sequence_order = COALESCE((SELECT MAX(s.sequence_order) FROM segments s WHERE s.branch_id = branches.id), 0)
+    """)
+    
+    # 回填故事汇总（updated_at 保持不变）
+    op.execute("""
+        UPDATE stories SET
+            branches_count = (SELECT COUNT(*) FROM branches b WHERE b.story_id = stories.id),
+            segments_count = COALESCE((SELECT SUM(b.segments_count) FROM branches b WHERE b.story_id = stories.id), 0),
+            bots_count = (
+                SELECT COUNT(DISTINCT m.bot_id) FROM bot_branch_membership m
+                JOIN branches b ON m.branch_id = b.id
+                WHERE b.story_id = stories.id
+            ),
+            last_activity_at = (SELECT MAX(b.last_segment_at) FROM branches b WHERE b.story_id = stories.id)
+    """)
+
+
+def downgrade():
+    op.drop_column('stories', 'last_activity_at')
+    op.drop_column('stories', 'bots_count')
+    op.drop_column('stories', 'segments_count')
+    op.drop_column('stories', 'branches_count')
+    op.drop_column('branches', 'last_sequence_order')
+    op.drop_column('branches', 'last_segment_at')
+    op.drop_column('branches', 'active_bots_count')
+    op.drop_column('branches', 'segments_count')
@@ -0,0 +1,52 @@
+"""续写段序号唯一约束
+
+Revision ID: d4e5f6a7b8c9
+Revises: c3d4e5f6a7b8
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e5f6a7b8c9'
+down_revision = 'c3d4e5f6a7b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """修复重复序号后添加 (branch_id, sequence_order) 唯一约束"""
+    # 并发写入可能已产生重复序号：按原顺序（序号、创建时间）重新编号有重复的分支
+    op.execute("""
+        UPDATE segments SET sequence_order = ranked.new_order
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY branch_id ORDER BY sequence_order, created_at, id
+            ) AS new_order
+            FROM segments
+            WHERE branch_id IN (
+                SELECT branch_id FROM segments
+                GROUP BY branch_id, sequence_order
+                HAVING COUNT(*) > 1
+            )
+        ) AS ranked
+        WHERE segments.id = ranked.id AND segments.sequence_order <> ranked.new_order
+    """)
+    
+    # 分配计数器与实际最大序号对齐
+    op.execute("""
+        UPDATE branches SET last_sequence_order = COALESCE(
+            (SELECT MAX(s.sequence_order) FROM segments s WHERE s.branch_id = branches.id), 0
+        )
+    """)
+    
+    op.create_unique_constraint('uq_segments_branch_sequence', 'segments', ['branch_id', 'sequence_order'])
+    # 唯一约束自带 (branch_id, sequence_order) 索引，原普通索引冗余
+    op.drop_index('idx_segments_branch_order', table_name='segments', if_exists=True)
+
+
+def downgrade():
+    op.create_index('idx_segments_branch_order', 'segments', ['branch_id', 'sequence_order'])
+    op.drop_constraint('uq_segments_branch_sequence', 'segments', type_='unique')
@@ -0,0 +1,62 @@
+"""添加分支物化祖先路径
+
+Revision ID: f6a7b8c9d0e1
+Revises: e5f6a7b8c9d0
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6a7b8c9d0e1'
+down_revision = 'e5f6a7b8c9d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """添加 branches.lineage 并按 parent_branch / fork_at_segment_id 回填"""
+    op.add_column('branches', sa.Column('lineage', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("""
+        SELECT b.id, b.parent_branch, b.last_sequence_order,
+               s.branch_id AS fork_branch_id, s.sequence_order AS fork_sequence
+        FROM branches b
+        LEFT JOIN segments s ON s.id = b.fork_at_segment_id
+    """)).fetchall()
+    branches = {str(r.id): r for r in rows}
+    lineages = {}
+    
+    def lineage_of(branch_id, seen=()):
+        if branch_id in lineages:
+            return lineages[branch_id]
+        row = branches[branch_id]
+        parent_id = str(row.parent_branch) if row.parent_branch else (
+            str(row.fork_branch_id) if row.fork_branch_id else None
+        )
+        if not parent_id or parent_id not in branches or parent_id in seen:
+            result = []
+        else:
+            up_to = row.fork_sequence if row.fork_sequence is not None else (
+                branches[parent_id].last_sequence_order or 0
+            )
+            result = lineage_of(parent_id, seen + (branch_id,)) + [
+                {'branch_id': parent_id, 'up_to_sequence': up_to}
+            ]
+        lineages[branch_id] = result
+        return result
+    
+    for branch_id in branches:
+        conn.execute(
+            sa.text("UPDATE branches SET lineage = CAST(:lineage AS JSONB) WHERE id = :id"),
+            {'lineage': json.dumps(lineage_of(branch_id)), 'id': branch_id}
+        )
+
+
+def downgrade():
+    op.drop_column('branches', 'lineage')
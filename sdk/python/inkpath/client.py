@@ -156,6 +156,25 @@ class InkPathClient:
         params = {'limit': limit, 'offset': offset}
         return self._request('GET', f'/api/v1/branches/{branch_id}/segments', params=params)
     
+    def list_segment_changes(
+        self,
+        branch_id: str,
+        since_sequence: int = 0,
+        since: Optional[str] = None,
+        limit: int = 200
+    ) -> Dict:
+        """
+        增量获取续写段（轮询用）
+        
+        Args:
+            since_sequence: 已读到的 sequence_order，下次传入返回的 next_since_sequence
+            since: 或者 ISO 8601 时间戳
+        """
+        params = {'since_sequence': since_sequence, 'limit': limit}
+        if since:
+            params['since'] = since
+        return self._request('GET', f'/api/v1/branches/{branch_id}/segments/changes', params=params)
+    
     def create_segment(self, branch_id: str, content: str) -> Dict:
         """提交续写段"""
         data = {'content': content}
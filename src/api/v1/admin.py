@@ -9,6 +9,7 @@ from src.database import get_db
 from src.services.story_service import get_story_by_id
 from src.services.branch_service import get_branch_by_id, get_branches_by_story
 from src.services.segment_service import get_segments_by_branch, get_segment_by_id
+from src.utils.cache import cache_service
 
 
 def get_db_session():
@@ -177,6 +178,7 @@ def update_segment(segment_id):
     segment.content = data['content']
     db.commit()
     db.refresh(segment)
+    cache_service.invalidate_segment(segment.id, segment.branch_id)
     return jsonify({
         'status': 'success',
         'data': {
@@ -202,8 +204,12 @@ def delete_segment(segment_id):
     if not segment:
         return jsonify({'status': 'error', 'error': {'code': 'NOT_FOUND', 'message': '片段不存在'}}), 404
 
+    branch_id = segment.branch_id
     db.delete(segment)
+    from src.services.counter_service import record_segments_removed
+    record_segments_removed(db, branch_id)
     db.commit()
+    cache_service.invalidate_segment(segment_uuid, branch_id)
     return jsonify({'status': 'success', 'data': {'id': segment_id}}), 200
 
 
@@ -275,6 +281,8 @@ def update_bot(bot_id):
         bot.status = data['status']
     db.commit()
     db.refresh(bot)
+    from src.utils.auth import invalidate_bot_principal
+    invalidate_bot_principal(bot.id)
     return jsonify({
         'status': 'success',
         'data': {
@@ -820,6 +820,10 @@ def update_bot_profile():
         
         db.commit()
         
+        # 认证缓存中的 Bot 快照含名称/模型
+        from src.utils.auth import invalidate_bot_principal
+        invalidate_bot_principal(bot.id)
+        
         return jsonify({
             'message': '更新成功',
             'data': {
@@ -2,7 +2,7 @@
 import gzip
 import json
 import logging
-from flask import Blueprint, request, jsonify, g, current_app, Response
+from flask import Blueprint, request, jsonify, g, current_app, Response, stream_with_context
 from sqlalchemy.orm import Session
 import uuid
 from src.database import get_db
@@ -10,7 +10,7 @@ from src.services.branch_service import (
     create_branch, get_branch_by_id, get_branches_by_story,
     get_branch_tree, join_branch, leave_branch, get_next_bot_in_queue
 )
-from src.services.segment_service import get_segments_by_branch
+from src.services.segment_service import iter_segments_for_export
 from src.models.segment import Segment
 from src.models.bot_branch_membership import BotBranchMembership
 from src.utils.rate_limit import create_branch_rate_limit, create_join_branch_rate_limit
@@ -272,15 +272,9 @@ def get_branch_detail(branch_id):
             }
         }), 404
     
-    # 获取统计信息
-    segments_count = db.query(Segment).filter(Segment.branch_id == branch.id).count()
-    active_bots_count = db.query(BotBranchMembership).filter(
-        BotBranchMembership.branch_id == branch.id
-    ).count()
-    
-    # 获取前10个 segment（预览用）
-    from src.services.segment_service import get_segments_by_branch
-    preview_segments, _ = get_segments_by_branch(
+    # 获取前10个 segment（预览用，复用续写段分页缓存）
+    from src.services.segment_service import get_segment_page
+    preview_segments, _ = get_segment_page(
         db=db, branch_id=branch_uuid, limit=10, offset=0
     )
     
@@ -295,17 +289,18 @@ def get_branch_detail(branch_id):
             
             'fork_at_segment_id': str(branch.fork_at_segment_id) if branch.fork_at_segment_id else None,
             'status': branch.status,
-            'segments_count': segments_count,
-            'active_bots_count': active_bots_count,
+            'segments_count': branch.segments_count,
+            'active_bots_count': branch.active_bots_count,
+            'last_segment_at': branch.last_segment_at.isoformat() if branch.last_segment_at else None,
             'created_at': branch.created_at.isoformat() if branch.created_at else None,
             'segments_preview': [
                 {
-                    'id': str(segment.id),
-                    'content': segment.content[:200] + '...' if len(segment.content) > 200 else segment.content,
-                    'sequence_order': segment.sequence_order,
-                    'bot_name': segment.bot.name if segment.bot else None,
-                    'bot_id': str(segment.bot_id) if segment.bot_id else None,
-                    'created_at': segment.created_at.isoformat() if segment.created_at else None,
+                    'id': segment['id'],
+                    'content': segment['content'][:200] + '...' if len(segment['content']) > 200 else segment['content'],
+                    'sequence_order': segment['sequence_order'],
+                    'bot_name': segment['bot_name'],
+                    'bot_id': segment['bot_id'],
+                    'created_at': segment['created_at'],
                 }
                 for segment in preview_segments
             ]
@@ -319,6 +314,16 @@ def get_branch_full_story(branch_id):
     获取分支完整故事文本（公开接口）
     按续写顺序返回故事片段集合，支持 gzip 压缩以减少网络传输。
     请求头带 Accept-Encoding: gzip 时返回压缩内容。
+    
+    stream=json 时以流式输出同结构的 JSON，stream=ndjson 时每行一个对象
+    （首行 story/branch 元信息，随后每行一个续写段，末行汇总）；
+    流式模式分批读取续写段并增量压缩，不设 5000 段上限。
+    
+    非流式响应的 gzip 产物按 (分支代数, last_sequence_order, 段数, 摘要更新时间, 故事更新时间)
+    缓存，带由缓存键导出的强 ETag；If-None-Match 命中时在构建产物之前返回 304。
+    
+    include_ancestors=true 时按分支的物化祖先路径一并返回继承的前缀（分叉点之前
+    的祖先续写段），与本分支续写段在一条有序查询中取出，每段附带所属 branch_id。
     """
     try:
         branch_uuid = uuid.UUID(branch_id)
@@ -352,61 +357,187 @@ def get_branch_full_story(branch_id):
             }
         }), 404
 
-    segments, total = get_segments_by_branch(
-        db=db, branch_id=branch_uuid, limit=5000, offset=0
+    story_data = {
+        'id': str(story.id),
+        'title': story.title,
+        'background': story.background,
+        'style_rules': story.style_rules,
+        'language': story.language,
+    }
+    branch_data = {
+        'id': str(branch.id),
+        'title': branch.title,
+        'description': branch.description,
+        'current_summary': branch.current_summary,
+    }
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    lineage = None
+    if request.args.get('include_ancestors', 'false').lower() == 'true':
+        lineage = branch.lineage or []
+        branch_data['lineage'] = lineage
+
+    stream_format = request.args.get('stream', '').lower()
+    if stream_format in ('json', 'ndjson'):
+        return _stream_full_story(db, branch_uuid, story_data, branch_data, stream_format, use_gzip, lineage)
+
+    key = _full_story_artifact_key(db, branch, story, lineage)
+    # 同一内容的不同编码是不同表示，强 ETag 需要区分
+    suffix = '-gz' if use_gzip else ''
+
+    # 缓存可用时 ETag 由键导出，条件请求在读取续写段、构建产物之前就能应答 304
+    from src.utils.cache import cache_service
+    if cache_service.is_enabled():
+        tag = _full_story_etag(key) + suffix
+        if request.if_none_match.contains(tag):
+            return Response(status=304, headers={'Vary': 'Accept-Encoding', 'ETag': f'"{tag}"'})
+
+    etag, compressed = _get_full_story_artifact(db, key, branch.id, story_data, branch_data, lineage)
+    tag = etag + suffix
+    headers = {'Vary': 'Accept-Encoding', 'ETag': f'"{tag}"'}
+
+    if request.if_none_match.contains(tag):
+        return Response(status=304, headers=headers)
+
+    if use_gzip:
+        # 直接输出缓存的压缩字节
+        headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(compressed))
+        return Response(compressed, status=200, mimetype='application/json', headers=headers)
+    return Response(
+        gzip.decompress(compressed),
+        status=200,
+        mimetype='application/json',
+        headers=headers
     )
-    segments_data = [
-        {
-            'sequence_order': seg.sequence_order,
-            'id': str(seg.id),
-            'content': seg.content,
-            'bot_id': str(seg.bot_id) if seg.bot_id else None,
-            'bot_name': seg.bot.name if seg.bot else None,
-            'created_at': seg.created_at.isoformat() if seg.created_at else None,
-        }
-        for seg in segments
+
+
+# 完整故事压缩产物的缓存时间（秒）；内容变化时键随之变化，无需主动失效
+FULL_STORY_ARTIFACT_TTL = 3600
+
+
+def _full_story_artifact_key(db, branch, story, lineage=None):
+    """
+    完整故事产物的缓存键
+    
+    覆盖所有版本输入：分支代数（续写段编辑/删除时递增）、last_sequence_order、段数、
+    摘要更新时间、故事更新时间；lineage 不为 None 时再加入各祖先的分支代数与段数
+    （祖先续写段被编辑或删除时 invalidate_segment 只递增祖先分支的代数）。
+    """
+    from src.utils.cache import cache_service, cache_key
+
+    key_parts = [
+        branch.id,
+        branch.last_sequence_order,
+        branch.segments_count,
+        branch.summary_updated_at.isoformat() if branch.summary_updated_at else '-',
+        story.updated_at.isoformat() if story.updated_at else '-'
     ]
+    if lineage is not None:
+        from src.models.branch import Branch
+        ancestor_ids = [uuid.UUID(a['branch_id']) for a in lineage]
+        counts = dict(db.query(Branch.id, Branch.segments_count).filter(
+            Branch.id.in_(ancestor_ids)
+        ).all()) if ancestor_ids else {}
+        key_parts.append('ancestors:' + ','.join(
+            f"{a['branch_id']}@{a['up_to_sequence']}/{counts.get(aid, 0)}"
+            f"/g{cache_service.get_generation('branch', aid)}"
+            for a, aid in zip(lineage, ancestor_ids)
+        ))
+    return cache_key("full_story:branch", *key_parts)
+
+
+def _full_story_etag(key: str, body: bytes = None) -> str:
+    """
+    完整故事的强 ETag
+    
+    缓存可用时由缓存键导出（代数随写入递增），无需构建产物即可比较；
+    缓存不可用时代数恒为 0，只能按内容计算。
+    """
+    import hashlib
+    from src.utils.cache import cache_service
+
+    if cache_service.is_enabled() or body is None:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def _get_full_story_artifact(db, key, branch_id, story_data, branch_data, lineage=None):
+    """
+    获取完整故事的 gzip 产物及其 ETag（带缓存）
+    
+    续写段经 iter_segments_for_export 全量读取，产物总是完整的。
+    
+    Returns:
+        (etag, gzip 字节)
+    """
+    from src.utils.cache import cache_service
+
+    cached = cache_service.get_bytes(key)
+    if cached:
+        etag, _, compressed = cached.partition(b'\n')
+        return etag.decode('ascii'), compressed
+
+    segments_data = list(iter_segments_for_export(db, branch_id, lineage=lineage or None))
 
     payload = {
         'status': 'success',
         'data': {
-            'story': {
-                'id': str(story.id),
-                'title': story.title,
-                'background': story.background,
-                'style_rules': story.style_rules,
-                'language': story.language,
-            },
-            'branch': {
-                'id': str(branch.id),
-                'title': branch.title,
-                'description': branch.description,
-                'current_summary': branch.current_summary,
-            },
+            'story': story_data,
+            'branch': branch_data,
             'segments': segments_data,
-            'segments_count': total,
+            'segments_count': len(segments_data),
         }
     }
 
-    body = json.dumps(payload, ensure_ascii=False)
-    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    etag = _full_story_etag(key, body)
+    compressed = gzip.compress(body)
+    cache_service.set_bytes(key, etag.encode('ascii') + b'\n' + compressed, ttl=FULL_STORY_ARTIFACT_TTL)
+    return etag, compressed
 
-    if use_gzip:
-        compressed = gzip.compress(body.encode('utf-8'))
-        return Response(
-            compressed,
-            status=200,
-            mimetype='application/json',
-            headers={
-                'Content-Encoding': 'gzip',
-                'Content-Length': str(len(compressed)),
-            }
-        )
-    return Response(
-        body,
-        status=200,
-        mimetype='application/json',
+
+def _iter_full_story_json(db, branch_uuid, story_data, branch_data, lineage=None):
+    """逐块生成与非流式响应结构相同的 JSON 文档"""
+    yield '{"status": "success", "data": {"story": %s, "branch": %s, "segments": [' % (
+        json.dumps(story_data, ensure_ascii=False),
+        json.dumps(branch_data, ensure_ascii=False)
     )
+    total = 0
+    for segment in iter_segments_for_export(db, branch_uuid, lineage=lineage):
+        yield (', ' if total else '') + json.dumps(segment, ensure_ascii=False)
+        total += 1
+    yield '], "segments_count": %d}}' % total
+
+
+def _iter_full_story_ndjson(db, branch_uuid, story_data, branch_data, lineage=None):
+    """逐行生成 NDJSON"""
+    yield json.dumps({'type': 'meta', 'story': story_data, 'branch': branch_data}, ensure_ascii=False) + '\n'
+    total = 0
+    for segment in iter_segments_for_export(db, branch_uuid, lineage=lineage):
+        yield json.dumps(dict(segment, type='segment'), ensure_ascii=False) + '\n'
+        total += 1
+    yield json.dumps({'type': 'end', 'segments_count': total}) + '\n'
+
+
+def _stream_full_story(db, branch_uuid, story_data, branch_data, stream_format, use_gzip, lineage=None):
+    """完整故事的流式响应（可选增量 gzip）"""
+    from src.utils.streaming import gzip_stream, encode_chunks
+
+    if stream_format == 'ndjson':
+        chunks = _iter_full_story_ndjson(db, branch_uuid, story_data, branch_data, lineage)
+        mimetype = 'application/x-ndjson'
+    else:
+        chunks = _iter_full_story_json(db, branch_uuid, story_data, branch_data, lineage)
+        mimetype = 'application/json'
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if use_gzip:
+        body = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        body = encode_chunks(chunks)
+    return Response(stream_with_context(body), status=200, mimetype=mimetype, headers=headers)
 
 
 @branches_bp.route('/branches/<branch_id>/participants', methods=['GET'])
@@ -514,20 +645,15 @@ def list_branches(story_id):
             include_all=include_all
         )
 
-        # 构建响应数据
-        from src.services.activity_service import get_activity_score_cached
+        # 构建响应数据（活跃度得分一次批量读取）
+        from src.services.activity_service import get_activity_scores_cached
+        try:
+            activity_scores = get_activity_scores_cached(db, [branch.id for branch in branches])
+        except Exception:
+            activity_scores = {}
         branches_data = []
         for branch in branches:
-            segments_count = db.query(Segment).filter(Segment.branch_id == branch.id).count()
-            active_bots_count = db.query(BotBranchMembership).filter(
-                BotBranchMembership.branch_id == branch.id
-            ).count()
-
-            # 获取活跃度得分
-            try:
-                activity_score = get_activity_score_cached(db, branch.id)
-            except Exception:
-                activity_score = 0.0
+            activity_score = activity_scores.get(branch.id, 0.0)
 
             branches_data.append({
                 'id': str(branch.id),
@@ -535,8 +661,9 @@ def list_branches(story_id):
                 'description': branch.description,
                 'parent_branch_id': str(branch.parent_branch) if branch.parent_branch else None,
                 
-                'segments_count': segments_count,
-                'active_bots_count': active_bots_count,
+                'segments_count': branch.segments_count,
+                'active_bots_count': branch.active_bots_count,
+                'last_segment_at': branch.last_segment_at.isoformat() if branch.last_segment_at else None,
                 'activity_score': activity_score,
                 'created_at': branch.created_at.isoformat() if branch.created_at else None
             })
@@ -575,20 +702,37 @@ def list_branches(story_id):
 
 @branches_bp.route('/stories/<story_id>/branches/tree', methods=['GET'])
 def get_branch_tree_endpoint(story_id):
-    """获取分支树API"""
+    """获取分支树API
+    
+    查询参数：
+    - max_depth: 最大展开层数（可选）
+    - root_branch_id: 只返回该分支下的子树，用于按需加载被截断的节点（可选）
+    """
     try:
         story_uuid = uuid.UUID(story_id)
+        root_branch_id = request.args.get('root_branch_id')
+        root_branch_uuid = uuid.UUID(root_branch_id) if root_branch_id else None
     except ValueError:
         return jsonify({
             'status': 'error',
             'error': {
                 'code': 'VALIDATION_ERROR',
-                'message': '无效的故事ID格式'
+                'message': '无效的故事ID或分支ID格式'
+            }
+        }), 400
+    
+    max_depth = request.args.get('max_depth', type=int)
+    if max_depth is not None and max_depth < 1:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'VALIDATION_ERROR',
+                'message': 'max_depth 必须大于等于 1'
             }
         }), 400
     
     db: Session = get_db_session()
-    tree = get_branch_tree(db, story_uuid)
+    tree = get_branch_tree(db, story_uuid, max_depth=max_depth, root_branch_id=root_branch_uuid)
     
     return jsonify({
         'status': 'success',
@@ -5,6 +5,7 @@ import uuid
 from src.database import get_db
 from src.services.comment_service import create_comment, get_comments_by_branch
 from src.utils.rate_limit import create_comment_rate_limit
+from src.utils.conditional import conditional_get
 
 
 def get_db_session():
@@ -17,6 +18,12 @@ def get_db_session():
 comments_bp = Blueprint('comments', __name__)
 
 
+def _comments_version(branch_id):
+    """评论树的版本标记（条件 GET）"""
+    from src.services.version_service import branch_comments_version
+    return branch_comments_version(get_db_session(), uuid.UUID(branch_id))
+
+
 @comments_bp.route('/branches/<branch_id>/comments', methods=['POST'])
 def create_comment_endpoint(branch_id):
     """发表评论API（支持Bot和人类）"""
@@ -182,6 +189,7 @@ def create_comment_endpoint(branch_id):
 
 
 @comments_bp.route('/branches/<branch_id>/comments', methods=['GET'])
+@conditional_get(_comments_version)
 def get_comments_endpoint(branch_id):
     """获取评论树API"""
     try:
@@ -6,7 +6,9 @@ from src.services.cron_service import (
     check_bot_timeouts,
     update_activity_scores,
     cleanup_expired_data,
-    cleanup_stuck_memberships
+    cleanup_stuck_memberships,
+    reconcile_branch_counters,
+    dispatch_outbox_events
 )
 from src.utils.auth import bot_auth_required
 import os
@@ -154,6 +156,86 @@ def cleanup_expired_data_endpoint():
         }), 500
 
 
+@cron_bp.route('/cron/reconcile-counters', methods=['POST', 'GET'])
+def reconcile_counters_endpoint():
+    """
+    校正分支/故事计数任务（定时任务端点）
+    
+    需要CRON_SECRET认证
+    """
+    # 验证Cron Secret
+    if not verify_cron_secret():
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'UNAUTHORIZED',
+                'message': '无效的Cron Secret'
+            }
+        }), 401
+    
+    db: Session = get_db_session()
+    
+    try:
+        results = reconcile_branch_counters(db)
+        
+        return jsonify({
+            'status': 'success',
+            'data': results
+        }), 200
+    
+    except Exception as e:
+        import traceback
+        if current_app.config.get('FLASK_DEBUG'):
+            traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'INTERNAL_ERROR',
+                'message': f'执行定时任务失败: {str(e)}'
+            }
+        }), 500
+
+
+@cron_bp.route('/cron/dispatch-outbox', methods=['POST', 'GET'])
+def dispatch_outbox_endpoint():
+    """
+    处理发件箱事件任务（定时任务端点）
+    
+    需要CRON_SECRET认证
+    """
+    # 验证Cron Secret
+    if not verify_cron_secret():
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'UNAUTHORIZED',
+                'message': '无效的Cron Secret'
+            }
+        }), 401
+    
+    db: Session = get_db_session()
+    
+    try:
+        results = dispatch_outbox_events(db)
+        
+        return jsonify({
+            'status': 'success',
+            'data': results
+        }), 200
+    
+    except Exception as e:
+        import traceback
+        if current_app.config.get('FLASK_DEBUG'):
+            traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'INTERNAL_ERROR',
+                'message': f'执行定时任务失败: {str(e)}'
+            }
+        }), 500
+
+
 @cron_bp.route('/cron/cleanup-stuck-memberships', methods=['POST'])
 @bot_auth_required
 def cleanup_stuck_memberships_endpoint():
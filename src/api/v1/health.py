@@ -13,6 +13,21 @@ def health_check():
     }), 200
 
 
+@health_bp.route('/health/metrics', methods=['GET'])
+def health_metrics():
+    """进程内缓存统计（每个 worker 独立）"""
+    from src.utils.auth import principal_cache
+    from src.utils.cache import cache_service
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'auth_cache': principal_cache.stats(),
+            'cache': cache_service.stats(),
+            'cache_l1': cache_service.local.stats()
+        }
+    }), 200
+
+
 @health_bp.route('/', methods=['GET'])
 def root():
     """根路径"""
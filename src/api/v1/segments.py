@@ -4,12 +4,14 @@ from sqlalchemy.orm import Session
 import uuid
 from src.database import get_db
 from src.services.segment_service import (
-    create_segment, get_segments_by_branch, get_segment_by_id,
-    count_segments_by_branch, log_segment_creation
+    create_segment, create_segments_bulk, get_segment_page, get_segment_changes, get_segment_page_after, get_segment_by_id,
+    count_segments_by_branch, count_segments_by_branch_cached,
+    encode_segment_cursor, decode_segment_cursor
 )
 from src.services.branch_service import get_next_bot_in_queue
 from src.utils.auth import bot_auth_required, api_token_auth_required
 from src.utils.rate_limit import create_segment_rate_limit
+from src.utils.conditional import conditional_get
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
 
 
@@ -23,7 +25,24 @@ def get_db_session():
 segments_bp = Blueprint('segments', __name__)
 
 
-def _create_segment_inner(db, branch_uuid, user_id=None, bot_id=None, bot_name=None, bot_model=None, content=None, is_starter=False):
+def _segments_version(branch_id):
+    """续写列表的版本标记（条件 GET）"""
+    from src.services.version_service import branch_segments_version
+    return branch_segments_version(get_db_session(), uuid.UUID(branch_id))
+
+
+def _add_next_bot(db, branch_uuid, response_data):
+    """响应里带上轮次队列中的下一个 Bot（通知仍由发件箱发送）"""
+    next_bot = get_next_bot_in_queue(db, branch_uuid)
+    if next_bot:
+        response_data['next_bot'] = {
+            'id': str(next_bot.id),
+            'name': next_bot.name,
+            'model': next_bot.model
+        }
+
+
+def _create_segment_inner(db, branch_uuid, user_id=None, bot_id=None, bot_name=None, bot_model=None, content=None, is_starter=False, author=None):
     """内部创建片段逻辑"""
     from src.models.bot import Bot
     
@@ -52,7 +71,8 @@ def _create_segment_inner(db, branch_uuid, user_id=None, bot_id=None, bot_name=N
         branch_id=branch_uuid,
         bot_id=author_id,
         content=content,
-        is_starter=is_starter
+        is_starter=is_starter,
+        author=author
     )
 
 
@@ -187,6 +207,7 @@ def create_segment_endpoint(branch_id):
         }), 401
     
     try:
+        author_id = bot_id or (user.id if user else None)
         segment = _create_segment_inner(
             db=db,
             branch_uuid=branch_uuid,
@@ -194,48 +215,19 @@ def create_segment_endpoint(branch_id):
             bot_id=bot_id,
             bot_name=author_name,
             content=content,
-            is_starter=is_starter
+            is_starter=is_starter,
+            author={
+                'author_id': author_id,
+                'author_type': 'bot' if bot_id else 'human',
+                'author_name': author_name or ('Bot' if bot_id else '未知用户'),
+            }
         )
         
-        # 获取分支信息（用于日志）
-        from src.models.branch import Branch
-        branch_obj = db.query(Branch).filter(Branch.id == branch_uuid).first()
-        
-        # 记录创作日志
-        try:
-            author_type = 'bot' if bot_id else 'human'
-            log_author_id = bot_id or (user.id if user else None)
-            log_segment_creation(
-                db=db,
-                segment_id=segment.id,
-                story_id=branch_obj.story_id if branch_obj else branch_uuid,
-                branch_id=branch_uuid,
-                author_id=log_author_id,
-                author_type=author_type,
-                author_name=author_name or ('Bot' if bot_id else '未知用户'),
-                content_length=len(content) if content else 0,
-                is_continuation='new' if is_starter else 'continuation'
-            )
-        except Exception as log_error:
-            import logging
-            logging.warning(f"Failed to log segment creation: {log_error}")
-        
-        # 获取下一个 Bot
-        next_bot = get_next_bot_in_queue(db, branch_uuid)
-        
-        # 通知下一个 Bot（异步）
-        if next_bot and next_bot.webhook_url:
-            try:
-                from src.utils.notification_queue import enqueue_your_turn_notification
-                enqueue_your_turn_notification(
-                    bot_id=str(next_bot.id),
-                    branch_id=str(branch_uuid)
-                )
-            except Exception as e:
-                import logging
-                logging.warning(f"Failed to enqueue your_turn notification: {str(e)}")
+        # 创作日志、下一个 Bot 通知由发件箱分发器在提交后处理
+        from src.services.outbox_service import kick_dispatcher
+        kick_dispatcher(db)
         
-        author_id_str = str(bot_id) if bot_id else (str(user.id) if user else None)
+        author_id_str = str(author_id) if author_id else None
         
         response_data = {
             'segment': {
@@ -248,13 +240,7 @@ def create_segment_endpoint(branch_id):
                 'created_at': segment.created_at.isoformat() if segment.created_at else None
             }
         }
-        
-        if next_bot:
-            response_data['next_bot'] = {
-                'id': str(next_bot.id),
-                'name': next_bot.name,
-                'model': next_bot.model
-            }
+        _add_next_bot(db, branch_uuid, response_data)
         
         return jsonify({
             'status': 'success',
@@ -291,9 +277,152 @@ def create_segment_endpoint(branch_id):
         }), 500
 
 
+@segments_bp.route('/branches/<branch_id>/segments/bulk', methods=['POST'])
+def create_segments_bulk_endpoint(branch_id):
+    """
+    批量提交续写API（JWT 认证，Bot / 用户 / Admin）
+    
+    请求体: {"segments": [{"content": "..."}, ...], "is_starter": false}
+    整批校验、一个事务写入，只计一次速率限制、只发一次轮次通知。
+    """
+    from src.models.bot import Bot
+    from src.models.user import User
+    
+    db: Session = get_db_session()
+    
+    user = None
+    bot = None
+    is_admin = False
+    try:
+        verify_jwt_in_request(optional=True)
+        jwt_identity = get_jwt_identity()
+        if jwt_identity:
+            if get_jwt().get('user_type') == 'admin':
+                is_admin = True
+            else:
+                bot = db.query(Bot).filter(Bot.id == jwt_identity).first()
+                if not bot:
+                    user = db.query(User).filter(User.id == jwt_identity).first()
+    except Exception as e:
+        import logging
+        logging.warning(f"JWT验证异常: {e}")
+    
+    if not (user or bot or is_admin):
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'UNAUTHORIZED',
+                'message': '请先登录'
+            }
+        }), 401
+    
+    try:
+        branch_uuid = uuid.UUID(branch_id)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'VALIDATION_ERROR',
+                'message': '无效的分支ID格式'
+            }
+        }), 400
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get('segments')
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'VALIDATION_ERROR',
+                'message': '缺少必需字段: segments'
+            }
+        }), 400
+    contents = [item.get('content') if isinstance(item, dict) else item for item in items]
+    
+    # 按条数计入 segment:create 额度，与逐条提交同等限流；剩余额度不足时整批拒绝
+    from src.utils.rate_limit_helper import check_rate_limit
+    rate_limit_result = check_rate_limit(
+        'segment:create',
+        bot_id=bot.id if bot else None,
+        branch_id=branch_uuid,
+        user_id=user.id if user else None,
+        cost=len(contents)
+    )
+    if rate_limit_result:
+        return rate_limit_result
+    
+    if bot:
+        author_id, author_type, author_name = bot.id, 'bot', bot.name
+    elif user:
+        author_id, author_type, author_name = user.id, 'human', user.name or user.email
+    else:
+        author_id, author_type, author_name = None, 'human', 'Admin'
+    
+    try:
+        segments = create_segments_bulk(
+            db=db,
+            branch_id=branch_uuid,
+            bot_id=bot.id if bot else None,
+            contents=contents,
+            author_id=author_id,
+            author_type=author_type,
+            author_name=author_name,
+            is_starter=bool(data.get('is_starter', False))
+        )
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'VALIDATION_ERROR',
+                'message': str(e)
+            }
+        }), 400
+    except Exception as e:
+        import traceback
+        if current_app.config.get('FLASK_DEBUG'):
+            traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'INTERNAL_ERROR',
+                'message': f'批量提交续写失败: {str(e)}'
+            }
+        }), 500
+    
+    # 创作日志与下一个 Bot 的通知已随续写写入发件箱（整批一条事件）
+    from src.services.outbox_service import kick_dispatcher
+    kick_dispatcher(db)
+    
+    response_data = {
+        'segments': [
+            {
+                'id': str(segment.id),
+                'sequence_order': segment.sequence_order,
+                'created_at': segment.created_at.isoformat() if segment.created_at else None
+            }
+            for segment in segments
+        ],
+        'count': len(segments)
+    }
+    _add_next_bot(db, branch_uuid, response_data)
+    
+    return jsonify({
+        'status': 'success',
+        'data': response_data
+    }), 201
+
+
 @segments_bp.route('/branches/<branch_id>/segments', methods=['GET'])
+@conditional_get(_segments_version)
 def list_segments(branch_id):
-    """获取续写列表API（公开，无需认证）"""
+    """
+    获取续写列表API（公开，无需认证）
+    
+    分页方式：
+    - cursor（上一页返回的 next_cursor）或 after_sequence：键集分页，不计算总数
+      （include_total=true 时返回缓存的总数）
+    - offset：偏移分页（兼容旧客户端）
+    """
     try:
         branch_uuid = uuid.UUID(branch_id)
     except ValueError:
@@ -306,44 +435,125 @@ def list_segments(branch_id):
         }), 400
     
     limit = int(request.args.get('limit', 50))
-    offset = int(request.args.get('offset', 0))
+    cursor = request.args.get('cursor')
+    after_sequence = request.args.get('after_sequence')
     
     db: Session = get_db_session()
-    segments, total = get_segments_by_branch(
+    
+    if cursor or after_sequence is not None:
+        try:
+            after = decode_segment_cursor(cursor) if cursor else int(after_sequence)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'error': {
+                    'code': 'VALIDATION_ERROR',
+                    'message': '无效的分页游标'
+                }
+            }), 400
+        
+        segments, next_cursor, has_more = get_segment_page_after(
+            db=db,
+            branch_id=branch_uuid,
+            after_sequence=after,
+            limit=limit
+        )
+        pagination = {
+            'limit': limit,
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }
+        if request.args.get('include_total', 'false').lower() == 'true':
+            pagination['total'] = count_segments_by_branch_cached(db, branch_uuid)
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'segments': segments,
+                'pagination': pagination
+            }
+        }), 200
+    
+    offset = int(request.args.get('offset', 0))
+    segments, total = get_segment_page(
         db=db,
         branch_id=branch_uuid,
         limit=limit,
         offset=offset
     )
-    
-    def _serialize_segment(segment):
-        bot_id_str = str(segment.bot_id) if segment.bot_id else None
-        bot_name = None
-        if segment.bot:
-            bot_name = segment.bot.name
-        elif segment.bot_id:
-            bot_name = f"Bot {bot_id_str[:8]}"
-        bot_model = segment.bot.model if segment.bot else None
-        return {
-            'id': str(segment.id),
-            'content': segment.content,
-            'sequence_order': segment.sequence_order,
-            'bot_id': bot_id_str,
-            'bot_name': bot_name,
-            'bot_model': bot_model,
-            'coherence_score': float(segment.coherence_score) if segment.coherence_score else None,
-            'created_at': segment.created_at.isoformat() if segment.created_at else None,
-        }
 
     return jsonify({
         'status': 'success',
         'data': {
-            'segments': [_serialize_segment(segment) for segment in segments],
+            'segments': segments,
             'pagination': {
                 'limit': limit,
                 'offset': offset,
                 'total': total,
-                'has_more': (offset + len(segments)) < total
+                'has_more': (offset + len(segments)) < total,
+                'next_cursor': encode_segment_cursor(segments[-1]['sequence_order']) if segments else None
             }
         }
     }), 200
+
+
+@segments_bp.route('/branches/<branch_id>/segments/changes', methods=['GET'])
+@conditional_get(_segments_version)
+def list_segment_changes(branch_id):
+    """
+    续写增量同步API（公开，无需认证）
+    
+    查询参数：
+    - since_sequence: 已读到的 sequence_order（默认 0）
+    - since: 或者 ISO 8601 时间戳，返回之后创建的续写段
+    - limit: 单次最多条数（默认 200，最大 500）
+    
+    客户端下次轮询带上返回的 next_since_sequence；没有新内容时 segments 为空。
+    """
+    from datetime import datetime
+    try:
+        branch_uuid = uuid.UUID(branch_id)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'VALIDATION_ERROR',
+                'message': '无效的分支ID格式'
+            }
+        }), 400
+    
+    try:
+        since_sequence = int(request.args.get('since_sequence', 0))
+        since = request.args.get('since')
+        since = datetime.fromisoformat(since.replace('Z', '+00:00')) if since else None
+        limit = min(max(int(request.args.get('limit', 200)), 1), 500)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'VALIDATION_ERROR',
+                'message': '无效的 since_sequence / since / limit 参数'
+            }
+        }), 400
+    
+    db: Session = get_db_session()
+    changes = get_segment_changes(
+        db=db,
+        branch_id=branch_uuid,
+        since_sequence=since_sequence,
+        since=since,
+        limit=limit
+    )
+    if changes is None:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'NOT_FOUND',
+                'message': '分支不存在'
+            }
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'data': changes
+    }), 200
@@ -8,6 +8,7 @@ from src.services.story_service import (
     update_story_style_rules, update_story_metadata
 )
 from src.utils.auth import api_token_auth_required
+from src.utils.conditional import conditional_get
 from src.models.branch import Branch
 from src.models.bot_branch_membership import BotBranchMembership
 
@@ -22,6 +23,32 @@ def get_db_session():
 stories_bp = Blueprint('stories', __name__)
 
 
+def _story_list_version():
+    """故事列表的版本标记（条件 GET）"""
+    from src.services.version_service import story_list_version
+    return story_list_version(
+        get_db_session(),
+        status=request.args.get('status', 'active'),
+        limit=int(request.args.get('limit', 20)),
+        offset=int(request.args.get('offset', 0))
+    )
+
+
+def _story_branches_page():
+    """故事分支列表的分页参数（视图与版本标记共用）"""
+    return {
+        'limit': int(request.args.get('limit', 6)),
+        'offset': int(request.args.get('offset', 0)),
+        'include_all': request.args.get('include_all', 'false').lower() == 'true',
+    }
+
+
+def _story_branches_version(story_id):
+    """故事分支列表的版本标记（条件 GET）"""
+    from src.services.version_service import story_branches_version
+    return story_branches_version(get_db_session(), uuid.UUID(story_id), **_story_branches_page())
+
+
 @stories_bp.route('/stories', methods=['POST'])
 def create_story_endpoint():
     """创建故事API（支持 API Token 或 JWT 认证）"""
@@ -206,6 +233,7 @@ def create_story_endpoint():
 
 
 @stories_bp.route('/stories', methods=['GET'])
+@conditional_get(_story_list_version)
 def list_stories():
     """获取故事列表API（公开，无需认证）"""
     status = request.args.get('status', 'active')
@@ -217,19 +245,6 @@ def list_stories():
     
     story_list = []
     for story in stories:
-        try:
-            branches_count = db.query(Branch).filter(Branch.story_id == story.id).count()
-            bots_count = 0
-            try:
-                bots_count = db.query(BotBranchMembership.bot_id).join(
-                    Branch, BotBranchMembership.branch_id == Branch.id
-                ).filter(Branch.story_id == story.id).distinct().count()
-            except Exception as e:
-                logger.warning(f"获取 bots_count 失败: {e}")
-        except Exception as e:
-            logger.warning(f"获取 branches_count 失败: {e}")
-            branches_count = 0
-        
         story_list.append({
             'id': str(story.id),
             'title': story.title,
@@ -237,8 +252,9 @@ def list_stories():
             'language': story.language,
             'owner_type': story.owner_type,
             'status': story.status,
-            'branches_count': branches_count,
-            'bots_count': bots_count,
+            'branches_count': story.branches_count,
+            'bots_count': story.bots_count,
+            'last_activity_at': story.last_activity_at.isoformat() if story.last_activity_at else None,
             'created_at': story.created_at.isoformat() if story.created_at else None
         })
     
@@ -277,14 +293,6 @@ def get_story_detail(story_id):
             }
         }), 404
     
-    # 获取分支数量
-    branches_count = db.query(Branch).filter(Branch.story_id == story.id).count()
-    
-    # 获取参与该故事所有分支的唯一 Bot 总数
-    bots_count = db.query(BotBranchMembership.bot_id).join(
-        Branch, BotBranchMembership.branch_id == Branch.id
-    ).filter(Branch.story_id == story.id).distinct().count()
-    
     return jsonify({
         'status': 'success',
         'data': {
@@ -298,8 +306,10 @@ def get_story_detail(story_id):
             'max_length': story.max_length,
             'owner_type': story.owner_type,
             'status': story.status,
-            'branches_count': branches_count,
-            'bots_count': bots_count,
+            'branches_count': story.branches_count,
+            'segments_count': story.segments_count,
+            'bots_count': story.bots_count,
+            'last_activity_at': story.last_activity_at.isoformat() if story.last_activity_at else None,
             'created_at': story.created_at.isoformat() if story.created_at else None
         }
     }), 200
@@ -371,6 +381,7 @@ def create_branch(story_id):
 
 
 @stories_bp.route('/stories/<story_id>/branches', methods=['GET'])
+@conditional_get(_story_branches_version)
 def list_branches(story_id):
     """获取故事的所有分支（公开）"""
     try:
@@ -384,24 +395,32 @@ def list_branches(story_id):
             }
         }), 400
     
+    try:
+        page = _story_branches_page()
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'code': 'VALIDATION_ERROR',
+                'message': 'limit 和 offset 必须为整数'
+            }
+        }), 400
+    
     from src.services.branch_service import get_branches_by_story
-    from src.services.segment_service import count_segments_by_branch
     
     db: Session = get_db_session()
-    branches, _ = get_branches_by_story(db, story_uuid)
+    branches, _ = get_branches_by_story(db, story_uuid, **page)
     
     # 为每个分支添加统计信息
     branch_data = []
     for b in branches:
-        segments_count = count_segments_by_branch(db, b.id)
-        # 简化：bots_count 从分支关联表获取
         branch_data.append({
             'id': str(b.id),
             'title': b.title,
             'parent_branch_id': str(b.parent_branch) if b.parent_branch else None,
             'created_at': b.created_at.isoformat() if b.created_at else None,
-            'segments_count': segments_count,
-            'bots_count': 1,  # 简化：至少有一个 Bot（创建者）
+            'segments_count': b.segments_count,
+            'bots_count': b.active_bots_count,
         })
     
     return jsonify({
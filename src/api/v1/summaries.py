@@ -5,6 +5,7 @@ import uuid
 from src.database import get_db
 from src.services.summary_service import get_branch_summary, generate_summary
 from src.services.branch_service import get_branch_by_id, update_branch_summary
+from src.utils.conditional import conditional_get
 
 
 def get_db_session():
@@ -17,7 +18,16 @@ def get_db_session():
 summaries_bp = Blueprint('summaries', __name__)
 
 
+def _summary_version(branch_id):
+    """分支摘要的版本标记（条件 GET）；强制刷新时不做条件处理"""
+    if request.args.get('force_refresh', 'false').lower() == 'true':
+        return None
+    from src.services.version_service import branch_summary_version
+    return branch_summary_version(get_db_session(), uuid.UUID(branch_id))
+
+
 @summaries_bp.route('/branches/<branch_id>/summary', methods=['GET'])
+@conditional_get(_summary_version)
 def get_branch_summary_endpoint(branch_id):
     """获取分支摘要API"""
     try:
@@ -18,7 +18,11 @@ def create_app(config_class=Config):
     init_jwt(app)
     
     # 初始化速率限制器
-    from src.utils.rate_limit import limiter
+    # 手动检查的限流头需在 Flask-Limiter 之后写入（after_request 逆序执行，故先注册）
+    from src.utils.rate_limit_helper import init_rate_limit_headers
+    init_rate_limit_headers(app)
+    from src.utils.rate_limit import limiter, configure_limiter_storage
+    configure_limiter_storage(app)
     limiter.init_app(app)
     
     # 启用CORS（允许多个域名）
@@ -1,5 +1,6 @@
 """应用配置"""
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +15,44 @@ class Config:
     REDIS_HOST = os.getenv('REDIS_HOST', '')
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
     REDIS_DB = int(os.getenv('REDIS_DB', 0))
+    REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 2))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+    
+    # 缓存后端：auto（有 REDIS_HOST 用 redis，否则 memory）| redis | memory | none
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'auto')
+    CACHE_MEMORY_MAX_SIZE = int(os.getenv('CACHE_MEMORY_MAX_SIZE', 10000))
+    CACHE_MEMORY_MAX_TTL = int(os.getenv('CACHE_MEMORY_MAX_TTL', 60))  # 进程内后端不跨 worker 失效，限制条目寿命
+    
+    # 缓存值序列化：auto（已安装 orjson 时用 orjson）| orjson | json；超过阈值（字节）的值 zlib 压缩，0 表示不压缩
+    CACHE_SERIALIZER = os.getenv('CACHE_SERIALIZER', 'auto')
+    CACHE_COMPRESS_THRESHOLD = int(os.getenv('CACHE_COMPRESS_THRESHOLD', 1024))
+    CACHE_COMPRESS_LEVEL = int(os.getenv('CACHE_COMPRESS_LEVEL', 1))
+    
+    # 进程内 L1 缓存（位于 Redis 之前，TTL 为 0 时关闭）
+    CACHE_L1_MAX_SIZE = int(os.getenv('CACHE_L1_MAX_SIZE', 1024))
+    CACHE_L1_TTL = int(os.getenv('CACHE_L1_TTL', 5))
+    CACHE_INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+    
+    # 缓存熔断器：连续失败次数达到阈值后断开，经过恢复时间后放行一次探测
+    CACHE_BREAKER_FAILURE_THRESHOLD = int(os.getenv('CACHE_BREAKER_FAILURE_THRESHOLD', 3))
+    CACHE_BREAKER_RECOVERY_TIMEOUT = float(os.getenv('CACHE_BREAKER_RECOVERY_TIMEOUT', 10))
+    
+    # 速率限制存储：留空时自动选择（有 REDIS_HOST 用 failover://，即 Redis 不可用时退回本机 SQLite；
+    # 否则 sqlite:///RATE_LIMIT_SQLITE_PATH，同一主机的 worker 共享计数）
+    RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', '')
+    RATE_LIMIT_SQLITE_PATH = os.getenv(
+        'RATE_LIMIT_SQLITE_PATH',
+        os.path.join(tempfile.gettempdir(), 'inkpath_rate_limits.db')
+    )
+    
+    # 公开读请求的 worker 内预过滤：每个键最多本地放行 N-1 次或 N 秒后再与限流存储对账（N<=1 时关闭）
+    RATE_LIMIT_READ_BATCH_SIZE = int(os.getenv('RATE_LIMIT_READ_BATCH_SIZE', 10))
+    RATE_LIMIT_READ_FLUSH_INTERVAL = float(os.getenv('RATE_LIMIT_READ_FLUSH_INTERVAL', 0.1))
+    
+    # 认证主体缓存（进程内，TTL 为 0 时关闭）
+    AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 60))
+    AUTH_CACHE_MAX_SIZE = int(os.getenv('AUTH_CACHE_MAX_SIZE', 2048))
     
     # JWT
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -43,6 +82,19 @@ class Config:
     SUMMARY_TRIGGER_COUNT = int(os.getenv('SUMMARY_TRIGGER_COUNT', 5))  # 每N个续写后生成摘要
     SUMMARY_MAX_SEGMENTS = int(os.getenv('SUMMARY_MAX_SEGMENTS', 20))  # 生成摘要时最多包含的段数
     
+    # 批量提交续写：单次请求最多的段数
+    SEGMENT_BULK_MAX_SIZE = int(os.getenv('SEGMENT_BULK_MAX_SIZE', 100))
+    
+    # 发件箱分发：thread（worker 内后台线程，提交后唤醒 + 定时轮询）| inline（请求内提交后立即处理）
+    # | cron（只由 /cron/dispatch-outbox 处理）
+    OUTBOX_DISPATCH_MODE = os.getenv('OUTBOX_DISPATCH_MODE', 'thread')
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+    # 已处理事件的保留天数（由 cleanup_expired_data 清理）；failed 保留更久以便排查
+    OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 7))
+    OUTBOX_FAILED_RETENTION_DAYS = int(os.getenv('OUTBOX_FAILED_RETENTION_DAYS', 30))
+    
     # Feature Flags
     ENABLE_COHERENCE_CHECK = False  # 禁用，避免超时
     COHERENCE_THRESHOLD = int(os.getenv('COHERENCE_THRESHOLD', 4))
@@ -11,6 +11,7 @@ from src.models.human_branch_membership import HumanBranchMembership
 from src.models.vote import Vote
 from src.models.comment import Comment
 from src.models.bot_reputation_log import BotReputationLog
+from src.models.outbox_event import OutboxEvent
 
 __all__ = [
     'User',
@@ -25,4 +26,5 @@ __all__ = [
     'Vote',
     'Comment',
     'BotReputationLog',
+    'OutboxEvent',
 ]
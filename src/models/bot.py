@@ -14,7 +14,7 @@ class Bot(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
     model = Column(String, nullable=False)  # 'claude-sonnet-4', 'gpt-4o', etc.
-    api_key_hash = Column(Text, nullable=False, unique=True, index=True)  # bcrypt加密
+    api_key_hash = Column(Text, nullable=False, unique=True, index=True)  # SHA256摘要（旧数据为bcrypt，认证通过后自动迁移）
     webhook_url = Column(Text, nullable=True)
     language = Column(String, default='zh')  # 'zh' | 'en'，Bot主要使用的语言
     owner_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
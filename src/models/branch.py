@@ -2,7 +2,7 @@
 import uuid
 from datetime import datetime
 from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from src.database import Base
 
@@ -18,11 +18,20 @@ class Branch(Base):
     description = Column(Text, nullable=True)
     creator_bot_id = Column(UUID(as_uuid=True), ForeignKey('bots.id', ondelete='SET NULL'), nullable=True)
     fork_at_segment_id = Column(UUID(as_uuid=True), ForeignKey('segments.id', ondelete='SET NULL'), nullable=True)
+    # 物化祖先路径（根 -> 父），每项 {"branch_id": ..., "up_to_sequence": ...}，
+    # 表示继承该祖先分支序号不超过 up_to_sequence 的续写段；根分支为空列表
+    lineage = Column(JSONB, nullable=True)
     status = Column(String, default='active', index=True)  # 'active' | 'archived' | 'merged'
     current_summary = Column(Text, nullable=True)
     summary_updated_at = Column(DateTime(timezone=True), nullable=True)
     summary_covers_up_to = Column(Integer, nullable=True)
+    # 反规范化计数（写入时在同一事务内维护，counter_service.reconcile_counters 定期校正）
+    segments_count = Column(Integer, nullable=False, default=0, server_default='0')
+    active_bots_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_segment_at = Column(DateTime(timezone=True), nullable=True)
+    last_sequence_order = Column(Integer, nullable=False, default=0, server_default='0')
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # 关系
     story = relationship('Story', backref='branches')
@@ -0,0 +1,28 @@
+"""事务性发件箱模型"""
+import uuid
+from datetime import datetime
+from sqlalchemy import Column, String, Text, DateTime, Integer, Index
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from src.database import Base
+
+
+class OutboxEvent(Base):
+    """发件箱事件表（与业务数据同一事务写入，由后台分发器处理）"""
+    __tablename__ = 'outbox_events'
+    __table_args__ = (
+        Index('idx_outbox_status_available', 'status', 'available_at'),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    event_type = Column(String, nullable=False)  # 'segment.created'
+    aggregate_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # 如分支ID
+    payload = Column(JSONB, nullable=False)
+    status = Column(String, nullable=False, default='pending')  # 'pending' | 'done' | 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime(timezone=True), default=datetime.utcnow)  # 重试退避：此时间之后才可处理
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.event_type} {self.status}>'
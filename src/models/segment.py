@@ -1,7 +1,7 @@
 """续写段模型"""
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Text, Numeric, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, Numeric, Integer, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from src.database import Base
@@ -10,6 +10,10 @@ from src.database import Base
 class Segment(Base):
     """续写段表"""
     __tablename__ = 'segments'
+    __table_args__ = (
+        # 同一分支内序号唯一（由 branches.last_sequence_order 原子分配）
+        UniqueConstraint('branch_id', 'sequence_order', name='uq_segments_branch_sequence'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     branch_id = Column(UUID(as_uuid=True), ForeignKey('branches.id', ondelete='CASCADE'), nullable=False, index=True)
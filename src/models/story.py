@@ -22,6 +22,11 @@ class Story(Base):
     owner_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # 可为NULL（Bot创建时）
     owner_type = Column(String, nullable=False)  # 'human' | 'bot'
     status = Column(String, default='active', index=True)  # 'active' | 'archived'
+    # 反规范化汇总（写入时维护，counter_service.reconcile_counters 定期校正）
+    branches_count = Column(Integer, nullable=False, default=0, server_default='0')
+    segments_count = Column(Integer, nullable=False, default=0, server_default='0')
+    bots_count = Column(Integer, nullable=False, default=0, server_default='0')  # 参与各分支的去重 Bot 数
+    last_activity_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -99,6 +99,54 @@ def init_scheduler(app: Flask):
         replace_existing=True
     )
     
+    # 每分钟处理发件箱事件（兜底）
+    def dispatch_outbox_job():
+        """处理发件箱事件任务"""
+        try:
+            url = f"{base_url}/api/v1/cron/dispatch-outbox"
+            response = requests.post(
+                url,
+                headers={'Authorization': f'Bearer {cron_secret}'},
+                timeout=60
+            )
+            if response.status_code != 200:
+                app.logger.error(f"发件箱分发任务执行失败: {response.status_code} - {response.text}")
+        except Exception as e:
+            app.logger.error(f"发件箱分发任务执行异常: {e}")
+    
+    scheduler.add_job(
+        func=dispatch_outbox_job,
+        trigger=CronTrigger(minute='*'),  # 每分钟
+        id='dispatch_outbox',
+        name='处理发件箱事件',
+        replace_existing=True
+    )
+    
+    # 每天校正分支/故事计数
+    def reconcile_counters_job():
+        """校正计数任务"""
+        try:
+            url = f"{base_url}/api/v1/cron/reconcile-counters"
+            response = requests.post(
+                url,
+                headers={'Authorization': f'Bearer {cron_secret}'},
+                timeout=300
+            )
+            if response.status_code == 200:
+                app.logger.info(f"计数校正任务执行成功: {response.json()}")
+            else:
+                app.logger.error(f"计数校正任务执行失败: {response.status_code} - {response.text}")
+        except Exception as e:
+            app.logger.error(f"计数校正任务执行异常: {e}")
+    
+    scheduler.add_job(
+        func=reconcile_counters_job,
+        trigger=CronTrigger(hour=3, minute=0),  # 每天凌晨3点
+        id='reconcile_counters',
+        name='校正分支计数',
+        replace_existing=True
+    )
+    
     scheduler.start()
     app.logger.info("定时任务调度器已启动")
     
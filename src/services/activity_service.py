@@ -8,18 +8,20 @@ from src.models.segment import Segment
 from src.models.bot_branch_membership import BotBranchMembership
 from src.models.vote import Vote
 from src.services.vote_service import calculate_score
-from redis import Redis
-from src.config import Config
+from src.utils.redis_client import get_request_redis
+
+
+# 活跃度得分缓存时间（秒）
+ACTIVITY_SCORE_TTL = 3600
 
 
 def get_redis_connection():
-    """获取Redis连接"""
-    return Redis(
-        host=Config.REDIS_HOST,
-        port=Config.REDIS_PORT,
-        db=Config.REDIS_DB,
-        decode_responses=True
-    )
+    """获取Redis连接（共享连接池，同一请求内复用）"""
+    return get_request_redis()
+
+
+def _activity_score_key(branch_id) -> str:
+    return f"branch:{branch_id}:activity_score"
 
 
 def calculate_activity_score(
@@ -76,29 +78,51 @@ def get_activity_score_cached(
     Returns:
         活跃度得分
     """
-    redis_key = f"branch:{branch_id}:activity_score"
+    return get_activity_scores_cached(db, [branch_id])[branch_id]
+
+
+def get_activity_scores_cached(
+    db: Session,
+    branch_ids: List[uuid.UUID]
+) -> Dict[uuid.UUID, float]:
+    """
+    批量获取活跃度得分（带缓存）
     
-    try:
-        redis_client = get_redis_connection()
-        cached_score = redis_client.get(redis_key)
-        
-        if cached_score:
-            return float(cached_score)
-    except Exception as e:
-        import logging
-        logging.warning(f"获取缓存活跃度得分失败: {e}")
+    一次 MGET 读取所有分支的缓存得分，未命中的分支计算后用一个 pipeline 回写。
+    
+    Returns:
+        {branch_id: 活跃度得分}
+    """
+    import logging
+    scores: Dict[uuid.UUID, float] = {}
+    if not branch_ids:
+        return scores
+    
+    redis_client = get_redis_connection()
+    if redis_client is not None:
+        try:
+            cached_scores = redis_client.mget([_activity_score_key(bid) for bid in branch_ids])
+            for bid, cached_score in zip(branch_ids, cached_scores):
+                if cached_score:
+                    scores[bid] = float(cached_score)
+        except Exception as e:
+            logging.warning(f"获取缓存活跃度得分失败: {e}")
     
     # 缓存未命中，计算并缓存
-    score = calculate_activity_score(db, branch_id)
+    missing = [bid for bid in branch_ids if bid not in scores]
+    for bid in missing:
+        scores[bid] = calculate_activity_score(db, bid)
     
-    try:
-        redis_client = get_redis_connection()
-        redis_client.setex(redis_key, 3600, str(score))  # 缓存1小时
-    except Exception as e:
-        import logging
-        logging.warning(f"缓存活跃度得分失败: {e}")
+    if missing and redis_client is not None:
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for bid in missing:
+                pipe.setex(_activity_score_key(bid), ACTIVITY_SCORE_TTL, str(scores[bid]))  # 缓存1小时
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"缓存活跃度得分失败: {e}")
     
-    return score
+    return scores
 
 
 def update_activity_score_cache(
@@ -115,10 +139,11 @@ def update_activity_score_cache(
     """
     score = calculate_activity_score(db, branch_id)
     
+    redis_client = get_redis_connection()
+    if redis_client is None:
+        return
     try:
-        redis_client = get_redis_connection()
-        redis_key = f"branch:{branch_id}:activity_score"
-        redis_client.setex(redis_key, 3600, str(score))  # 缓存1小时
+        redis_client.setex(_activity_score_key(branch_id), ACTIVITY_SCORE_TTL, str(score))  # 缓存1小时
     except Exception as e:
         import logging
         logging.warning(f"更新活跃度得分缓存失败: {e}")
@@ -9,6 +9,12 @@ from src.models.user import User
 DEFAULT_TOKEN_LIFETIME = timedelta(days=30)
 
 
+def _invalidate_cached_principal(user_id) -> None:
+    """清除认证缓存中该用户的旧凭证"""
+    from src.utils.auth import invalidate_user_principal
+    invalidate_user_principal(user_id)
+
+
 def generate_api_token() -> str:
     """生成 API Token"""
     return secrets.token_urlsafe(32)
@@ -35,6 +41,7 @@ def generate_user_api_token(
     
     db.commit()
     db.refresh(user)
+    _invalidate_cached_principal(user.id)
     
     return user, token
 
@@ -49,6 +56,7 @@ def revoke_user_api_token(db: Session, user_id: str) -> bool:
     user.api_token_expires_at = None
     
     db.commit()
+    _invalidate_cached_principal(user.id)
     return True
 
 
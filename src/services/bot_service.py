@@ -97,16 +97,47 @@ def get_bot_by_name(db: Session, bot_name: str):
 
 
 def authenticate_bot(db: Session, api_key: str):
-    """通过API Key认证Bot"""
+    """
+    通过API Key认证Bot
+    
+    先按 SHA256 摘要命中 bots.api_key_hash 唯一索引（O(1)）；
+    未命中时仅在旧版 bcrypt 哈希中回退校验，校验通过后立即迁移为 SHA256，
+    之后同一 Key 的认证都走索引。
+    """
     Bot = _get_bot_model()
     
+    if not api_key:
+        return None
+    
     try:
-        bots = db.query(Bot).filter(Bot.status == 'active').all()
+        bot = db.query(Bot).filter(
+            Bot.api_key_hash == hash_api_key(api_key),
+            Bot.status == 'active'
+        ).first()
+        if bot:
+            return bot
         
-        for bot in bots:
+        # 回退：只扫描尚未迁移的 bcrypt 哈希
+        legacy_bots = db.query(Bot).filter(
+            Bot.api_key_hash.like('$2%'),
+            Bot.status == 'active'
+        ).all()
+        
+        for bot in legacy_bots:
             if verify_api_key(api_key, bot.api_key_hash):
+                _migrate_legacy_hash(db, bot, api_key)
                 return bot
     except Exception as e:
         logger.error(f"Bot认证失败: {e}")
     
     return None
+
+
+def _migrate_legacy_hash(db: Session, bot, api_key: str) -> None:
+    """将 bcrypt 哈希升级为 SHA256 摘要（失败不影响本次认证）"""
+    try:
+        bot.api_key_hash = hash_api_key(api_key)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"迁移Bot API Key哈希失败: {e}")
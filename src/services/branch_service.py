@@ -8,7 +8,11 @@ from src.models.story import Story
 from src.models.segment import Segment
 from src.models.bot_branch_membership import BotBranchMembership
 from src.models.bot import Bot
-from src.utils.cache import cache_service, cache_key
+from src.utils.cache import cache_service, cache_key, cached
+from src.services.counter_service import (
+    allocate_sequence_orders, record_branch_created, record_membership_change,
+    record_segments_added
+)
 
 
 def create_branch(
@@ -48,10 +52,12 @@ def create_branch(
         description=description,
         creator_bot_id=creator_bot_id,
         fork_at_segment_id=fork_at_segment_id,
+        lineage=build_branch_lineage(db, parent_branch_id, fork_at_segment_id),
         status='active'
     )
     
     db.add(branch)
+    record_branch_created(db, story_id)
     db.commit()
     db.refresh(branch)
     
@@ -77,6 +83,7 @@ def create_branch(
             join_order=existing_count + 1
         )
         db.add(membership)
+        record_membership_change(db, branch.id, 1, story_id=story_id)
         db.commit()
     
     # 分支创建时自动生成摘要
@@ -150,9 +157,10 @@ def create_branch_with_initial_segment(
             branch_id=branch.id,
             bot_id=creator_bot_id,
             content=initial_segment_content,
-            sequence_order=1
+            sequence_order=allocate_sequence_orders(db, branch.id)
         )
         db.add(segment)
+        record_segments_added(db, branch.id, story_id=story_id)
         db.commit()
         db.refresh(segment)
         
@@ -161,6 +169,45 @@ def create_branch_with_initial_segment(
     return branch, None
 
 
+def build_branch_lineage(
+    db: Session,
+    parent_branch_id: Optional[uuid.UUID],
+    fork_at_segment_id: Optional[uuid.UUID] = None
+) -> List[Dict[str, Any]]:
+    """
+    计算新分支的物化祖先路径
+    
+    父分支的路径加上父分支自身一项：指定分叉点时继承到分叉段为止，
+    否则继承父分支当前的全部续写段。分叉段所在分支视为父分支。
+    
+    Returns:
+        根 -> 父 的祖先列表
+    """
+    up_to_sequence = None
+    if fork_at_segment_id:
+        fork_segment = db.query(Segment.branch_id, Segment.sequence_order).filter(
+            Segment.id == fork_at_segment_id
+        ).first()
+        if fork_segment:
+            parent_branch_id = parent_branch_id or fork_segment.branch_id
+            up_to_sequence = fork_segment.sequence_order
+    
+    if not parent_branch_id:
+        return []
+    
+    parent = db.query(Branch.lineage, Branch.last_sequence_order).filter(
+        Branch.id == parent_branch_id
+    ).first()
+    if not parent:
+        return []
+    
+    if up_to_sequence is None:
+        up_to_sequence = parent.last_sequence_order or 0
+    return list(parent.lineage or []) + [
+        {'branch_id': str(parent_branch_id), 'up_to_sequence': up_to_sequence}
+    ]
+
+
 def get_branch_by_id(db: Session, branch_id: uuid.UUID) -> Optional[Branch]:
     """根据ID获取分支"""
     return db.query(Branch).filter(Branch.id == branch_id).first()
@@ -205,55 +252,89 @@ def get_branches_by_story(
     return branches, total
 
 
-def get_branch_tree(db: Session, story_id: uuid.UUID) -> List[Dict[str, Any]]:
+# 分支树邻接表的缓存时间（秒）；挂在故事代数下，新建分支时随 invalidate_story 失效
+BRANCH_TREE_TTL = 600
+# 过期后的宽限期（秒）：代数未变时内容仍有效，由一个调用方重新查询，其余直接返回旧值
+BRANCH_TREE_STALE_TTL = 300
+
+
+@cached(ttl=BRANCH_TREE_TTL, key_prefix='branches:tree', stale_ttl=BRANCH_TREE_STALE_TTL, skip_args=1)
+def _get_branch_tree_nodes(db: Session, story_id: uuid.UUID) -> List[Dict[str, Any]]:
     """
-    获取分支树（递归查询）
+    获取故事所有活跃分支的扁平节点列表（一条查询，带缓存）
+    
+    缓存未命中时并发请求合并为一次查询（single-flight）。
+    
+    Returns:
+        按创建时间排序的节点列表（不含 children）
+    """
+    rows = db.query(
+        Branch.id,
+        Branch.title,
+        Branch.description,
+        Branch.parent_branch,
+        Branch.created_at
+    ).filter(
+        Branch.story_id == story_id,
+        Branch.status == 'active'
+    ).order_by(Branch.created_at.asc()).all()
+    
+    nodes = [
+        {
+            'id': str(row.id),
+            'title': row.title,
+            'description': row.description,
+            'parent_branch_id': str(row.parent_branch) if row.parent_branch else None,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+        }
+        for row in rows
+    ]
+    return nodes
+
+
+def get_branch_tree(
+    db: Session,
+    story_id: uuid.UUID,
+    max_depth: Optional[int] = None,
+    root_branch_id: Optional[uuid.UUID] = None
+) -> List[Dict[str, Any]]:
+    """
+    获取分支树
+    
+    一条查询取出故事的全部活跃分支，在内存中按 parent_branch 建邻接表后 O(n) 组装。
+    
+    Args:
+        max_depth: 最大展开层数（1 表示只返回第一层）；被截断的节点 children 为空，
+            可通过 children_count 判断并用 root_branch_id 按需加载子树
+        root_branch_id: 只返回该分支的子树（其子分支列表）；默认从根分支开始
     
     Returns:
         分支树结构列表
     """
-    def build_tree(branch_id: Optional[uuid.UUID] = None, visited: set = None) -> List[Dict[str, Any]]:
-        """递归构建分支树"""
-        if visited is None:
-            visited = set()
-        
-        if branch_id and branch_id in visited:
-            # 循环引用防护
-            return []
-        
-        if branch_id:
-            visited.add(branch_id)
-        
-        # 查询子分支
-        if branch_id:
-            children = db.query(Branch).filter(
-                Branch.story_id == story_id,
-                Branch.parent_branch == branch_id,
-                Branch.status == 'active'
-            ).all()
-        else:
-            # 根分支（没有parent_branch的分支）
-            children = db.query(Branch).filter(
-                Branch.story_id == story_id,
-                Branch.parent_branch.is_(None),
-                Branch.status == 'active'
-            ).all()
-        
+    nodes = _get_branch_tree_nodes(db, story_id)
+    
+    children_of: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for node in nodes:
+        children_of.setdefault(node['parent_branch_id'], []).append(node)
+    
+    def build(parent_id: Optional[str], depth: int, visited: set) -> List[Dict[str, Any]]:
         result = []
-        for branch in children:
-            branch_data = {
-                'id': str(branch.id),
-                'title': branch.title,
-                'description': branch.description,
-                'parent_branch_id': str(branch.parent_branch) if branch.parent_branch else None,
-                'created_at': branch.created_at.isoformat() if branch.created_at else None,
-                'children': build_tree(branch.id, visited.copy())
-            }
+        for node in children_of.get(parent_id, []):
+            # 循环引用防护
+            if node['id'] in visited:
+                continue
+            child_ids = children_of.get(node['id'], [])
+            branch_data = dict(node, children_count=len(child_ids))
+            if max_depth is None or depth < max_depth:
+                visited.add(node['id'])
+                branch_data['children'] = build(node['id'], depth + 1, visited)
+            else:
+                branch_data['children'] = []
             result.append(branch_data)
-        
         return result
     
-    return build_tree()
+    start = str(root_branch_id) if root_branch_id else None
+    return build(start, 1, {start} if start else set())
 
 
 def join_branch(
@@ -294,6 +375,7 @@ def join_branch(
     )
     
     db.add(membership)
+    record_membership_change(db, branch_id, 1, story_id=branch.story_id)
     db.commit()
     db.refresh(membership)
     
@@ -337,6 +419,7 @@ def leave_branch(
         return False
     
     db.delete(membership)
+    record_membership_change(db, branch_id, -1)
     db.commit()
     
     return True
@@ -349,43 +432,33 @@ def get_next_bot_in_queue(db: Session, branch_id: uuid.UUID) -> Optional[Bot]:
     轮次计算逻辑：
     1. 如果没有续写段，返回第一个加入的Bot
     2. 如果有续写段，计算当前应该轮到谁：
-       - 获取最后一个续写段的Bot
        - 计算: (总段数 - 1) % Bot数量 = 当前索引
        - 下一位是 (currentIndex + 1) % Bot数量
     
+    总段数读取 Branch.segments_count 计数器，不加载续写段；
+    共两次查询（计数 + 连接 Bot 的成员定位），开销不随分支长度增长。
+    
     Returns:
         Bot对象或None
     """
-    # 获取所有参与的Bot（按join_order排序）
-    members = db.query(BotBranchMembership).filter(
+    # 段数取分支计数器，成员数按成员表计数（与分支长度无关）
+    member_count = db.query(func.count(BotBranchMembership.bot_id)).filter(
         BotBranchMembership.branch_id == branch_id
-    ).order_by(BotBranchMembership.join_order.asc()).all()
-    
-    if not members:
+    ).scalar_subquery()
+    row = db.query(Branch.segments_count, member_count).filter(Branch.id == branch_id).first()
+    if not row or not row[1]:
         return None
     
-    # 获取当前分支的所有续写段
-    segments = db.query(Segment).filter(
-        Segment.branch_id == branch_id
-    ).order_by(Segment.sequence_order.desc()).all()
+    total_segments, total_members = row[0] or 0, row[1]
     
-    if not segments:
-        # 没有续写段，返回第一个加入的Bot
-        first_member = members[0]
-        return db.query(Bot).filter(Bot.id == first_member.bot_id).first()
+    # 当前索引 (总段数 - 1) % Bot数量，下一位即 总段数 % Bot数量；没有续写段时为第一个加入的Bot
+    next_index = total_segments % total_members
     
-    # 获取最后一个续写段的sequence_order
-    last_segment = segments[0]
-    
-    # 计算当前应该轮到谁: (总段数 - 1) % Bot数量 = 当前索引
-    total_segments = len(segments)
-    current_index = (total_segments - 1) % len(members)
-    
-    # 下一位是 (currentIndex + 1) % Bot数量
-    next_index = (current_index + 1) % len(members)
-    next_member = members[next_index]
-    
-    return db.query(Bot).filter(Bot.id == next_member.bot_id).first()
+    return db.query(Bot).join(
+        BotBranchMembership, BotBranchMembership.bot_id == Bot.id
+    ).filter(
+        BotBranchMembership.branch_id == branch_id
+    ).order_by(BotBranchMembership.join_order.asc()).offset(next_index).limit(1).first()
 
 
 def update_branch_summary(
@@ -400,8 +473,7 @@ def update_branch_summary(
     from datetime import datetime
     branch.current_summary = current_summary
     branch.summary_updated_at = datetime.utcnow()
-    all_count = db.query(Segment).filter(Segment.branch_id == branch_id).count()
-    branch.summary_covers_up_to = all_count
+    branch.summary_covers_up_to = branch.segments_count
     db.commit()
     db.refresh(branch)
     cache_service.invalidate_story(branch.story_id)
@@ -0,0 +1,271 @@
+"""分支/故事反规范化计数维护服务
+
+写路径在提交前调用 record_*，计数与业务数据在同一事务中更新；
+reconcile_counters 按实际数据重新计算，用于定时校正和迁移后回填。
+"""
+import uuid
+from datetime import datetime
+from typing import Optional, Dict, Any
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, select, update
+from src.models.branch import Branch
+from src.models.story import Story
+from src.models.segment import Segment
+from src.models.bot_branch_membership import BotBranchMembership
+
+# 校正任务分批读取 / 批量更新的行数
+RECONCILE_BATCH_SIZE = 1000
+
+
+def _story_id_of(db: Session, branch_id: uuid.UUID, story_id: Optional[uuid.UUID]):
+    """调用方未提供 story_id 时使用子查询（不额外往返）"""
+    if story_id is not None:
+        return story_id
+    return select(Branch.story_id).where(Branch.id == branch_id).scalar_subquery()
+
+
+def allocate_sequence_orders(db: Session, branch_id: uuid.UUID, count: int = 1) -> int:
+    """
+    原子地为分支分配 count 个连续的 sequence_order（不提交）
+    
+    UPDATE ... RETURNING 在一条语句内完成自增并取回新值，行锁持有到事务结束，
+    同一分支的并发写入在这里排队，不会拿到相同序号。
+    
+    Returns:
+        分配到的最后一个序号（第一个为 返回值 - count + 1）
+    """
+    last = db.execute(
+        update(Branch)
+        .where(Branch.id == branch_id)
+        .values(last_sequence_order=Branch.last_sequence_order + count)
+        .returning(Branch.last_sequence_order)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if last is None:
+        raise ValueError("分支不存在")
+    return last
+
+
+def resync_sequence_counter(db: Session, branch_id: uuid.UUID) -> int:
+    """
+    将分支的 last_sequence_order 校正为实际最大序号（不提交）
+    
+    计数器落后于数据（绕过写路径直接插入的续写段）导致唯一约束冲突时调用。
+    """
+    max_order = db.query(func.max(Segment.sequence_order)).filter(
+        Segment.branch_id == branch_id
+    ).scalar() or 0
+    db.query(Branch).filter(
+        Branch.id == branch_id,
+        Branch.last_sequence_order < max_order
+    ).update({Branch.last_sequence_order: max_order}, synchronize_session=False)
+    return max_order
+
+
+def record_segments_added(
+    db: Session,
+    branch_id: uuid.UUID,
+    count: int = 1,
+    last_sequence_order: Optional[int] = None,
+    story_id: Optional[uuid.UUID] = None,
+    created_at: Optional[datetime] = None
+):
+    """
+    续写段写入后累加分支与故事计数（不提交）
+    
+    序号已通过 allocate_sequence_orders 分配时无需传 last_sequence_order。
+    """
+    now = created_at or datetime.utcnow()
+    values = {
+        Branch.segments_count: Branch.segments_count + count,
+        Branch.last_segment_at: now,
+    }
+    if last_sequence_order is not None:
+        values[Branch.last_sequence_order] = case(
+            (Branch.last_sequence_order < last_sequence_order, last_sequence_order),
+            else_=Branch.last_sequence_order
+        )
+    db.query(Branch).filter(Branch.id == branch_id).update(values, synchronize_session=False)
+    db.query(Story).filter(Story.id == _story_id_of(db, branch_id, story_id)).update({
+        Story.segments_count: Story.segments_count + count,
+        Story.last_activity_at: now,
+        # 汇总列变化不算故事内容更新
+        Story.updated_at: Story.updated_at,
+    }, synchronize_session=False)
+
+
+def record_segments_removed(
+    db: Session,
+    branch_id: uuid.UUID,
+    count: int = 1,
+    story_id: Optional[uuid.UUID] = None
+):
+    """
+    续写段删除后扣减计数（不提交）
+    
+    last_sequence_order 不回退，序号分配始终向前。
+    """
+    db.query(Branch).filter(Branch.id == branch_id).update({
+        Branch.segments_count: case(
+            (Branch.segments_count > count, Branch.segments_count - count),
+            else_=0
+        ),
+    }, synchronize_session=False)
+    db.query(Story).filter(Story.id == _story_id_of(db, branch_id, story_id)).update({
+        Story.segments_count: case(
+            (Story.segments_count > count, Story.segments_count - count),
+            else_=0
+        ),
+        Story.updated_at: Story.updated_at,
+    }, synchronize_session=False)
+
+
+def record_branch_created(db: Session, story_id: uuid.UUID):
+    """分支创建后累加故事分支数（不提交）"""
+    db.query(Story).filter(Story.id == story_id).update({
+        Story.branches_count: Story.branches_count + 1,
+        Story.last_activity_at: datetime.utcnow(),
+        Story.updated_at: Story.updated_at,
+    }, synchronize_session=False)
+
+
+def record_membership_change(
+    db: Session,
+    branch_id: uuid.UUID,
+    delta: int,
+    story_id: Optional[uuid.UUID] = None
+):
+    """
+    Bot 加入（delta=1）或离开（delta=-1）分支后更新计数（不提交）
+    
+    故事的 bots_count 是跨分支去重数，无法增量维护，这里按该故事的成员关系重新统计。
+    """
+    db.query(Branch).filter(Branch.id == branch_id).update({
+        Branch.active_bots_count: case(
+            (Branch.active_bots_count + delta > 0, Branch.active_bots_count + delta),
+            else_=0
+        ),
+    }, synchronize_session=False)
+    
+    # 会话未开启 autoflush，先写出新增/删除的成员关系再统计
+    db.flush()
+    story_id = _story_id_of(db, branch_id, story_id)
+    bots_count = select(func.count(func.distinct(BotBranchMembership.bot_id))).join(
+        Branch, BotBranchMembership.branch_id == Branch.id
+    ).where(Branch.story_id == story_id).scalar_subquery()
+    db.query(Story).filter(Story.id == story_id).update({
+        Story.bots_count: bots_count,
+        Story.updated_at: Story.updated_at,
+    }, synchronize_session=False)
+
+
+def reconcile_counters(db: Session, story_id: Optional[uuid.UUID] = None) -> Dict[str, Any]:
+    """
+    按实际数据重新计算计数并修正不一致的行（定时任务 / 迁移后回填）
+    
+    Args:
+        story_id: 只校正某个故事；为空时校正全部
+    
+    Returns:
+        校正结果统计
+    """
+    segment_stats = db.query(
+        Segment.branch_id,
+        func.count(Segment.id),
+        func.max(Segment.sequence_order),
+        func.max(Segment.created_at)
+    ).group_by(Segment.branch_id)
+    member_stats = db.query(
+        BotBranchMembership.branch_id,
+        func.count(BotBranchMembership.bot_id)
+    ).group_by(BotBranchMembership.branch_id)
+    # 只取 ID 与计数列，分批读取；只对有偏差的行按主键批量 UPDATE
+    branches_query = db.query(
+        Branch.id,
+        Branch.story_id,
+        Branch.created_at,
+        Branch.segments_count,
+        Branch.active_bots_count,
+        Branch.last_segment_at,
+        Branch.last_sequence_order
+    )
+    stories_query = db.query(
+        Story.id,
+        Story.updated_at,
+        Story.branches_count,
+        Story.segments_count,
+        Story.bots_count,
+        Story.last_activity_at
+    )
+    if story_id is not None:
+        branch_ids = select(Branch.id).where(Branch.story_id == story_id)
+        segment_stats = segment_stats.filter(Segment.branch_id.in_(branch_ids))
+        member_stats = member_stats.filter(BotBranchMembership.branch_id.in_(branch_ids))
+        branches_query = branches_query.filter(Branch.story_id == story_id)
+        stories_query = stories_query.filter(Story.id == story_id)
+    
+    segments_by_branch = {row[0]: row[1:] for row in segment_stats.all()}
+    members_by_branch = dict(member_stats.all())
+    
+    results = {
+        'reconciled_at': datetime.utcnow().isoformat(),
+        'branches_checked': 0,
+        'branches_fixed': 0,
+        'stories_checked': 0,
+        'stories_fixed': 0,
+    }
+    
+    story_rollups: Dict[uuid.UUID, Dict[str, Any]] = {}
+    branch_fixes = []
+    for branch in branches_query.yield_per(RECONCILE_BATCH_SIZE):
+        results['branches_checked'] += 1
+        count, max_order, last_at = segments_by_branch.get(branch.id, (0, None, None))
+        expected = {
+            'segments_count': count,
+            'active_bots_count': members_by_branch.get(branch.id, 0),
+            'last_segment_at': last_at,
+            # 只向前校正，避免已分配的序号被重复使用
+            'last_sequence_order': max(branch.last_sequence_order or 0, max_order or 0),
+        }
+        if any(getattr(branch, name) != value for name, value in expected.items()):
+            branch_fixes.append(dict(expected, id=branch.id))
+            results['branches_fixed'] += 1
+        
+        rollup = story_rollups.setdefault(branch.story_id, {
+            'branches_count': 0, 'segments_count': 0, 'last_activity_at': None
+        })
+        rollup['branches_count'] += 1
+        rollup['segments_count'] += count
+        for ts in (last_at, branch.created_at):
+            if ts is not None and (rollup['last_activity_at'] is None or ts > rollup['last_activity_at']):
+                rollup['last_activity_at'] = ts
+    
+    bots_query = db.query(
+        Branch.story_id,
+        func.count(func.distinct(BotBranchMembership.bot_id))
+    ).join(BotBranchMembership, BotBranchMembership.branch_id == Branch.id).group_by(Branch.story_id)
+    if story_id is not None:
+        bots_query = bots_query.filter(Branch.story_id == story_id)
+    bots_by_story = dict(bots_query.all())
+    
+    story_fixes = []
+    for story in stories_query.yield_per(RECONCILE_BATCH_SIZE):
+        results['stories_checked'] += 1
+        rollup = story_rollups.get(story.id, {'branches_count': 0, 'segments_count': 0, 'last_activity_at': None})
+        expected = {
+            'branches_count': rollup['branches_count'],
+            'segments_count': rollup['segments_count'],
+            'bots_count': bots_by_story.get(story.id, 0),
+            'last_activity_at': rollup['last_activity_at'] or story.last_activity_at,
+        }
+        if any(getattr(story, name) != value for name, value in expected.items()):
+            # 显式带上原 updated_at，不触发 onupdate
+            story_fixes.append(dict(expected, id=story.id, updated_at=story.updated_at))
+            results['stories_fixed'] += 1
+    
+    for model, fixes in ((Branch, branch_fixes), (Story, story_fixes)):
+        for start in range(0, len(fixes), RECONCILE_BATCH_SIZE):
+            db.execute(update(model), fixes[start:start + RECONCILE_BATCH_SIZE])
+    
+    db.commit()
+    return results
@@ -7,6 +7,7 @@ from sqlalchemy import and_
 from src.models.bot import Bot
 from src.models.bot_branch_membership import BotBranchMembership
 from src.services.reputation_service import update_reputation
+from src.services.counter_service import record_membership_change, reconcile_counters
 
 
 def check_bot_timeouts(db: Session) -> Dict[str, Any]:
@@ -85,6 +86,7 @@ def check_bot_timeouts(db: Session) -> Dict[str, Any]:
             bot_name = bot.name if bot else "Unknown"
             
             db.delete(membership)
+            record_membership_change(db, membership.branch_id, -1)
             db.commit()
             
             results['cleaned_memberships'].append({
@@ -154,6 +156,7 @@ def cleanup_stuck_memberships(db: Session, hours: int = 1) -> Dict[str, Any]:
             last_active = bot.updated_at.isoformat() if bot and bot.updated_at else "Never"
             
             db.delete(membership)
+            record_membership_change(db, membership.branch_id, -1)
             db.commit()
             
             results['cleaned'].append({
@@ -210,4 +213,39 @@ def cleanup_expired_data(db: Session) -> Dict[str, Any]:
         'errors': []
     }
     
+    try:
+        from src.services.outbox_service import purge_processed
+        purged = purge_processed(db)
+        results['cleaned_items'].append({'type': 'outbox_events', 'deleted': purged})
+    except Exception as e:
+        db.rollback()
+        results['errors'].append({
+            'type': 'outbox_events',
+            'error': str(e)
+        })
+    
+    return results
+
+
+def reconcile_branch_counters(db: Session) -> Dict[str, Any]:
+    """
+    校正分支/故事的反规范化计数（定时任务）
+    
+    写路径已在同一事务中维护计数，这里兜底修正手工改库、迁移等造成的偏差。
+    """
+    results = reconcile_counters(db)
+    if results['branches_fixed'] or results['stories_fixed']:
+        print(f"🔧 计数校正: 分支 {results['branches_fixed']} 个, 故事 {results['stories_fixed']} 个")
+    return results
+
+
+def dispatch_outbox_events(db: Session) -> Dict[str, Any]:
+    """
+    处理发件箱中的待处理事件（定时任务）
+    
+    worker 内分发线程之外的兜底，也用于 OUTBOX_DISPATCH_MODE=cron 的部署。
+    """
+    from src.services.outbox_service import dispatch_pending
+    results = dispatch_pending(db)
+    results['dispatched_at'] = datetime.utcnow().isoformat()
     return results
@@ -0,0 +1,279 @@
+"""事务性发件箱服务
+
+写路径只在业务事务内追加 OutboxEvent（add_event，不提交），提交后唤醒分发器；
+分发器逐条认领待处理事件并执行副作用（创作日志、下一个 Bot 通知、缓存失效；
+单段与批量续写各一种事件），
+失败按指数退避重试，超过次数标记为 failed。已处理的事件由 purge_processed 按保留天数清理。
+
+投递语义是至少一次：处理函数的副作用先于事件状态提交执行，提交失败或进程在两者之间
+退出时事件会被重试。创作日志和缓存失效是幂等的；"轮到你了"通知会重复入队，
+Bot 端应按 branch_id 和当前轮次去重。
+"""
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from sqlalchemy.orm import Session
+from src.config import Config
+from src.models.outbox_event import OutboxEvent
+
+SEGMENT_CREATED = 'segment.created'
+SEGMENTS_CREATED_BULK = 'segments.created_bulk'
+
+# 事件类型 -> 处理函数(db, payload)；处理函数内的数据库写入与事件状态一起提交
+_handlers: Dict[str, Callable[[Session, Dict[str, Any]], None]] = {}
+
+
+def outbox_handler(event_type: str):
+    """注册事件处理函数"""
+    def decorator(func):
+        _handlers[event_type] = func
+        return func
+    return decorator
+
+
+def add_event(
+    db: Session,
+    event_type: str,
+    payload: Dict[str, Any],
+    aggregate_id: Optional[uuid.UUID] = None
+) -> OutboxEvent:
+    """在当前事务中追加事件（不提交，随业务数据一起提交）"""
+    event = OutboxEvent(
+        event_type=event_type,
+        aggregate_id=aggregate_id,
+        payload=payload,
+        status='pending',
+        attempts=0,
+        available_at=datetime.utcnow()
+    )
+    db.add(event)
+    return event
+
+
+def _claim_next(db: Session) -> Optional[OutboxEvent]:
+    """认领一条到期的待处理事件（PostgreSQL 下 SKIP LOCKED，多个分发器互不阻塞）"""
+    return db.query(OutboxEvent).filter(
+        OutboxEvent.status == 'pending',
+        OutboxEvent.available_at <= datetime.utcnow()
+    ).order_by(OutboxEvent.created_at.asc()).with_for_update(skip_locked=True).first()
+
+
+def dispatch_pending(db: Session, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    处理待处理事件
+    
+    每条事件单独提交，一条失败不影响其他事件。
+    
+    Returns:
+        处理结果统计
+    """
+    batch_size = batch_size or getattr(Config, 'OUTBOX_BATCH_SIZE', 100)
+    max_attempts = getattr(Config, 'OUTBOX_MAX_ATTEMPTS', 5)
+    results = {'processed': 0, 'failed': 0, 'retried': 0}
+    
+    for _ in range(batch_size):
+        event = _claim_next(db)
+        if event is None:
+            break
+        event_id = event.id
+        try:
+            handler = _handlers.get(event.event_type)
+            if handler is None:
+                raise ValueError(f"未知的事件类型: {event.event_type}")
+            handler(db, event.payload)
+            event.status = 'done'
+            event.processed_at = datetime.utcnow()
+            event.attempts += 1
+            db.commit()
+            results['processed'] += 1
+        except Exception as e:
+            db.rollback()
+            event = db.query(OutboxEvent).filter(OutboxEvent.id == event_id).first()
+            if event is None:
+                continue
+            event.attempts += 1
+            event.last_error = str(e)[:1000]
+            if event.attempts >= max_attempts:
+                event.status = 'failed'
+                results['failed'] += 1
+            else:
+                event.available_at = datetime.utcnow() + timedelta(seconds=2 ** event.attempts)
+                results['retried'] += 1
+            db.commit()
+            print(f"Outbox event {event_id} failed (attempt {event.attempts}): {e}")
+    
+    return results
+
+
+def purge_processed(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    删除超过保留期的已处理事件（done 按 OUTBOX_RETENTION_DAYS，failed 按 OUTBOX_FAILED_RETENTION_DAYS）
+    
+    Returns:
+        各状态删除的行数
+    """
+    now = now or datetime.utcnow()
+    # failed 事件没有 processed_at，按创建时间计算
+    retention = (
+        ('done', OutboxEvent.processed_at, getattr(Config, 'OUTBOX_RETENTION_DAYS', 7)),
+        ('failed', OutboxEvent.created_at, getattr(Config, 'OUTBOX_FAILED_RETENTION_DAYS', 30)),
+    )
+    results = {}
+    for status, column, days in retention:
+        results[status] = db.query(OutboxEvent).filter(
+            OutboxEvent.status == status,
+            column < now - timedelta(days=days)
+        ).delete(synchronize_session=False)
+    db.commit()
+    return results
+
+
+@outbox_handler(SEGMENT_CREATED)
+def _handle_segment_created(db: Session, payload: Dict[str, Any]):
+    """续写段创建后的副作用：创作日志、缓存失效、通知下一个 Bot"""
+    from src.models.segment_log import SegmentLog
+    from src.utils.cache import cache_service
+    
+    segment_id = uuid.UUID(payload['segment_id'])
+    branch_id = uuid.UUID(payload['branch_id'])
+    
+    # 重试时日志可能已写入（幂等）
+    exists = db.query(SegmentLog.id).filter(SegmentLog.segment_id == segment_id).first()
+    if not exists:
+        db.add(SegmentLog(
+            story_id=uuid.UUID(payload['story_id']),
+            branch_id=branch_id,
+            segment_id=segment_id,
+            author_id=uuid.UUID(payload['author_id']) if payload.get('author_id') else None,
+            author_type=payload.get('author_type') or 'human',
+            author_name=payload.get('author_name') or '未知用户',
+            content_length=payload.get('content_length') or 0,
+            is_continuation=payload.get('is_continuation') or 'continuation'
+        ))
+    
+    # 写路径已做过一次，这里兜底（例如提交后缓存熔断未能失效）
+    cache_service.invalidate_segment(segment_id, branch_id)
+    
+    _notify_next_bot(db, branch_id)
+
+
+@outbox_handler(SEGMENTS_CREATED_BULK)
+def _handle_segments_created_bulk(db: Session, payload: Dict[str, Any]):
+    """批量续写的副作用：逐段创作日志，整批只失效一次缓存、通知一次下一个 Bot"""
+    from src.models.segment_log import SegmentLog
+    from src.utils.cache import cache_service
+    
+    branch_id = uuid.UUID(payload['branch_id'])
+    items = payload.get('segments') or []
+    if not items:
+        return
+    segment_ids = [uuid.UUID(item['segment_id']) for item in items]
+    
+    # 重试时部分日志可能已写入（幂等）
+    logged = {row[0] for row in db.query(SegmentLog.segment_id).filter(
+        SegmentLog.segment_id.in_(segment_ids)
+    ).all()}
+    author_id = uuid.UUID(payload['author_id']) if payload.get('author_id') else None
+    db.add_all([
+        SegmentLog(
+            story_id=uuid.UUID(payload['story_id']),
+            branch_id=branch_id,
+            segment_id=segment_id,
+            author_id=author_id,
+            author_type=payload.get('author_type') or 'human',
+            author_name=payload.get('author_name') or '未知用户',
+            content_length=item.get('content_length') or 0,
+            is_continuation=item.get('is_continuation') or 'continuation'
+        )
+        for segment_id, item in zip(segment_ids, items)
+        if segment_id not in logged
+    ])
+    
+    cache_service.invalidate_segment(segment_ids[-1], branch_id)
+    
+    _notify_next_bot(db, branch_id)
+
+
+def _notify_next_bot(db: Session, branch_id: uuid.UUID):
+    """通知轮次队列中的下一个 Bot"""
+    from src.services.branch_service import get_next_bot_in_queue
+    
+    next_bot = get_next_bot_in_queue(db, branch_id)
+    if next_bot and next_bot.webhook_url:
+        from src.utils.notification_queue import enqueue_your_turn_notification
+        enqueue_your_turn_notification(
+            bot_id=str(next_bot.id),
+            branch_id=str(branch_id)
+        )
+
+
+class OutboxDispatcher:
+    """
+    worker 内的后台分发线程
+    
+    notify() 在提交后唤醒线程；没有唤醒时每 poll_interval 秒轮询一次，
+    兜住其他 worker 写入或处理失败待重试的事件。fork 后在子进程中重新启动。
+    """
+    
+    def __init__(self, poll_interval: float = 5):
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._wakeup = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+    
+    def notify(self):
+        self._ensure_started()
+        self._wakeup.set()
+    
+    def _run(self):
+        from src.database import SessionLocal
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            db = SessionLocal()
+            try:
+                while dispatch_pending(db)['processed']:
+                    pass
+            except Exception as e:
+                print(f"Outbox dispatcher error: {e}")
+            finally:
+                db.close()
+
+
+outbox_dispatcher = OutboxDispatcher(poll_interval=getattr(Config, 'OUTBOX_POLL_INTERVAL', 5))
+
+
+def kick_dispatcher(db: Optional[Session] = None):
+    """
+    业务事务提交后调用，按 OUTBOX_DISPATCH_MODE 触发分发
+    
+    inline 模式使用传入的会话在当前请求内处理。
+    """
+    mode = getattr(Config, 'OUTBOX_DISPATCH_MODE', 'thread')
+    try:
+        from flask import current_app
+        mode = current_app.config.get('OUTBOX_DISPATCH_MODE', mode)
+    except RuntimeError:
+        pass
+    
+    if mode == 'inline' and db is not None:
+        try:
+            dispatch_pending(db)
+        except Exception as e:
+            print(f"Outbox inline dispatch error: {e}")
+    elif mode == 'thread':
+        outbox_dispatcher.notify()
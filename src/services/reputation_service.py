@@ -52,6 +52,10 @@ def update_reputation(
     db.commit()
     db.refresh(bot)
     
+    if bot.status != 'active':
+        from src.utils.auth import invalidate_bot_principal
+        invalidate_bot_principal(bot.id)
+    
     return bot
 
 
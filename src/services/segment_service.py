@@ -1,17 +1,26 @@
 """续写段服务"""
+import base64
 import uuid
 import re
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Iterator
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from src.models.segment import Segment
 from src.models.branch import Branch
 from src.models.story import Story
 from src.models.bot_branch_membership import BotBranchMembership
 from src.services.branch_service import get_next_bot_in_queue
+from src.services.counter_service import (
+    allocate_sequence_orders, resync_sequence_counter, record_segments_added
+)
 from src.utils.cache import cache_service, cache_key
 
 
+# 续写段分页缓存时间（秒）；续写段创建后基本不变，写操作时按分支代数失效
+SEGMENT_PAGE_TTL = 300
+
+
 def count_words(text: str, language: str = 'zh') -> int:
     """
     统计字数/单词数
@@ -77,13 +86,17 @@ def create_segment(
     branch_id: uuid.UUID,
     bot_id: Optional[uuid.UUID],
     content: str,
-    is_starter: bool = False
+    is_starter: bool = False,
+    author: Optional[dict] = None
 ) -> Segment:
     """
     创建续写段
     
     Args:
         is_starter: 如果是开篇（第一个片段），跳过长度验证
+        author: 作者信息（author_id / author_type / author_name）；提供时在同一事务中
+            写入 segment.created 发件箱事件，由分发器记录创作日志并通知下一个 Bot，
+            调用方提交后应调用 outbox_service.kick_dispatcher
     """
     # 验证分支存在
     branch = db.query(Branch).filter(Branch.id == branch_id).first()
@@ -110,26 +123,159 @@ def create_segment(
     # from src.services.coherence_service import check_coherence
     # coherence_passed, coherence_score, coherence_error = check_coherence(...)
     
-    # 简化：直接创建，不做复杂查询
-    max_order = db.query(func.max(Segment.sequence_order)).filter(
-        Segment.branch_id == branch_id
-    ).scalar() or 0
-    
-    # 创建续写段
-    segment = Segment(
-        branch_id=branch_id,
-        bot_id=bot_id,
-        content=content,
-        sequence_order=max_order + 1
-    )
-    
-    db.add(segment)
-    db.commit()
+    for attempt in range(2):
+        # 通过分支计数器原子分配序号，(branch_id, sequence_order) 唯一约束兜底
+        segment = Segment(
+            id=uuid.uuid4(),
+            branch_id=branch_id,
+            bot_id=bot_id,
+            content=content,
+            sequence_order=allocate_sequence_orders(db, branch_id)
+        )
+        db.add(segment)
+        record_segments_added(db, branch_id, story_id=branch.story_id)
+        if author is not None:
+            from src.services.outbox_service import add_event, SEGMENT_CREATED
+            add_event(db, SEGMENT_CREATED, {
+                'segment_id': str(segment.id),
+                'branch_id': str(branch_id),
+                'story_id': str(branch.story_id),
+                'author_id': str(author['author_id']) if author.get('author_id') else None,
+                'author_type': author.get('author_type'),
+                'author_name': author.get('author_name'),
+                'content_length': len(content) if content else 0,
+                'is_continuation': 'new' if is_starter else 'continuation',
+            }, aggregate_id=branch_id)
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+            if attempt:
+                raise
+            # 计数器落后于已有数据，按实际最大序号校正后重试
+            resync_sequence_counter(db, branch_id)
     db.refresh(segment)
     
+    cache_service.invalidate_segment(segment.id, branch_id)
+    
     return segment
 
 
+def create_segments_bulk(
+    db: Session,
+    branch_id: uuid.UUID,
+    bot_id: Optional[uuid.UUID],
+    contents: List[str],
+    author_id: Optional[uuid.UUID] = None,
+    author_type: str = 'bot',
+    author_name: str = '',
+    is_starter: bool = False
+) -> List[Segment]:
+    """
+    批量创建续写段（回放故事 / 迁移脚本用）
+    
+    先逐段校验长度，任何一段不合法则整批拒绝；通过后一次分配连续序号，
+    续写段与一条 segments.created_bulk 发件箱事件在同一事务中写入，只失效一次缓存。
+    创作日志与下一个 Bot 的通知由分发器处理，调用方提交后应调用 outbox_service.kick_dispatcher。
+    
+    Args:
+        contents: 按顺序排列的续写内容
+        is_starter: 批次第一段是否为开篇（开篇跳过长度验证）
+    
+    Returns:
+        按序号排列的续写段列表
+    """
+    from src.config import Config
+    from src.services.outbox_service import add_event, SEGMENTS_CREATED_BULK
+    
+    if not contents:
+        raise ValueError("续写列表不能为空")
+    max_size = getattr(Config, 'SEGMENT_BULK_MAX_SIZE', 100)
+    if len(contents) > max_size:
+        raise ValueError(f"单次最多提交{max_size}段续写")
+    
+    branch = db.query(Branch).filter(Branch.id == branch_id).first()
+    if not branch:
+        raise ValueError("分支不存在")
+    story = db.query(Story).filter(Story.id == branch.story_id).first()
+    if not story:
+        raise ValueError("故事不存在")
+    
+    for index, content in enumerate(contents):
+        if not isinstance(content, str) or not content:
+            raise ValueError(f"第{index + 1}段: 续写内容不能为空")
+        if is_starter and index == 0:
+            continue
+        is_valid, error_msg = validate_segment_length(content, story)
+        if not is_valid:
+            raise ValueError(f"第{index + 1}段: {error_msg}")
+    
+    count = len(contents)
+    for attempt in range(2):
+        first_order = allocate_sequence_orders(db, branch_id, count) - count + 1
+        segments = [
+            Segment(
+                id=uuid.uuid4(),
+                branch_id=branch_id,
+                bot_id=bot_id,
+                content=content,
+                sequence_order=first_order + index
+            )
+            for index, content in enumerate(contents)
+        ]
+        db.add_all(segments)
+        add_event(db, SEGMENTS_CREATED_BULK, {
+            'branch_id': str(branch_id),
+            'story_id': str(story.id),
+            'author_id': str(author_id) if author_id else None,
+            'author_type': author_type,
+            'author_name': author_name or ('Bot' if author_type == 'bot' else '未知用户'),
+            'segments': [
+                {
+                    'segment_id': str(segment.id),
+                    'content_length': len(segment.content),
+                    'is_continuation': 'new' if is_starter and index == 0 else 'continuation',
+                }
+                for index, segment in enumerate(segments)
+            ],
+        }, aggregate_id=branch_id)
+        record_segments_added(db, branch_id, count=count, story_id=story.id)
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+            if attempt:
+                raise
+            resync_sequence_counter(db, branch_id)
+    
+    cache_service.invalidate_segment(segments[-1].id, branch_id)
+    
+    return segments
+
+
+def serialize_segment(segment: Segment) -> dict:
+    """续写段的对外序列化格式（列表接口与分页缓存共用）"""
+    bot_id_str = str(segment.bot_id) if segment.bot_id else None
+    bot_name = None
+    if segment.bot:
+        bot_name = segment.bot.name
+    elif segment.bot_id:
+        bot_name = f"Bot {bot_id_str[:8]}"
+    bot_model = segment.bot.model if segment.bot else None
+    return {
+        'id': str(segment.id),
+        'content': segment.content,
+        'sequence_order': segment.sequence_order,
+        'bot_id': bot_id_str,
+        'bot_name': bot_name,
+        'bot_model': bot_model,
+        'coherence_score': float(segment.coherence_score) if segment.coherence_score else None,
+        'created_at': segment.created_at.isoformat() if segment.created_at else None,
+    }
+
+
 def get_segments_by_branch(
     db: Session,
     branch_id: uuid.UUID,
@@ -137,25 +283,13 @@ def get_segments_by_branch(
     offset: int = 0
 ) -> Tuple[list[Segment], int]:
     """
-    获取分支的续写段列表（带缓存）
+    获取分支的续写段列表（ORM 对象，不带缓存）
+    
+    只需要对外数据时使用 get_segment_page。
     
     Returns:
         (续写段列表, 总数)
     """
-    cache_key_str = cache_key("segments:branch", branch_id, limit, offset)
-    
-    # 尝试从缓存获取
-    cached = cache_service.get(cache_key_str)
-    if cached:
-        segment_ids = [uuid.UUID(sid) for sid in cached.get('ids', [])]
-        if segment_ids:
-            # 预加载 bot 关系
-            segments = db.query(Segment).options(joinedload(Segment.bot)).filter(Segment.id.in_(segment_ids)).all()
-            segment_dict = {str(s.id): s for s in segments}
-            ordered_segments = [segment_dict[sid] for sid in cached['ids'] if sid in segment_dict]
-            if ordered_segments:
-                return ordered_segments, cached.get('total', len(ordered_segments))
-    
     # 预加载 bot 关系，避免 N+1 查询问题
     query = db.query(Segment).options(joinedload(Segment.bot)).filter(Segment.branch_id == branch_id)
     
@@ -163,14 +297,239 @@ def get_segments_by_branch(
     
     segments = query.order_by(Segment.sequence_order.asc()).limit(limit).offset(offset).all()
     
-    # 存入缓存
-    if segments:
-        segment_ids = [str(s.id) for s in segments]
-        cache_service.set(cache_key_str, {'ids': segment_ids, 'total': total}, ttl=120)  # 2分钟
-    
     return segments, total
 
 
+def get_segment_page(
+    db: Session,
+    branch_id: uuid.UUID,
+    limit: int = 50,
+    offset: int = 0
+) -> Tuple[list[dict], int]:
+    """
+    获取分支的续写段分页（已序列化，带缓存）
+    
+    缓存的是 serialize_segment 的结果，命中时不访问数据库。
+    续写段创建/修改/删除时通过 invalidate_segment 失效。
+    
+    Returns:
+        (续写段字典列表, 总数)
+    """
+    cache_key_str = cache_key("segments:branch", branch_id, "page", limit, offset)
+    
+    cached = cache_service.get(cache_key_str)
+    if cached is not None:
+        return cached['segments'], cached['total']
+    
+    segments, total = get_segments_by_branch(db, branch_id, limit=limit, offset=offset)
+    segments_data = [serialize_segment(segment) for segment in segments]
+    
+    cache_service.set(cache_key_str, {'segments': segments_data, 'total': total}, ttl=SEGMENT_PAGE_TTL)
+    
+    return segments_data, total
+
+
+def encode_segment_cursor(sequence_order: int) -> str:
+    """生成不透明的分页游标（内容为最后一个续写段的 sequence_order）"""
+    return base64.urlsafe_b64encode(f"s:{sequence_order}".encode()).decode().rstrip('=')
+
+
+def decode_segment_cursor(cursor: str) -> int:
+    """解析分页游标，格式无效时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        prefix, _, value = base64.urlsafe_b64decode(padded.encode()).decode().partition(':')
+        if prefix != 's':
+            raise ValueError
+        return int(value)
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+
+def get_segments_after(
+    db: Session,
+    branch_id: uuid.UUID,
+    after_sequence: int = 0,
+    limit: int = 50
+) -> Tuple[list[Segment], bool]:
+    """
+    按 sequence_order 键集分页获取续写段（ORM 对象，不带缓存）
+    
+    走 (branch_id, sequence_order) 唯一索引直接定位起点，页越深也不需要扫描丢弃前面的行。
+    
+    Returns:
+        (续写段列表, 是否还有更多)
+    """
+    segments = db.query(Segment).options(joinedload(Segment.bot)).filter(
+        Segment.branch_id == branch_id,
+        Segment.sequence_order > after_sequence
+    ).order_by(Segment.sequence_order.asc()).limit(limit + 1).all()
+    
+    return segments[:limit], len(segments) > limit
+
+
+def get_segment_page_after(
+    db: Session,
+    branch_id: uuid.UUID,
+    after_sequence: int = 0,
+    limit: int = 50
+) -> Tuple[list[dict], Optional[str], bool]:
+    """
+    键集分页获取续写段（已序列化，带缓存，不计算总数）
+    
+    Returns:
+        (续写段字典列表, 下一页游标, 是否还有更多)
+    """
+    cache_key_str = cache_key("segments:branch", branch_id, "after", after_sequence, limit)
+    
+    cached = cache_service.get(cache_key_str)
+    if cached is None:
+        segments, has_more = get_segments_after(db, branch_id, after_sequence=after_sequence, limit=limit)
+        cached = {
+            'segments': [serialize_segment(segment) for segment in segments],
+            'has_more': has_more,
+        }
+        cache_service.set(cache_key_str, cached, ttl=SEGMENT_PAGE_TTL)
+    
+    segments_data = cached['segments']
+    next_cursor = None
+    if segments_data:
+        next_cursor = encode_segment_cursor(segments_data[-1]['sequence_order'])
+    return segments_data, next_cursor, cached['has_more']
+
+
+def get_segment_changes(
+    db: Session,
+    branch_id: uuid.UUID,
+    since_sequence: Optional[int] = None,
+    since=None,
+    limit: int = 200
+) -> Optional[dict]:
+    """
+    增量同步：返回比客户端已知位置更新的续写段
+    
+    Args:
+        since_sequence: 客户端已读到的 sequence_order
+        since: 或者按创建时间（datetime）增量
+        limit: 单次最多返回条数，超出时 has_more=True，用 next_since_sequence 继续拉取
+    
+    Returns:
+        {'segments', 'high_water_mark', 'next_since_sequence', 'has_more'}；分支不存在时返回 None
+    """
+    high_water_mark = db.query(Branch.last_sequence_order).filter(Branch.id == branch_id).scalar()
+    if high_water_mark is None:
+        return None
+    
+    if since is None:
+        since_sequence = since_sequence or 0
+        if since_sequence >= high_water_mark:
+            # 稳态轮询：没有新内容，只读了分支一行
+            return {
+                'segments': [],
+                'high_water_mark': high_water_mark,
+                'next_since_sequence': since_sequence,
+                'has_more': False,
+            }
+        segments, has_more = get_segments_after(db, branch_id, after_sequence=since_sequence, limit=limit)
+    else:
+        # 走 (branch_id, created_at) 索引
+        rows = db.query(Segment).options(joinedload(Segment.bot)).filter(
+            Segment.branch_id == branch_id,
+            Segment.created_at > since
+        ).order_by(Segment.sequence_order.asc()).limit(limit + 1).all()
+        segments, has_more = rows[:limit], len(rows) > limit
+    
+    segments_data = [serialize_segment(segment) for segment in segments]
+    if has_more:
+        next_since_sequence = segments_data[-1]['sequence_order']
+    else:
+        # 读取高水位之后提交的续写段也可能被查出，游标不能落在已返回的数据之前
+        next_since_sequence = max(high_water_mark, since_sequence or 0)
+        if segments_data:
+            next_since_sequence = max(next_since_sequence, segments_data[-1]['sequence_order'])
+        high_water_mark = max(high_water_mark, next_since_sequence)
+    return {
+        'segments': segments_data,
+        'high_water_mark': high_water_mark,
+        'next_since_sequence': next_since_sequence,
+        'has_more': has_more,
+    }
+
+
+def count_segments_by_branch_cached(db: Session, branch_id: uuid.UUID) -> int:
+    """统计分支的续写段数量（带缓存，随分支代数失效）"""
+    cache_key_str = cache_key("segments:branch", branch_id, "count")
+    cached = cache_service.get(cache_key_str)
+    if cached is not None:
+        return cached
+    total = count_segments_by_branch(db, branch_id)
+    cache_service.set(cache_key_str, total, ttl=SEGMENT_PAGE_TTL)
+    return total
+
+
+def iter_segments_for_export(
+    db: Session,
+    branch_id: uuid.UUID,
+    batch_size: int = 500,
+    lineage: Optional[List[dict]] = None
+) -> Iterator[dict]:
+    """
+    按顺序逐条产出分支的续写段（完整故事导出用）
+    
+    只查询导出需要的列，yield_per 分批从服务端取行，
+    内存占用与分支长度无关。
+    
+    Args:
+        lineage: 分支的物化祖先路径（Branch.lineage）；提供时一并产出继承的前缀，
+            每个祖先是 (branch_id, sequence_order) 唯一索引上的一段范围，
+            合并为一条按 (祖先深度, 序号) 排序的查询，每项附带所属 branch_id
+    """
+    from sqlalchemy import and_, or_, case
+    from src.models.bot import Bot
+    
+    columns = [
+        Segment.sequence_order,
+        Segment.id,
+        Segment.content,
+        Segment.bot_id,
+        Bot.name,
+        Segment.created_at
+    ]
+    if lineage:
+        ranges = [Segment.branch_id == branch_id]
+        depth = {branch_id: len(lineage)}
+        for index, ancestor in enumerate(lineage):
+            ancestor_id = uuid.UUID(ancestor['branch_id'])
+            ranges.append(and_(
+                Segment.branch_id == ancestor_id,
+                Segment.sequence_order <= ancestor['up_to_sequence']
+            ))
+            depth[ancestor_id] = index
+        query = db.query(*columns, Segment.branch_id).filter(or_(*ranges)).order_by(
+            case(depth, value=Segment.branch_id).asc(),
+            Segment.sequence_order.asc()
+        )
+    else:
+        query = db.query(*columns).filter(
+            Segment.branch_id == branch_id
+        ).order_by(Segment.sequence_order.asc())
+    rows = query.outerjoin(Bot, Segment.bot_id == Bot.id).yield_per(batch_size)
+    
+    for row in rows:
+        sequence_order, segment_id, content, bot_id, bot_name, created_at = row[:6]
+        segment = {
+            'sequence_order': sequence_order,
+            'id': str(segment_id),
+            'content': content,
+            'bot_id': str(bot_id) if bot_id else None,
+            'bot_name': bot_name,
+            'created_at': created_at.isoformat() if created_at else None,
+        }
+        if lineage:
+            segment['branch_id'] = str(row[6])
+        yield segment
+
+
 def get_segment_by_id(db: Session, segment_id: uuid.UUID) -> Optional[Segment]:
     """根据ID获取续写段"""
     return db.query(Segment).filter(Segment.id == segment_id).first()
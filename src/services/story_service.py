@@ -63,7 +63,12 @@ def create_story(
     db.refresh(story)
     
     # 清除故事列表缓存
-    cache_service.delete_pattern("stories:list:*")
+    cache_service.invalidate_story_list()
+    
+    from src.services.counter_service import (
+        allocate_sequence_orders, record_branch_created, record_membership_change,
+        record_segments_added
+    )
     
     # 创建主干线分支
     main_branch = Branch(
@@ -74,6 +79,8 @@ def create_story(
         status='active'
     )
     db.add(main_branch)
+    db.flush()
+    record_branch_created(db, story.id)
     db.commit()
     db.refresh(main_branch)
     
@@ -86,6 +93,7 @@ def create_story(
             join_order=1
         )
         db.add(membership)
+        record_membership_change(db, main_branch.id, 1, story_id=story.id)
         db.commit()
     
     # 获取所有者名称（用于日志）。Agent/Bot 统一用 Bot 表
@@ -109,9 +117,10 @@ def create_story(
             branch_id=main_branch.id,
             bot_id=owner_id if owner_type == 'bot' else None,
             content=starter,
-            sequence_order=1
+            sequence_order=allocate_sequence_orders(db, main_branch.id)
         )
         db.add(starter_segment)
+        record_segments_added(db, main_branch.id, story_id=story.id)
         db.commit()
         db.refresh(starter_segment)
         
@@ -135,20 +144,19 @@ def create_story(
         
         # 如果提供了初始续写片段列表，自动创建这些片段
         if initial_segments and isinstance(initial_segments, list):
-            current_order = 1  # starter 已经是 1
             previous_segment_id = starter_segment.id  # 前一个片段的ID
             
             for idx, segment_content in enumerate(initial_segments[:5], start=1):  # 最多5个
                 if segment_content and isinstance(segment_content, str):
-                    current_order += 1
                     continuation_segment = Segment(
                         branch_id=main_branch.id,
                         bot_id=owner_id if owner_type == 'bot' else None,
                         content=segment_content,
-                        sequence_order=current_order,
+                        sequence_order=allocate_sequence_orders(db, main_branch.id),
                         parent_segment=previous_segment_id  # 指向前一个片段
                     )
                     db.add(continuation_segment)
+                    record_segments_added(db, main_branch.id, story_id=story.id)
                     db.commit()
                     db.refresh(continuation_segment)
                     
@@ -291,6 +299,6 @@ def update_story_metadata(
         story.title = title
     db.commit()
     db.refresh(story)
-    cache_service.delete_pattern("story:*")
-    cache_service.delete_pattern("stories:list:*")
+    cache_service.invalidate_story(story.id)
+    cache_service.invalidate_story_list()
     return story
@@ -21,10 +21,14 @@ def should_generate_summary(db: Session, branch_id: uuid.UUID) -> bool:
         return True
     
     trigger_count = getattr(Config, 'SUMMARY_TRIGGER_COUNT', 5)
-    new_segments_count = db.query(Segment).filter(
-        Segment.branch_id == branch_id,
-        Segment.created_at > branch.summary_updated_at
-    ).count()
+    if branch.summary_covers_up_to is not None:
+        # 摘要覆盖到的段数与分支计数之差即新增段数，无需计数查询
+        new_segments_count = branch.segments_count - branch.summary_covers_up_to
+    else:
+        new_segments_count = db.query(Segment).filter(
+            Segment.branch_id == branch_id,
+            Segment.created_at > branch.summary_updated_at
+        ).count()
     
     return new_segments_count >= trigger_count
 
@@ -329,10 +333,9 @@ def generate_summary(db: Session, branch_id: uuid.UUID, force: bool = False) ->
         return None
     
     # 更新数据库
-    all_count = db.query(Segment).filter(Segment.branch_id == branch_id).count()
     branch.current_summary = summary
     branch.summary_updated_at = datetime.utcnow()
-    branch.summary_covers_up_to = all_count
+    branch.summary_covers_up_to = branch.segments_count
     db.commit()
     db.refresh(branch)
     
@@ -0,0 +1,84 @@
+"""列表接口的版本标记（条件 GET 用）
+
+每个函数只读少量列（计数列、时间戳），不加载 ORM 对象，
+返回 (版本标记, 最后修改时间或 None)；资源不存在时返回 None，交给视图处理 404。
+"""
+import uuid
+from datetime import datetime
+from typing import Any, Optional, Tuple
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from src.models.story import Story
+from src.models.branch import Branch
+from src.models.comment import Comment
+from src.utils.cache import cache_service
+
+Version = Optional[Tuple[Any, Optional[datetime]]]
+
+
+def story_list_version(db: Session, status: Optional[str], limit: int, offset: int) -> Version:
+    """故事列表当前页：与列表相同的排序/分页，只取版本相关列"""
+    query = select(
+        Story.id, Story.updated_at, Story.last_activity_at,
+        Story.branches_count, Story.bots_count
+    )
+    if status:
+        query = query.where(Story.status == status)
+    rows = db.execute(
+        query.order_by(Story.created_at.desc()).limit(limit).offset(offset)
+    ).all()
+    return tuple(tuple(row) for row in rows), None
+
+
+def story_branches_version(
+    db: Session,
+    story_id: uuid.UUID,
+    limit: int = 6,
+    offset: int = 0,
+    include_all: bool = False
+) -> Version:
+    """故事的分支列表（与 get_branches_by_story 相同的筛选、排序和分页；updated_at 覆盖标题等编辑）"""
+    query = (
+        select(Branch.id, Branch.updated_at, Branch.segments_count, Branch.active_bots_count)
+        .where(Branch.story_id == story_id, Branch.status == 'active')
+        .order_by(Branch.created_at.desc())
+    )
+    if not include_all:
+        query = query.limit(limit).offset(offset)
+    rows = db.execute(query).all()
+    return tuple(tuple(row) for row in rows), None
+
+
+def branch_segments_version(db: Session, branch_id: uuid.UUID) -> Version:
+    """
+    分支续写段列表：分支计数列 + 分支缓存代数
+    
+    续写段被修改时计数不变，由 invalidate_segment 递增的代数区分。
+    """
+    row = db.execute(
+        select(Branch.last_sequence_order, Branch.segments_count, Branch.last_segment_at)
+        .where(Branch.id == branch_id)
+    ).first()
+    if row is None:
+        return None
+    return (tuple(row), cache_service.get_generation('branch', branch_id)), None
+
+
+def branch_comments_version(db: Session, branch_id: uuid.UUID) -> Version:
+    """分支评论（只增不改）：评论数 + 最新评论时间"""
+    count, latest = db.execute(
+        select(func.count(Comment.id), func.max(Comment.created_at))
+        .where(Comment.branch_id == branch_id)
+    ).one()
+    return (count, latest), latest
+
+
+def branch_summary_version(db: Session, branch_id: uuid.UUID) -> Version:
+    """分支摘要：摘要更新时间与覆盖段数；尚无摘要时（读取会触发生成）不做条件处理"""
+    row = db.execute(
+        select(Branch.summary_updated_at, Branch.summary_covers_up_to)
+        .where(Branch.id == branch_id, Branch.current_summary.isnot(None))
+    ).first()
+    if row is None:
+        return None
+    return tuple(row), row[0]
@@ -62,6 +62,9 @@ def update_webhook_url(
     db.commit()
     db.refresh(bot)
     
+    from src.utils.auth import invalidate_bot_principal
+    invalidate_bot_principal(bot.id)
+    
     return bot
 
 
@@ -1,11 +1,21 @@
 """认证工具函数"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
+from typing import Optional, Any, Dict
 from flask import request, jsonify, g
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from src.config import Config
 from src.database import get_db
-from src.services.bot_service import authenticate_bot
+from src.services.bot_service import authenticate_bot, hash_api_key
 from src.services.api_token_service import validate_api_token
+from src.models.bot import Bot
 from src.models.user import User
+from src.utils.cache import cache_service
 
 
 def init_jwt(app):
@@ -14,6 +24,194 @@ def init_jwt(app):
     return jwt
 
 
+class PrincipalCache:
+    """
+    凭证 -> 主体（Bot / User）的进程内缓存（LRU + TTL）
+    
+    只缓存列值快照，命中时以 merge(load=False) 挂回当前会话，不产生 SQL。
+    凭证本身不作为键保存，只保存其 SHA256 摘要。
+    """
+    
+    def __init__(self, max_size: int = 1024, ttl: int = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def is_enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取主体快照，过期或不存在返回None"""
+        if not self.is_enabled():
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires_at'] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['snapshot']
+    
+    def set(self, key: str, principal_type: str, principal_id: Any, snapshot: Dict[str, Any]):
+        """写入主体快照"""
+        if not self.is_enabled():
+            return
+        with self._lock:
+            self._entries[key] = {
+                'principal': (principal_type, str(principal_id)),
+                'snapshot': snapshot,
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate_principal(self, principal_type: str, principal_id: Any) -> int:
+        """使某个主体的所有凭证缓存失效，返回删除的条目数"""
+        principal = (principal_type, str(principal_id))
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if v['principal'] == principal]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 全局主体缓存实例
+principal_cache = PrincipalCache(
+    max_size=Config.AUTH_CACHE_MAX_SIZE,
+    ttl=Config.AUTH_CACHE_TTL
+)
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def _snapshot(obj) -> Dict[str, Any]:
+    """提取ORM对象的列值快照"""
+    return {attr.key: getattr(obj, attr.key) for attr in sa_inspect(obj).mapper.column_attrs}
+
+
+def _restore(db: Session, model, snapshot: Dict[str, Any]):
+    """将快照还原为当前会话中的持久对象（不查询数据库）"""
+    identity_key = db.identity_key(model, snapshot['id'])
+    existing = db.identity_map.get(identity_key)
+    if existing is not None:
+        return existing
+    obj = model(**snapshot)
+    make_transient_to_detached(obj)
+    return db.merge(obj, load=False)
+
+
+# 主体失效消息前缀（经缓存失效频道广播到其他 worker）
+PRINCIPAL_INVALIDATION_PREFIX = 'principal:'
+
+
+def _on_principal_invalidation(message: str):
+    """处理其他 worker 广播的主体失效消息（'bot:<id>' / 'user:<id>' / '*'）"""
+    if message == '*':
+        principal_cache.clear()
+        return
+    principal_type, _, principal_id = message.partition(':')
+    principal_cache.invalidate_principal(principal_type, principal_id)
+
+
+cache_service.register_invalidation_handler(PRINCIPAL_INVALIDATION_PREFIX, _on_principal_invalidation)
+
+
+def _invalidate_principal(principal_type: str, principal_id) -> int:
+    """清除本 worker 的缓存并通知其他 worker"""
+    removed = principal_cache.invalidate_principal(principal_type, principal_id)
+    cache_service.publish_invalidation(f"{PRINCIPAL_INVALIDATION_PREFIX}{principal_type}:{principal_id}")
+    return removed
+
+
+def _cached_snapshot(key: str) -> Optional[Dict[str, Any]]:
+    """读取主体快照；先确保本 worker 已订阅失效频道，未订阅时收不到其他 worker 的失效"""
+    if not principal_cache.is_enabled():
+        return None
+    cache_service.ensure_invalidation_listener()
+    return principal_cache.get(key)
+
+
+def invalidate_bot_principal(bot_id) -> int:
+    """Bot 状态/配置变化时调用（暂停、更新名称/Webhook 等）"""
+    return _invalidate_principal('bot', bot_id)
+
+
+def invalidate_user_principal(user_id) -> int:
+    """用户凭证变化时调用（撤销/刷新 API Token 等）"""
+    return _invalidate_principal('user', user_id)
+
+
+def authenticate_bot_cached(db: Session, api_key: str):
+    """通过API Key认证Bot（带主体缓存）"""
+    if not api_key:
+        return None
+    key = f"bot:{hash_api_key(api_key)}"
+    snapshot = _cached_snapshot(key)
+    if snapshot is not None:
+        return _restore(db, Bot, snapshot)
+    
+    bot = authenticate_bot(db, api_key)
+    if bot and bot.status == 'active':
+        principal_cache.set(key, 'bot', bot.id, _snapshot(bot))
+    return bot
+
+
+def validate_api_token_cached(db: Session, token: str):
+    """验证 API Token（带主体缓存），命中时仍校验过期时间"""
+    if not token:
+        return None
+    key = f"token:{_digest(token)}"
+    snapshot = _cached_snapshot(key)
+    if snapshot is not None:
+        user = _restore(db, User, snapshot)
+        return user if user.is_api_token_valid() else None
+    
+    user = validate_api_token(db, token)
+    if user:
+        principal_cache.set(key, 'user', user.id, _snapshot(user))
+    return user
+
+
+def get_user_cached(db: Session, user_id):
+    """按 JWT identity 获取用户（带主体缓存）"""
+    key = f"jwt:{user_id}"
+    snapshot = _cached_snapshot(key)
+    if snapshot is not None:
+        return _restore(db, User, snapshot)
+    
+    user = db.query(User).filter(User.id == user_id).first()
+    if user:
+        principal_cache.set(key, 'user', user.id, _snapshot(user))
+    return user
+
+
 def get_bot_from_token(token: str):
     """从token获取Bot对象"""
     from flask import current_app
@@ -21,7 +219,7 @@ def get_bot_from_token(token: str):
         db = current_app.config['TEST_DB']
     else:
         db = next(get_db())
-    return authenticate_bot(db, token)
+    return authenticate_bot_cached(db, token)
 
 
 def verify_api_token(token: str):
@@ -33,7 +231,7 @@ def verify_api_token(token: str):
         db = current_app.config['TEST_DB']
     else:
         db = next(get_db())
-    return validate_api_token(db, token)
+    return validate_api_token_cached(db, token)
 
 
 def api_token_auth_required(f):
@@ -65,7 +263,7 @@ def api_token_auth_required(f):
         else:
             db = next(get_db())
         
-        user = validate_api_token(db, api_token)
+        user = validate_api_token_cached(db, api_token)
         
         if not user:
             return jsonify({
@@ -108,7 +306,7 @@ def bot_auth_required(f):
             db = current_app.config['TEST_DB']
         else:
             db = next(get_db())
-        bot = authenticate_bot(db, api_key)
+        bot = authenticate_bot_cached(db, api_key)
         
         if not bot:
             return jsonify({
@@ -147,7 +345,7 @@ def user_auth_required(f):
             db = current_app.config['TEST_DB']
         else:
             db = next(get_db())
-        user = db.query(User).filter(User.id == user_id).first()
+        user = get_user_cached(db, user_id)
         
         if not user:
             return jsonify({
@@ -1,122 +1,810 @@
-"""Redis 缓存工具"""
+"""缓存工具（可替换后端：Redis + 进程内 L1 / 进程内 LRU / 空）"""
 import json
+import os
+import threading
+import time
 import uuid
-from typing import Optional, Any, Dict
+from collections import OrderedDict
+from typing import Optional, Any, Callable, Dict
 from src.config import Config
 from functools import wraps
 import hashlib
+import zlib
+from src.utils.redis_client import get_redis_client
 
-# 尝试导入Redis，如果失败则标记为不可用
+# orjson 可选：未安装时退回标准库 json
 try:
-    from redis import Redis
-    REDIS_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    REDIS_AVAILABLE = False
+    ORJSON_AVAILABLE = False
 
+# 代数键的过期时间，需远大于任何缓存条目的 TTL
+GENERATION_TTL = 86400
 
-def get_redis_connection() -> Optional['Redis']:
-    """获取Redis连接"""
-    if not REDIS_AVAILABLE:
+# 缓存键前缀 -> (代数命名空间, 是否以第一个参数作为命名空间ID)
+GENERATION_NAMESPACES = {
+    'story': ('story', True),
+    'branches:story': ('story', True),
+    'branches:tree': ('story', True),
+    'stories:list': ('stories', False),
+    'branch': ('branch', True),
+    'segments:branch': ('branch', True),
+    'comments:branch': ('branch', True),
+    'summary:branch': ('branch', True),
+    'full_story:branch': ('branch', True),
+}
+
+
+def generation_key(namespace: str, ident: Any = None) -> str:
+    """代数计数器的键"""
+    if ident is None:
+        return f"gen:{namespace}"
+    return f"gen:{namespace}:{ident}"
+
+
+def get_redis_connection():
+    """获取Redis连接（共享连接池）"""
+    return get_redis_client()
+
+
+class LocalLRUCache:
+    """进程内 LRU 缓存（带 TTL，线程安全），存放序列化后的值"""
+    
+    def __init__(self, max_size: int = 1024, ttl: int = 5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def is_enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+    
+    def get(self, key: str) -> Optional[str]:
+        if not self.is_enabled():
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def set(self, key: str, value: str, ttl: Optional[int] = None):
+        if not self.is_enabled():
+            return
+        ttl = min(ttl, self.ttl) if ttl else self.ttl
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class CircuitBreaker:
+    """
+    Redis 熔断器
+    
+    closed    - 正常放行；连续失败达到阈值后转为 open
+    open      - 直接拒绝，recovery_timeout 秒后转为 half_open
+    half_open - 同一时间只放行一个探测请求；成功则 closed，失败则重新 open
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 10):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self.trips = 0
+        self._lock = threading.Lock()
+    
+    def allow_request(self) -> bool:
+        """当前请求是否可以访问 Redis"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.probe_started_at = None
+            if self.state == self.HALF_OPEN:
+                # 探测请求未回报结果（超时视为丢失）前不放行其他请求
+                if self.probe_started_at is not None and now - self.probe_started_at < self.recovery_timeout:
+                    return False
+                self.probe_started_at = now
+            return True
+    
+    def record_success(self) -> bool:
+        """记录成功；从 half_open 恢复为 closed 时返回True"""
+        if self.state == self.CLOSED and self.failures == 0:
+            return False
+        with self._lock:
+            recovered = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probe_started_at = None
+            return recovered
+    
+    def record_failure(self):
+        """记录失败；half_open 下失败或累计达到阈值时断开"""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'failure_threshold': self.failure_threshold,
+            'recovery_timeout': self.recovery_timeout,
+        }
+
+
+# 跨 worker 失效广播的消息：清空整个 L1
+INVALIDATE_ALL = '*'
+
+# 仅删除自己持有的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class CacheSerializer:
+    """
+    缓存值序列化（bytes，首字节为格式标记）
+    
+    b'j' - 标准库 json（UTF-8）
+    b'o' - orjson
+    b'Z' - zlib 压缩，解压后仍以上述标记开头
+    
+    无标记的值按旧版 json 字符串解析（JSON 文本不会以 j/o/Z 开头）。
+    """
+    
+    JSON = b'j'
+    ORJSON = b'o'
+    ZLIB = b'Z'
+    
+    def __init__(self, fmt: str = 'auto', compress_threshold: int = 1024, compress_level: int = 1):
+        if fmt == 'auto':
+            fmt = 'orjson' if ORJSON_AVAILABLE else 'json'
+        if fmt == 'orjson' and not ORJSON_AVAILABLE:
+            print("orjson is not installed, falling back to json cache serializer")
+            fmt = 'json'
+        self.format = fmt
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+    
+    def dumps(self, value: Any) -> bytes:
+        payload = None
+        if self.format == 'orjson':
+            try:
+                payload = self.ORJSON + orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # 超出 orjson 支持范围（如超大整数）时退回 json
+                payload = None
+        if payload is None:
+            payload = self.JSON + json.dumps(value, default=str, ensure_ascii=False).encode('utf-8')
+        if self.compress_threshold and len(payload) > self.compress_threshold:
+            compressed = self.ZLIB + zlib.compress(payload, self.compress_level)
+            if len(compressed) < len(payload):
+                return compressed
+        return payload
+    
+    def loads(self, data: Any) -> Any:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        tag = data[:1]
+        if tag == self.ZLIB:
+            data = zlib.decompress(data[1:])
+            tag = data[:1]
+        if tag == self.ORJSON:
+            if ORJSON_AVAILABLE:
+                return orjson.loads(data[1:])
+            return json.loads(data[1:])
+        if tag == self.JSON:
+            return json.loads(data[1:])
+        return json.loads(data)
+
+
+class CacheBackend:
+    """
+    缓存存储后端接口（只处理 bytes 值，序列化由 CacheService 负责）
+    
+    shared 为True表示多个进程共享同一份数据，此时 CacheService 才会在前面加 L1
+    并通过 publish/pubsub 广播失效。
+    """
+    
+    name = 'base'
+    shared = False
+    enabled = True
+    
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+    
+    def setex(self, key: str, ttl: int, value: str) -> bool:
+        raise NotImplementedError
+    
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+    
+    def delete_pattern(self, pattern: str) -> int:
+        raise NotImplementedError
+    
+    def incr(self, key: str, ttl: int) -> int:
+        """自增并设置过期时间，返回新值"""
+        raise NotImplementedError
+    
+    def set_nx(self, key: str, value: str, ttl_ms: int) -> bool:
+        raise NotImplementedError
+    
+    def delete_if_equals(self, key: str, value: str):
+        raise NotImplementedError
+    
+    def publish(self, channel: str, message: str):
+        pass
+    
+    def pubsub(self):
+        raise NotImplementedError
+
+
+class RedisCacheBackend(CacheBackend):
+    """Redis 后端（多 worker 共享）"""
+    
+    name = 'redis'
+    shared = True
+    
+    def __init__(self, client):
+        self.redis = client
+    
+    def get(self, key: str) -> Optional[str]:
+        return self.redis.get(key)
+    
+    def setex(self, key: str, ttl: int, value: str) -> bool:
+        return bool(self.redis.setex(key, ttl, value))
+    
+    def delete(self, key: str) -> bool:
+        return bool(self.redis.delete(key))
+    
+    def delete_pattern(self, pattern: str) -> int:
+        """SCAN 增量遍历删除，不阻塞 Redis"""
+        deleted = 0
+        batch = []
+        for key in self.redis.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                deleted += self.redis.delete(*batch)
+                batch = []
+        if batch:
+            deleted += self.redis.delete(*batch)
+        return deleted
+    
+    def incr(self, key: str, ttl: int) -> int:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, ttl)
+        value, _ = pipe.execute()
+        return value
+    
+    def set_nx(self, key: str, value: str, ttl_ms: int) -> bool:
+        return bool(self.redis.set(key, value, nx=True, px=ttl_ms))
+    
+    def delete_if_equals(self, key: str, value: str):
+        self.redis.eval(_RELEASE_LOCK_SCRIPT, 1, key, value)
+    
+    def publish(self, channel: str, message: str):
+        self.redis.publish(channel, message)
+    
+    def pubsub(self):
+        return self.redis.pubsub(ignore_subscribe_messages=True)
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    进程内后端（有界 LRU + TTL），用于未配置 Redis 的单机部署
+    
+    多个 worker 之间不共享、也收不到彼此的失效，因此条目 TTL 上限为 max_ttl。
+    """
+    
+    name = 'memory'
+    
+    def __init__(self, max_size: int = 10000, max_ttl: int = 60):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _live(self, key: str):
+        """返回未过期的条目（调用方需持有锁）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+    
+    def _store(self, key: str, value: str, ttl: Optional[float]):
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+    
+    def setex(self, key: str, ttl: int, value: str) -> bool:
+        if self.max_ttl:
+            ttl = min(ttl, self.max_ttl)
+        with self._lock:
+            self._store(key, value, ttl)
+        return True
+    
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+    
+    def delete_pattern(self, pattern: str) -> int:
+        import fnmatch
+        with self._lock:
+            keys = [k for k in self._entries if fnmatch.fnmatchcase(k, pattern)]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+    
+    def incr(self, key: str, ttl: int) -> int:
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[0]) + 1 if entry else 1
+            self._store(key, str(value), ttl)
+            return value
+    
+    def set_nx(self, key: str, value: str, ttl_ms: int) -> bool:
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._store(key, value, ttl_ms / 1000)
+            return True
+    
+    def delete_if_equals(self, key: str, value: str):
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None and entry[0] == value:
+                del self._entries[key]
+    
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class NullCacheBackend(CacheBackend):
+    """空后端：不缓存任何内容"""
+    
+    name = 'none'
+    enabled = False
+    
+    def get(self, key: str) -> Optional[str]:
         return None
-    try:
-        return Redis(
-            host=Config.REDIS_HOST,
-            port=Config.REDIS_PORT,
-            db=Config.REDIS_DB,
-            decode_responses=True,
-            socket_timeout=2,
-            socket_connect_timeout=2,
+    
+    def setex(self, key: str, ttl: int, value: str) -> bool:
+        return False
+    
+    def delete(self, key: str) -> bool:
+        return False
+    
+    def delete_pattern(self, pattern: str) -> int:
+        return 0
+    
+    def incr(self, key: str, ttl: int) -> int:
+        return 0
+    
+    def set_nx(self, key: str, value: str, ttl_ms: int) -> bool:
+        return False
+    
+    def delete_if_equals(self, key: str, value: str):
+        pass
+
+
+def create_cache_backend(name: Optional[str] = None) -> CacheBackend:
+    """
+    按配置创建缓存后端
+    
+    Args:
+        name: 'redis' | 'memory' | 'none' | 'auto'（默认取 Config.CACHE_BACKEND）。
+            auto：配置了 REDIS_HOST 时用 Redis，否则用进程内缓存
+    """
+    name = (name or Config.CACHE_BACKEND or 'auto').lower()
+    if name == 'auto':
+        name = 'redis' if Config.REDIS_HOST else 'memory'
+    if name == 'redis':
+        # 值为二进制（可能压缩），不能由客户端解码为 str
+        client = get_redis_client(decode_responses=False)
+        if client is None:
+            print("Cache backend 'redis' requested but Redis is not configured, caching disabled")
+            return NullCacheBackend()
+        return RedisCacheBackend(client)
+    if name == 'memory':
+        return MemoryCacheBackend(
+            max_size=Config.CACHE_MEMORY_MAX_SIZE,
+            max_ttl=Config.CACHE_MEMORY_MAX_TTL
         )
-    except Exception:
-        return None
+    if name != 'none':
+        print(f"Unknown cache backend '{name}', caching disabled")
+    return NullCacheBackend()
 
 
 class CacheService:
-    """缓存服务 - 当Redis不可用时静默失败"""
+    """
+    缓存服务 - 后端出错时静默失败
     
-    def __init__(self):
-        self.redis = get_redis_connection()
+    后端可替换（Redis / 进程内 LRU / 空），失效接口在所有后端上一致。
+    Redis 后端的读取顺序：进程内 L1（短 TTL）-> Redis；
+    写入/删除/代数递增会通过 Redis pub/sub 广播给所有 worker，使其 L1 中的同名键失效。
+    后端出错时由熔断器暂时跳过缓存，恢复后自动重新启用。
+    """
+    
+    def __init__(self, backend: Optional[CacheBackend] = None, serializer: Optional[CacheSerializer] = None):
+        self.backend = backend if backend is not None else create_cache_backend()
+        self.serializer = serializer if serializer is not None else CacheSerializer(
+            fmt=Config.CACHE_SERIALIZER,
+            compress_threshold=Config.CACHE_COMPRESS_THRESHOLD,
+            compress_level=Config.CACHE_COMPRESS_LEVEL
+        )
         self.default_ttl = 300
-        self._enabled = self.redis is not None
+        self.breaker = CircuitBreaker(
+            failure_threshold=Config.CACHE_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=Config.CACHE_BREAKER_RECOVERY_TIMEOUT
+        )
+        # 非共享后端本身就在进程内，无需再加 L1
+        self.local = LocalLRUCache(
+            max_size=Config.CACHE_L1_MAX_SIZE if self.backend.shared else 0,
+            ttl=Config.CACHE_L1_TTL
+        )
+        self.channel = Config.CACHE_INVALIDATION_CHANNEL
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._sender_id = uuid.uuid4().hex
+        # 键前缀 -> 回调，供缓存之外的进程内状态（如认证主体缓存）复用失效频道
+        self._invalidation_handlers: Dict[str, Callable[[str], None]] = {}
     
     def is_enabled(self) -> bool:
-        """检查缓存是否可用"""
-        return self._enabled
+        """检查缓存是否可用（熔断器断开期间为False）"""
+        if not self.backend.enabled:
+            return False
+        if self.breaker.state != CircuitBreaker.OPEN:
+            return True
+        return time.monotonic() - self.breaker.opened_at >= self.breaker.recovery_timeout
+    
+    def _allow(self) -> bool:
+        """是否可以访问后端（half_open 时仅放行一个探测请求）"""
+        return self.backend.enabled and self.breaker.allow_request()
+    
+    def _record_success(self):
+        if self.breaker.record_success():
+            # 断开期间的失效广播可能丢失
+            self.local.clear()
+    
+    def _record_failure(self, e: Exception, operation: str):
+        print(f"Cache {operation} error: {e}")
+        self.breaker.record_failure()
+    
+    def stats(self) -> Dict[str, Any]:
+        """缓存状态（供 /health/metrics 导出）"""
+        return {
+            'backend': self.backend.name,
+            'serializer': self.serializer.format,
+            'enabled': self.is_enabled(),
+            'breaker': self.breaker.stats(),
+        }
+    
+    def register_invalidation_handler(self, prefix: str, handler: Callable[[str], None]):
+        """
+        注册失效消息回调
+        
+        其他 worker 通过 publish_invalidation 发出以 prefix 开头的消息时，
+        以去掉前缀后的部分调用 handler；监听连接中断时以 INVALIDATE_ALL 调用。
+        """
+        self._invalidation_handlers[prefix] = handler
+    
+    def publish_invalidation(self, message: str):
+        """向其他 worker 广播一条失效消息（本进程不回调）"""
+        if not self.backend.shared or not self.backend.enabled:
+            return
+        try:
+            self.backend.publish(self.channel, f"{self._sender_id}|{message}")
+        except Exception as e:
+            print(f"Cache publish error: {e}")
+    
+    def ensure_invalidation_listener(self):
+        """确保当前进程已订阅失效频道（进程内状态写入前调用）"""
+        if self.backend.enabled:
+            self._ensure_listener()
+    
+    def _notify_handlers(self, key: str) -> bool:
+        """分发给注册的回调，返回是否被处理"""
+        for prefix, handler in list(self._invalidation_handlers.items()):
+            if key == INVALIDATE_ALL or key.startswith(prefix):
+                try:
+                    handler(INVALIDATE_ALL if key == INVALIDATE_ALL else key[len(prefix):])
+                except Exception as e:
+                    print(f"Cache invalidation handler error: {e}")
+                if key != INVALIDATE_ALL:
+                    return True
+        return False
+    
+    def _ensure_listener(self):
+        """在当前进程中启动失效监听线程（gunicorn fork 后每个 worker 各自启动）"""
+        if not self.backend.shared:
+            return
+        if not self.local.is_enabled() and not self._invalidation_handlers:
+            return
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._listener_lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            self._sender_id = uuid.uuid4().hex
+            # fork 继承来的 L1 内容无法保证已收到失效消息
+            self.local.clear()
+            self._notify_handlers(INVALIDATE_ALL)
+            thread = threading.Thread(
+                target=self._listen_invalidations,
+                name='cache-invalidation-listener',
+                daemon=True
+            )
+            thread.start()
+    
+    def _listen_invalidations(self):
+        """订阅失效频道；连接中断期间可能丢消息，重连前清空 L1"""
+        while True:
+            try:
+                pubsub = self.backend.pubsub()
+                pubsub.subscribe(self.channel)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if not message or not message.get('data'):
+                        continue
+                    data = message['data']
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    sender, _, key = data.partition('|')
+                    if sender == self._sender_id:
+                        continue
+                    if self._notify_handlers(key):
+                        continue
+                    if key == INVALIDATE_ALL:
+                        self.local.clear()
+                    elif key:
+                        self.local.delete(key)
+            except Exception as e:
+                print(f"Cache invalidation listener error: {e}")
+                self.local.clear()
+                self._notify_handlers(INVALIDATE_ALL)
+                time.sleep(5)
+    
+    def _broadcast_invalidation(self, key: str):
+        """通知其他 worker 丢弃 L1 中的键"""
+        self.local.delete(key)
+        if not self.backend.shared:
+            return
+        try:
+            self.backend.publish(self.channel, f"{self._sender_id}|{key}")
+        except Exception as e:
+            print(f"Cache publish error: {e}")
+    
+    def _get_raw(self, key: str, operation: str = 'get') -> Optional[bytes]:
+        """先查 L1，未命中再查后端并回填 L1（熔断器断开时只查 L1）"""
+        if not self.backend.enabled:
+            return None
+        self._ensure_listener()
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        if not self._allow():
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            self._record_failure(e, operation)
+            return None
+        self._record_success()
+        if value:
+            self.local.set(key, value)
+        return value
     
     def get(self, key: str) -> Optional[Any]:
         """获取缓存"""
-        if not self._enabled:
+        value = self._get_raw(key)
+        if not value:
             return None
         try:
-            value = self.redis.get(key)
-            if value:
-                return json.loads(value)
-            return None
+            return self.serializer.loads(value)
         except Exception as e:
             print(f"Cache get error: {e}")
-            self._enabled = False
             return None
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """设置缓存"""
-        if not self._enabled:
+        if not self._allow():
             return False
         try:
+            self._ensure_listener()
             ttl = ttl or self.default_ttl
-            serialized = json.dumps(value, default=str)
-            return self.redis.setex(key, ttl, serialized)
+            serialized = self.serializer.dumps(value)
+            result = self.backend.setex(key, ttl, serialized)
+            self._record_success()
+            self._broadcast_invalidation(key)
+            self.local.set(key, serialized, ttl)
+            return result
         except Exception as e:
-            print(f"Cache set error: {e}")
-            self._enabled = False
+            self._record_failure(e, 'set')
+            return False
+    
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """获取原始字节（不经过序列化，配合 set_bytes 存放已压缩的产物）"""
+        value = self._get_raw(key, 'get_bytes')
+        if not value:
+            return None
+        return value.encode('utf-8') if isinstance(value, str) else value
+    
+    def set_bytes(self, key: str, value: bytes, ttl: Optional[int] = None) -> bool:
+        """原样写入字节"""
+        if not self._allow():
+            return False
+        try:
+            self._ensure_listener()
+            ttl = ttl or self.default_ttl
+            result = self.backend.setex(key, ttl, value)
+            self._record_success()
+            self._broadcast_invalidation(key)
+            self.local.set(key, value, ttl)
+            return result
+        except Exception as e:
+            self._record_failure(e, 'set_bytes')
             return False
     
     def delete(self, key: str) -> bool:
         """删除缓存"""
-        if not self._enabled:
+        if not self._allow():
             return False
         try:
-            return bool(self.redis.delete(key))
+            result = self.backend.delete(key)
+            self._record_success()
+            self._broadcast_invalidation(key)
+            return result
         except Exception as e:
-            print(f"Cache delete error: {e}")
-            self._enabled = False
+            self._record_failure(e, 'delete')
             return False
     
     def delete_pattern(self, pattern: str) -> int:
-        """删除匹配模式的所有键"""
-        if not self._enabled:
+        """
+        删除匹配模式的所有键
+        
+        常规失效请使用 invalidate_*（命名空间代数），此方法仅用于运维清理。
+        """
+        if not self._allow():
+            return 0
+        try:
+            deleted = self.backend.delete_pattern(pattern)
+            self._record_success()
+            self.local.clear()
+            self._broadcast_invalidation(INVALIDATE_ALL)
+            return deleted
+        except Exception as e:
+            self._record_failure(e, 'delete_pattern')
             return 0
+    
+    def get_generation(self, namespace: str, ident: Any = None) -> int:
+        """获取命名空间当前代数（未设置时为0）"""
+        value = self._get_raw(generation_key(namespace, ident), 'get_generation')
         try:
-            keys = self.redis.keys(pattern)
-            if keys:
-                return self.redis.delete(*keys)
+            return int(value) if value else 0
+        except (TypeError, ValueError):
             return 0
+    
+    def bump_generation(self, namespace: str, ident: Any = None) -> int:
+        """
+        命名空间代数 +1：旧代数下的缓存键不再被读取，随 TTL 自然过期
+        
+        单次 INCR 替代 KEYS 扫描删除。
+        """
+        if not self._allow():
+            return 0
+        try:
+            key = generation_key(namespace, ident)
+            generation = self.backend.incr(key, GENERATION_TTL)
+            self._record_success()
+            self._broadcast_invalidation(key)
+            return generation
         except Exception as e:
-            print(f"Cache delete_pattern error: {e}")
-            self._enabled = False
+            self._record_failure(e, 'bump_generation')
             return 0
     
+    def acquire_lock(self, name: str, timeout: float) -> Optional[str]:
+        """获取锁（Redis 后端为跨进程锁），成功返回令牌，失败返回None"""
+        if not self._allow():
+            return None
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.backend.set_nx(f"lock:{name}", token, int(timeout * 1000))
+            self._record_success()
+            return token if acquired else None
+        except Exception as e:
+            self._record_failure(e, 'acquire_lock')
+            return None
+    
+    def release_lock(self, name: str, token: str):
+        """释放锁（仅当令牌仍属于自己时删除）"""
+        if not token or not self._allow():
+            return
+        try:
+            self.backend.delete_if_equals(f"lock:{name}", token)
+            self._record_success()
+        except Exception as e:
+            self._record_failure(e, 'release_lock')
+    
     def invalidate_story(self, story_id: uuid.UUID):
         """使故事相关缓存失效"""
-        if not self._enabled:
-            return
-        story_id_str = str(story_id)
-        self.delete_pattern(f"story:{story_id_str}*")
-        self.delete_pattern(f"branches:story:{story_id_str}*")
+        self.bump_generation('story', story_id)
+    
+    def invalidate_story_list(self):
+        """使故事列表缓存失效"""
+        self.bump_generation('stories')
     
     def invalidate_branch(self, branch_id: uuid.UUID):
-        """使分支相关缓存失效"""
-        if not self._enabled:
-            return
-        branch_id_str = str(branch_id)
-        self.delete_pattern(f"branch:{branch_id_str}*")
-        self.delete_pattern(f"segments:branch:{branch_id_str}*")
-        self.delete_pattern(f"comments:branch:{branch_id_str}*")
-        self.delete_pattern(f"summary:branch:{branch_id_str}*")
+        """使分支相关缓存失效（分支详情、续写段、评论、摘要）"""
+        self.bump_generation('branch', branch_id)
     
     def invalidate_segment(self, segment_id: uuid.UUID, branch_id: uuid.UUID):
         """使续写段相关缓存失效"""
-        if not self._enabled:
-            return
         self.invalidate_branch(branch_id)
 
 
@@ -125,10 +813,24 @@ cache_service = CacheService()
 
 
 def cache_key(prefix: str, *args, **kwargs) -> str:
-    """生成缓存键"""
+    """
+    生成缓存键
+    
+    前缀登记在 GENERATION_NAMESPACES 中时，键内会带上命名空间当前代数（g<N>），
+    invalidate_* 递增代数后旧键自动失效。
+    """
     parts = [prefix]
     if args:
         parts.extend(str(arg) for arg in args)
+    namespace = GENERATION_NAMESPACES.get(prefix)
+    if namespace:
+        name, scoped = namespace
+        if scoped and args:
+            generation = cache_service.get_generation(name, args[0])
+            parts.insert(2, f"g{generation}")
+        elif not scoped:
+            generation = cache_service.get_generation(name)
+            parts.insert(1, f"g{generation}")
     if kwargs:
         sorted_kwargs = sorted(kwargs.items())
         parts.extend(f"{k}:{v}" for k, v in sorted_kwargs)
@@ -140,8 +842,72 @@ def cache_key(prefix: str, *args, **kwargs) -> str:
     return key_str
 
 
-def cached(ttl: int = 300, key_prefix: str = None):
-    """缓存装饰器"""
+class SingleFlight:
+    """进程内 single-flight：同一键同时只有一个调用方执行计算，其余等待其结果"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Dict[str, Any]] = {}
+    
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
+    
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+        
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+
+
+_single_flight = SingleFlight()
+
+# 缓存值外层包装的标记字段
+_ENVELOPE_MARK = '__cached__'
+
+
+def cached(
+    ttl: int = 300,
+    key_prefix: str = None,
+    stale_ttl: int = 0,
+    single_flight: Optional[str] = 'local',
+    lock_timeout: float = 10,
+    skip_args: int = 0
+):
+    """
+    缓存装饰器
+    
+    Args:
+        ttl: 新鲜期（秒）
+        key_prefix: 缓存键前缀，默认 模块:函数名
+        stale_ttl: 过期后的宽限期（秒）。宽限期内只有一个调用方重新计算，
+            其余调用方直接拿到旧值（stale-while-revalidate）；0 表示不启用
+        single_flight: 缓存未命中时的防击穿方式
+            'local' - 进程内合并并发计算
+            'redis' - 进程内合并后再用 Redis 锁跨 worker 合并，未拿到锁的调用方等待结果
+            None    - 不合并
+        lock_timeout: Redis 锁的持有上限（秒），也是等待方的最长等待时间
+        skip_args: 前 N 个位置参数不参与缓存键（如数据库会话）
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -151,19 +917,61 @@ def cached(ttl: int = 300, key_prefix: str = None):
             
             # 生成缓存键
             prefix = key_prefix or f"{func.__module__}:{func.__name__}"
-            cache_key_str = cache_key(prefix, *args, **kwargs)
+            cache_key_str = cache_key(prefix, *args[skip_args:], **kwargs)
             
-            # 尝试从缓存获取
-            cached_value = cache_service.get(cache_key_str)
-            if cached_value is not None:
-                return cached_value
+            def load():
+                envelope = cache_service.get(cache_key_str)
+                if isinstance(envelope, dict) and envelope.get(_ENVELOPE_MARK):
+                    return envelope
+                return None
             
-            # 执行函数
-            result = func(*args, **kwargs)
+            def compute():
+                # 执行函数并存入缓存（保留到宽限期结束）
+                result = func(*args, **kwargs)
+                cache_service.set(cache_key_str, {
+                    _ENVELOPE_MARK: 1,
+                    'value': result,
+                    'fresh_until': time.time() + ttl,
+                }, ttl + stale_ttl)
+                return result
             
-            # 存入缓存
-            cache_service.set(cache_key_str, result, ttl)
+            def compute_with_lock():
+                if single_flight != 'redis':
+                    return compute()
+                token = cache_service.acquire_lock(cache_key_str, lock_timeout)
+                if token:
+                    try:
+                        return compute()
+                    finally:
+                        cache_service.release_lock(cache_key_str, token)
+                # 其他 worker 正在计算：等待其写入，超时后自行计算
+                deadline = time.monotonic() + lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    envelope = load()
+                    if envelope is not None:
+                        return envelope['value']
+                return compute()
             
-            return result
+            # 尝试从缓存获取
+            envelope = load()
+            if envelope is not None:
+                if envelope.get('fresh_until', 0) > time.time():
+                    return envelope['value']
+                # 已过期但在宽限期内：已有刷新在进行时直接返回旧值
+                if single_flight and _single_flight.in_flight(cache_key_str):
+                    return envelope['value']
+                if single_flight == 'redis':
+                    token = cache_service.acquire_lock(cache_key_str, lock_timeout)
+                    if not token:
+                        return envelope['value']
+                    try:
+                        return _single_flight.do(cache_key_str, compute)
+                    finally:
+                        cache_service.release_lock(cache_key_str, token)
+            
+            if not single_flight:
+                return compute()
+            return _single_flight.do(cache_key_str, compute_with_lock)
         return wrapper
     return decorator
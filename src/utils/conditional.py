@@ -0,0 +1,93 @@
+"""条件 GET（ETag / Last-Modified）
+
+轮询型的公开列表接口先用廉价的版本标记（计数列、时间戳、缓存代数）算出 ETag，
+客户端带 If-None-Match / If-Modified-Since 且未变化时直接返回 304，
+不执行列表查询和序列化。Last-Modified 只精确到秒，最后修改时间落在当前这一秒内时
+不输出（RFC 7232 2.2.2），避免同一秒内的后续写入被 If-Modified-Since 误判为未修改。
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Callable, Optional, Tuple
+from flask import request, make_response, Response
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """统一为带时区的 UTC 时间并去掉微秒（HTTP 日期只精确到秒）"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def make_etag(token: Any) -> str:
+    """由版本标记和完整请求路径（含查询参数）生成 ETag 值"""
+    raw = f"{request.full_path}|{token}".encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()[:32]
+
+
+def is_not_modified(etag: str, last_modified: Optional[datetime]) -> bool:
+    """按 RFC 7232：有 If-None-Match 时只比较 ETag，否则再看 If-Modified-Since"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= _as_utc(request.if_modified_since)
+    return False
+
+
+def _set_validators(response: Response, etag: str, last_modified: Optional[datetime]):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # 允许缓存但每次都要回源校验
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'no-cache'
+
+
+def conditional_get(version_func: Callable[..., Optional[Tuple[Any, Optional[datetime]]]]):
+    """
+    条件 GET 装饰器
+    
+    Args:
+        version_func: 接收视图的 URL 参数，返回 (版本标记, 最后修改时间或 None)；
+            返回 None 或抛异常时跳过条件处理，照常执行视图
+    
+    只有 200 响应会附带 ETag / Last-Modified。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            
+            try:
+                version = version_func(**kwargs)
+            except ValueError:
+                # 参数格式不合法，交给视图返回 400
+                version = None
+            except Exception as e:
+                print(f"Conditional GET version error: {e}")
+                version = None
+            if version is None:
+                return view(*args, **kwargs)
+            
+            token, last_modified = version
+            last_modified = _as_utc(last_modified)
+            if last_modified is not None and last_modified >= _as_utc(datetime.now(timezone.utc)):
+                # 最后修改仍在当前这一秒内：同一秒的后续写入不会改变秒级时间，
+                # 作为 If-Modified-Since 的依据会误判 304，此时只用 ETag
+                last_modified = None
+            etag = make_etag(token)
+            
+            if is_not_modified(etag, last_modified):
+                response = Response(status=304)
+                _set_validators(response, etag, last_modified)
+                return response
+            
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                _set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
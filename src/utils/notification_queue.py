@@ -6,37 +6,24 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 from src.config import Config
+from src.utils.redis_client import get_redis_client, is_redis_available
 
-# 尝试导入Redis和RQ
+# 尝试导入RQ
 try:
-    from redis import Redis
     from rq import Queue
-    REDIS_AVAILABLE = True
+    RQ_AVAILABLE = True
 except ImportError:
-    REDIS_AVAILABLE = False
+    RQ_AVAILABLE = False
 
 # 全局队列变量
 _notification_queue = None
 
 
 def is_queue_available() -> bool:
-    """检查队列是否可用"""
-    if not REDIS_AVAILABLE:
-        return False
-    try:
-        from redis import Redis
-        redis_conn = Redis(
-            host=Config.REDIS_HOST,
-            port=Config.REDIS_PORT,
-            db=Config.REDIS_DB,
-            decode_responses=True,
-            socket_timeout=2,
-            socket_connect_timeout=2,
-        )
-        redis_conn.ping()
-        return True
-    except Exception:
+    """检查队列是否可用（Redis 探测结果有缓存，不会每次入队都 PING）"""
+    if not RQ_AVAILABLE:
         return False
+    return is_redis_available()
 
 
 def get_notification_queue():
@@ -53,14 +40,10 @@ def get_notification_queue():
     
     if _notification_queue is None:
         try:
-            from redis import Redis
-            from rq import Queue
-            redis_conn = Redis(
-                host=Config.REDIS_HOST,
-                port=Config.REDIS_PORT,
-                db=Config.REDIS_DB,
-                decode_responses=True
-            )
+            # RQ 存储的是序列化后的 bytes，需使用不解码的连接池
+            redis_conn = get_redis_client(decode_responses=False)
+            if redis_conn is None:
+                return None
             _notification_queue = Queue('notifications', connection=redis_conn)
         except Exception:
             return None
@@ -1,47 +1,19 @@
 """速率限制工具"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
 from flask import request, g, current_app
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_limiter.errors import RateLimitExceeded
 from src.config import Config
-
-# 尝试导入Redis，如果失败则使用内存存储
-try:
-    from redis import Redis
-    REDIS_AVAILABLE = True
-except ImportError:
-    REDIS_AVAILABLE = False
+from src.utils.redis_client import get_redis_client
 
 
 def get_redis_connection():
-    """获取Redis连接"""
-    if not REDIS_AVAILABLE:
-        return None
-    try:
-        return Redis(
-            host=Config.REDIS_HOST,
-            port=Config.REDIS_PORT,
-            db=Config.REDIS_DB,
-            decode_responses=True,
-            socket_timeout=2,
-            socket_connect_timeout=2,
-        )
-    except Exception:
-        return None
-
-
-def is_redis_available():
-    """检查Redis是否可用"""
-    if not REDIS_AVAILABLE:
-        return False
-    redis_conn = get_redis_connection()
-    if redis_conn is None:
-        return False
-    try:
-        redis_conn.ping()
-        return True
-    except Exception:
-        return False
+    """获取Redis连接（共享连接池）"""
+    return get_redis_client()
 
 
 def get_rate_limit_key():
@@ -85,25 +57,118 @@ def get_branch_rate_limit_key():
     return f"{bot_key}:branch:{branch_id}"
 
 
-# 根据Redis可用性选择存储后端
-if is_redis_available():
-    # 使用Redis存储
-    limiter = Limiter(
-        app=None,
-        key_func=get_rate_limit_key,
-        storage_uri=f"redis://{Config.REDIS_HOST}:{Config.REDIS_PORT}/{Config.REDIS_DB}",
-        default_limits=["200 per day", "50 per hour"],
-        headers_enabled=True
-    )
-else:
-    # 使用内存存储（当Redis不可用时）
-    limiter = Limiter(
-        app=None,
-        key_func=get_rate_limit_key,
-        default_limits=["200 per day", "50 per hour"],
-        headers_enabled=True,
-        storage_uri="memory://"
-    )
+class ReadPrefilter:
+    """
+    公开读请求的 worker 内预过滤
+    
+    每个（限流键, 端点）在本 worker 内最多先放行 batch_size - 1 个请求而不访问限流存储，
+    直到攒满或距上次对账超过 flush_interval 秒，再把累计的请求数作为一次 cost 计入全局限额。
+    全局限额因此近似生效：每个 worker 每个键最多超出 batch_size - 1 次。
+    某个键被拒绝后，在窗口重置前不再本地放行。
+    """
+    
+    def __init__(self, batch_size: int = 10, flush_interval: float = 0.1, max_keys: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        # key -> [本地已放行未对账的请求数, 上次对账时间, 拒绝截止时间]
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def is_enabled(self) -> bool:
+        return self.batch_size > 1
+    
+    def absorb(self, key: str) -> Optional[int]:
+        """
+        本地放行时返回None；否则返回本次需要计入全局限额的 cost（含之前本地放行的请求）
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [0, now, 0.0]
+                self._entries[key] = entry
+                while len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+                return 1
+            self._entries.move_to_end(key)
+            if (
+                now >= entry[2]
+                and entry[0] < self.batch_size - 1
+                and now - entry[1] < self.flush_interval
+            ):
+                entry[0] += 1
+                return None
+            cost = entry[0] + 1
+            entry[0] = 0
+            entry[1] = now
+            return cost
+    
+    def block(self, key: str, seconds: float):
+        """键被限流后，在 seconds 秒内所有请求都交给限流存储判断"""
+        with self._lock:
+            entry = self._entries.setdefault(key, [0, 0.0, 0.0])
+            entry[2] = time.monotonic() + max(0.0, seconds)
+
+
+read_prefilter = ReadPrefilter(
+    batch_size=Config.RATE_LIMIT_READ_BATCH_SIZE,
+    flush_interval=Config.RATE_LIMIT_READ_FLUSH_INTERVAL
+)
+
+_READ_METHODS = ('GET', 'HEAD')
+
+
+def _read_prefilter_key() -> str:
+    return f"{get_rate_limit_key()}:{request.endpoint}"
+
+
+def _absorb_public_read() -> bool:
+    """Limiter 请求过滤器：读请求被本地放行时返回True（跳过本次限流存储访问）"""
+    if not read_prefilter.is_enabled() or request.method not in _READ_METHODS:
+        return False
+    cost = read_prefilter.absorb(_read_prefilter_key())
+    if cost is None:
+        return True
+    g._rate_limit_cost = cost
+    return False
+
+
+def _default_limit_cost() -> int:
+    """默认限额的 cost：读请求对账时包含本地已放行的请求数"""
+    return g.get('_rate_limit_cost', 1)
+
+
+def _on_limit_breach(request_limit):
+    """被限流后停止本地放行该键的读请求，直到窗口重置"""
+    if request.method in _READ_METHODS:
+        read_prefilter.block(_read_prefilter_key(), request_limit.reset_at - time.time())
+
+
+# 存储后端在 init_app 时按配置选择（见 configure_limiter_storage），导入时不探测 Redis
+limiter = Limiter(
+    key_func=get_rate_limit_key,
+    default_limits=["200 per day", "50 per hour"],
+    default_limits_cost=_default_limit_cost,
+    on_breach=_on_limit_breach,
+    headers_enabled=True
+)
+limiter.request_filter(_absorb_public_read)
+
+
+def get_limiter_storage_uri() -> str:
+    """默认存储：配置了 Redis 时用 failover://（Redis 不可用时退回本机 SQLite），否则用本机 SQLite"""
+    if Config.REDIS_HOST:
+        return 'failover://'
+    return f"sqlite:///{Config.RATE_LIMIT_SQLITE_PATH}"
+
+
+def configure_limiter_storage(app):
+    """在 limiter.init_app 之前调用，未显式配置 RATELIMIT_STORAGE_URI 时填入默认存储"""
+    # 注册 sqlite:// 与 failover:// 存储
+    import src.utils.rate_limit_store  # noqa: F401
+    if not app.config.get('RATELIMIT_STORAGE_URI'):
+        app.config['RATELIMIT_STORAGE_URI'] = get_limiter_storage_uri()
 
 
 # 速率限制配置
@@ -2,42 +2,114 @@
 from flask import jsonify, request, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from redis import Redis
-from src.config import Config
+from src.utils.redis_client import get_request_redis, is_redis_available, mark_redis_unavailable
+import math
+import time
 import uuid
 
 
-# 单例 Redis 连接
-_redis_client = None
+# 滑动窗口（有序集合记录窗口内每次请求的时间戳），一次往返完成检查与计数
+# KEYS[1] 限流键；ARGV: 当前毫秒时间、窗口毫秒数、上限、本次请求成员、本次消耗的次数
+# 返回 {是否放行, 剩余次数, 窗口重置的毫秒时间}；剩余次数不足 cost 时整体拒绝
+_SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[5] or '1')
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+local allowed = 0
+if count + cost <= limit then
+    for i = 1, cost do
+        redis.call('ZADD', key, now, ARGV[4] .. ':' .. i)
+    end
+    redis.call('PEXPIRE', key, window)
+    count = count + cost
+    allowed = 1
+end
+local reset = now + window
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window
+end
+return {allowed, limit - count, reset}
+"""
+
+_sliding_window_script = None
+
+# 限制字符串中的时间单位 -> 秒
+_PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
 
 
 def get_redis_connection():
-    """获取Redis连接（单例模式）"""
-    global _redis_client
-    if _redis_client is None:
-        # 检查 Redis 配置是否存在
-        if not Config.REDIS_HOST:
-            return None
-        
-        try:
-            _redis_client = Redis(
-                host=Config.REDIS_HOST,
-                port=Config.REDIS_PORT,
-                db=Config.REDIS_DB,
-                decode_responses=True,
-                socket_timeout=5,  # 5秒超时
-                socket_connect_timeout=5
-            )
-            # 测试连接
-            _redis_client.ping()
-        except Exception as e:
-            import logging
-            logging.error(f"Redis连接失败: {e}")
-            return None
-    return _redis_client
-
-
-def check_rate_limit(action: str, bot_id: uuid.UUID = None, branch_id: uuid.UUID = None, user_id: uuid.UUID = None):
+    """获取Redis连接（共享连接池，同一请求内复用）"""
+    return get_request_redis()
+
+
+def parse_rate_limit(limit: str):
+    """
+    解析限制字符串（例如 "5 per hour"、"10 per 2 minutes"）
+    
+    Returns:
+        (最大请求数, 窗口秒数)
+    """
+    parts = limit.split()
+    max_requests = int(parts[0])
+    multiplier = 1
+    unit = parts[-1].lower()
+    if len(parts) == 4:
+        multiplier = int(parts[2])
+    return max_requests, multiplier * _PERIODS[unit.rstrip('s')]
+
+
+def _sliding_window_hit(redis_client, redis_key: str, max_requests: int, window: int, cost: int = 1):
+    """
+    原子地检查并记录一次请求（消耗 cost 次额度）
+    
+    Returns:
+        (是否放行, 剩余次数, 重置时间戳（秒）)
+    """
+    global _sliding_window_script
+    if _sliding_window_script is None:
+        _sliding_window_script = redis_client.register_script(_SLIDING_WINDOW_SCRIPT)
+    now_ms = int(time.time() * 1000)
+    allowed, remaining, reset_ms = _sliding_window_script(
+        keys=[redis_key],
+        args=[now_ms, window * 1000, max_requests, f"{now_ms}:{uuid.uuid4().hex}", cost],
+        client=redis_client
+    )
+    return bool(int(allowed)), max(0, int(remaining)), math.ceil(int(reset_ms) / 1000)
+
+
+def _rate_limit_headers(info: dict) -> dict:
+    return {
+        'X-RateLimit-Limit': str(info['limit']),
+        'X-RateLimit-Remaining': str(info['remaining']),
+        'X-RateLimit-Reset': str(info['reset']),
+    }
+
+
+def apply_rate_limit_headers(response):
+    """在响应中附加本次请求手动检查的速率限制信息"""
+    info = g.get('_rate_limit_info')
+    if info:
+        for name, value in _rate_limit_headers(info).items():
+            response.headers[name] = value
+    return response
+
+
+def init_rate_limit_headers(app):
+    """注册响应钩子，输出 X-RateLimit-* 头"""
+    app.after_request(apply_rate_limit_headers)
+
+
+def check_rate_limit(action: str, bot_id: uuid.UUID = None, branch_id: uuid.UUID = None, user_id: uuid.UUID = None, cost: int = 1):
     """
     手动检查速率限制
     
@@ -46,6 +118,7 @@ def check_rate_limit(action: str, bot_id: uuid.UUID = None, branch_id: uuid.UUID
         bot_id: Bot ID（可选）
         branch_id: 分支ID（可选，用于segment:create）
         user_id: User ID（可选，用于comment:create和vote:create）
+        cost: 本次消耗的次数（批量接口按条数计），剩余额度不足时整体拒绝
     
     Returns:
         如果超过限制，返回429响应；否则返回None
@@ -76,38 +149,39 @@ def check_rate_limit(action: str, bot_id: uuid.UUID = None, branch_id: uuid.UUID
     
     # 检查速率限制
     try:
-        limit = RATE_LIMITS[action]
-        # 解析限制（例如 "2 per hour"）
-        parts = limit.split()
-        max_requests = int(parts[0])
-        
-        # 直接使用Redis来检查
-        redis_client = get_redis_connection()
-        if redis_client is None:
-            # Redis 不可用，跳过速率限制
-            return None
+        max_requests, window = parse_rate_limit(RATE_LIMITS[action])
+        redis_key = f"LIMITER:sw:{key}:{action}"
         
-        redis_key = f"LIMITER:{key}:{action}"
+        result = None
+        redis_client = get_redis_connection() if is_redis_available() else None
+        if redis_client is not None:
+            try:
+                result = _sliding_window_hit(redis_client, redis_key, max_requests, window, cost)
+            except Exception as e:
+                import logging
+                logging.warning(f"Redis速率限制检查失败，改用本机存储: {e}")
+                mark_redis_unavailable()
+        if result is None:
+            # Redis 未配置或不可用：使用本机共享存储（同一主机的 worker 共享计数）
+            from src.utils.rate_limit_store import get_local_rate_limit_store
+            result = get_local_rate_limit_store().hit_sliding_window(redis_key, max_requests, window, cost)
         
-        # 获取当前计数
-        current = redis_client.get(redis_key)
-        if current:
-            current = int(current)
-            if current >= max_requests:
-                return jsonify({
-                    'status': 'error',
-                    'error': {
-                        'code': 'RATE_LIMIT_EXCEEDED',
-                        'message': '速率限制已超出，请稍后再试'
-                    }
-                }), 429
+        allowed, remaining, reset = result
+        g._rate_limit_info = {'limit': max_requests, 'remaining': remaining, 'reset': reset}
         
-        # 增加计数
-        redis_client.incr(redis_key)
-        redis_client.expire(redis_key, 3600)  # 1小时过期
+        if not allowed:
+            response = jsonify({
+                'status': 'error',
+                'error': {
+                    'code': 'RATE_LIMIT_EXCEEDED',
+                    'message': '速率限制已超出，请稍后再试'
+                }
+            })
+            response.headers['Retry-After'] = str(max(1, reset - int(time.time())))
+            return response, 429
         
     except Exception as e:
-        # 如果Redis不可用，记录错误但不阻止请求
+        # 存储不可用时记录错误但不阻止请求
         import logging
         logging.error(f"速率限制检查失败: {e}")
         return None
@@ -0,0 +1,275 @@
+"""单机多 worker 共享的速率限制存储（SQLite WAL）"""
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+from limits.storage import Storage, RedisStorage
+from src.config import Config
+from src.utils.redis_client import get_redis_pool, is_redis_available, mark_redis_unavailable
+
+
+# 每次写入时顺带清理过期行的概率
+_CLEANUP_PROBABILITY = 0.01
+
+# 无法解析限流配置时，滑动窗口记录的保留时间（秒）
+_DEFAULT_HITS_RETENTION = 86400
+
+logger = logging.getLogger(__name__)
+
+
+def _configured_max_window() -> int:
+    """RATE_LIMITS 中最大的窗口（秒），超过它的滑动窗口记录不会再被任何 key 使用"""
+    try:
+        from src.utils.rate_limit import RATE_LIMITS
+        from src.utils.rate_limit_helper import parse_rate_limit
+        return max(parse_rate_limit(limit)[1] for limit in RATE_LIMITS.values())
+    except Exception:
+        return _DEFAULT_HITS_RETENTION
+
+
+class SQLiteRateLimitStore:
+    """
+    基于 SQLite 文件的计数存储
+    
+    同一主机上的 gunicorn worker 打开同一个文件，以 BEGIN IMMEDIATE 串行化写入，
+    因此计数在进程间共享；WAL 模式下读不阻塞写。
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._max_window = None
+    
+    def _connection(self) -> sqlite3.Connection:
+        """每个进程、每个线程一个连接（sqlite3 连接不能跨线程或 fork 共享）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_counters ('
+            'key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_limit_hits (key TEXT NOT NULL, ts REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_rate_limit_hits_key_ts ON rate_limit_hits (key, ts)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+    
+    def _write(self, fn):
+        """在写事务中执行 fn(conn)"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    
+    def _hits_retention(self, window: int = 0) -> int:
+        """滑动窗口记录的保留时间：配置中最大窗口与本进程见过的最大窗口取较大者"""
+        if self._max_window is None:
+            self._max_window = _configured_max_window()
+        self._max_window = max(self._max_window, window)
+        return self._max_window
+    
+    def _maybe_cleanup(self, conn: sqlite3.Connection, now: float, window: int = 0):
+        """按概率清理过期计数与不再落在任何窗口内的滑动窗口记录（不再被访问的 key 也会被清掉）"""
+        retention = self._hits_retention(window)
+        if random.random() < _CLEANUP_PROBABILITY:
+            conn.execute('DELETE FROM rate_limit_counters WHERE expires_at <= ?', (now,))
+            conn.execute('DELETE FROM rate_limit_hits WHERE ts <= ?', (now - retention,))
+    
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        """固定窗口计数：窗口已过期时从 amount 重新开始"""
+        now = time.time()
+        
+        def run(conn):
+            row = conn.execute(
+                'SELECT value, expires_at FROM rate_limit_counters WHERE key = ?', (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                value = row[0] + amount
+                conn.execute('UPDATE rate_limit_counters SET value = ? WHERE key = ?', (value, key))
+            else:
+                value = amount
+                conn.execute(
+                    'INSERT OR REPLACE INTO rate_limit_counters (key, value, expires_at) VALUES (?, ?, ?)',
+                    (key, value, now + expiry)
+                )
+            self._maybe_cleanup(conn, now)
+            return value
+        
+        return self._write(run)
+    
+    def get(self, key: str) -> int:
+        row = self._connection().execute(
+            'SELECT value FROM rate_limit_counters WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def get_expiry(self, key: str) -> float:
+        row = self._connection().execute(
+            'SELECT expires_at FROM rate_limit_counters WHERE key = ?', (key,)
+        ).fetchone()
+        return max(row[0], time.time()) if row else time.time()
+    
+    def clear(self, key: str):
+        self._write(lambda conn: (
+            conn.execute('DELETE FROM rate_limit_counters WHERE key = ?', (key,)),
+            conn.execute('DELETE FROM rate_limit_hits WHERE key = ?', (key,)),
+        ))
+    
+    def reset(self) -> int:
+        def run(conn):
+            count = conn.execute('SELECT COUNT(*) FROM rate_limit_counters').fetchone()[0]
+            conn.execute('DELETE FROM rate_limit_counters')
+            conn.execute('DELETE FROM rate_limit_hits')
+            return count
+        return self._write(run)
+    
+    def hit_sliding_window(self, key: str, limit: int, window: int, cost: int = 1) -> Tuple[bool, int, int]:
+        """
+        滑动窗口检查并记录一次请求，消耗 cost 次额度（与 rate_limit_helper 的 Redis 脚本语义一致）
+        
+        Returns:
+            (是否放行, 剩余次数, 重置时间戳（秒）)
+        """
+        now = time.time()
+        
+        def run(conn):
+            conn.execute('DELETE FROM rate_limit_hits WHERE key = ? AND ts <= ?', (key, now - window))
+            count = conn.execute('SELECT COUNT(*) FROM rate_limit_hits WHERE key = ?', (key,)).fetchone()[0]
+            allowed = count + cost <= limit
+            if allowed:
+                conn.executemany('INSERT INTO rate_limit_hits (key, ts) VALUES (?, ?)', [(key, now)] * cost)
+                count += cost
+            oldest = conn.execute('SELECT MIN(ts) FROM rate_limit_hits WHERE key = ?', (key,)).fetchone()[0]
+            reset = (oldest if oldest is not None else now) + window
+            self._maybe_cleanup(conn, now, window)
+            return allowed, max(0, limit - count), int(reset) + 1
+        
+        return self._write(run)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_local_rate_limit_store(path: Optional[str] = None) -> SQLiteRateLimitStore:
+    """获取指定路径（默认取应用配置的 RATE_LIMIT_SQLITE_PATH）的共享存储"""
+    if not path:
+        from flask import current_app, has_app_context
+        if has_app_context():
+            path = current_app.config.get('RATE_LIMIT_SQLITE_PATH')
+        path = path or Config.RATE_LIMIT_SQLITE_PATH
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(path, SQLiteRateLimitStore(path))
+    return store
+
+
+class SQLiteStorage(Storage):
+    """
+    Flask-Limiter 存储：sqlite:///<文件路径>
+    
+    用于未配置 Redis 的单机部署，替代按 worker 独立计数的 memory://。
+    """
+    
+    STORAGE_SCHEME = ['sqlite']
+    
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        path = uri[len('sqlite:///'):] if uri.startswith('sqlite:///') else ''
+        self.store = get_local_rate_limit_store(path or None)
+    
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+    
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        return self.store.incr(key, expiry, amount)
+    
+    def get(self, key: str) -> int:
+        return self.store.get(key)
+    
+    def get_expiry(self, key: str) -> float:
+        return self.store.get_expiry(key)
+    
+    def check(self) -> bool:
+        try:
+            self.store.get('__check__')
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def reset(self) -> Optional[int]:
+        return self.store.reset()
+    
+    def clear(self, key: str) -> None:
+        self.store.clear(key)
+
+
+class FailoverStorage(Storage):
+    """
+    Flask-Limiter 存储：failover://
+    
+    Redis 可用时使用 Redis，否则使用本机 SQLite。Redis 状态由 is_redis_available()
+    在后台探测，请求路径上不会因 PING 而阻塞；Redis 调用出错时立即切到 SQLite。
+    """
+    
+    STORAGE_SCHEME = ['failover']
+    
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+        redis_uri = f"redis://{Config.REDIS_HOST}:{Config.REDIS_PORT}/{Config.REDIS_DB}"
+        self.primary = RedisStorage(redis_uri, connection_pool=get_redis_pool())
+        self.fallback = SQLiteStorage(f"sqlite:///{Config.RATE_LIMIT_SQLITE_PATH}")
+        # 当前是否因 Redis 出错而使用本机存储（只在状态切换时记录日志）
+        self._degraded = False
+    
+    @property
+    def base_exceptions(self):
+        return Exception
+    
+    def _call(self, method: str, *args):
+        if is_redis_available():
+            try:
+                result = getattr(self.primary, method)(*args)
+            except Exception as e:
+                if not self._degraded:
+                    self._degraded = True
+                    logger.warning(f"Rate limit Redis storage error, using local storage: {e}")
+                mark_redis_unavailable()
+            else:
+                if self._degraded:
+                    self._degraded = False
+                    logger.info("Rate limit Redis storage recovered")
+                return result
+        return getattr(self.fallback, method)(*args)
+    
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        return self._call('incr', key, expiry, amount)
+    
+    def get(self, key: str) -> int:
+        return self._call('get', key)
+    
+    def get_expiry(self, key: str) -> float:
+        return self._call('get_expiry', key)
+    
+    def check(self) -> bool:
+        return self.fallback.check() or self.primary.check()
+    
+    def reset(self) -> Optional[int]:
+        return self._call('reset')
+    
+    def clear(self, key: str) -> None:
+        self._call('clear', key)
@@ -0,0 +1,143 @@
+"""Redis 客户端工厂（进程内共享连接池）"""
+import os
+import threading
+import time
+from typing import Optional, Dict, Tuple
+from src.config import Config
+
+# 尝试导入Redis，如果失败则标记为不可用
+try:
+    from redis import Redis, ConnectionPool
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+# 可用性探测结果的缓存时间（秒），避免每次入队/请求都 PING
+AVAILABILITY_CHECK_INTERVAL = 30
+
+# (pid, decode_responses) -> ConnectionPool；fork 后子进程重新建池
+_pools: Dict[Tuple[int, bool], 'ConnectionPool'] = {}
+_pools_lock = threading.Lock()
+
+# available 为None表示尚未探测完成
+_availability = {'checked_at': float('-inf'), 'available': None}
+_probe_lock = threading.Lock()
+
+
+def _reset_probe_lock_after_fork():
+    # fork 时若父进程正在探测，子进程继承的锁永远不会被释放
+    global _probe_lock
+    _probe_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_probe_lock_after_fork)
+
+
+def get_redis_pool(decode_responses: bool = True) -> Optional['ConnectionPool']:
+    """
+    获取进程级共享连接池
+
+    Args:
+        decode_responses: RQ 需要 bytes（False），其余调用方使用 str（True）
+    """
+    if not REDIS_AVAILABLE or not Config.REDIS_HOST:
+        return None
+    key = (os.getpid(), decode_responses)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    host=Config.REDIS_HOST,
+                    port=Config.REDIS_PORT,
+                    db=Config.REDIS_DB,
+                    decode_responses=decode_responses,
+                    socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT,
+                    health_check_interval=Config.REDIS_HEALTH_CHECK_INTERVAL,
+                    max_connections=Config.REDIS_MAX_CONNECTIONS,
+                )
+                _pools[key] = pool
+    return pool
+
+
+def get_redis_client(decode_responses: bool = True) -> Optional['Redis']:
+    """获取基于共享连接池的 Redis 客户端（未配置 Redis 时返回None）"""
+    pool = get_redis_pool(decode_responses)
+    if pool is None:
+        return None
+    return Redis(connection_pool=pool)
+
+
+def _probe_redis() -> bool:
+    """PING 一次并记录结果"""
+    client = get_redis_client()
+    available = False
+    if client is not None:
+        try:
+            available = bool(client.ping())
+        except Exception:
+            available = False
+    _availability['checked_at'] = time.monotonic()
+    _availability['available'] = available
+    return available
+
+
+def _start_background_probe():
+    """在后台线程中重新探测（同一时间只有一个探测线程）"""
+    if not _probe_lock.acquire(blocking=False):
+        return
+    # 先占住本周期，避免并发请求重复启动探测
+    _availability['checked_at'] = time.monotonic()
+
+    def run():
+        try:
+            _probe_redis()
+        finally:
+            _probe_lock.release()
+
+    threading.Thread(target=run, name='redis-availability-probe', daemon=True).start()
+
+
+def is_redis_available(force: bool = False) -> bool:
+    """
+    检查Redis是否可用
+
+    默认不阻塞：返回最近一次探测结果，结果超过 AVAILABILITY_CHECK_INTERVAL 秒时在后台重新探测；
+    首次探测完成前，配置了 REDIS_HOST 即视为可用（调用方出错时应调用 mark_redis_unavailable）。
+    force=True 时同步 PING。
+    """
+    if not REDIS_AVAILABLE or not Config.REDIS_HOST:
+        return False
+    if force:
+        return _probe_redis()
+    if time.monotonic() - _availability['checked_at'] >= AVAILABILITY_CHECK_INTERVAL:
+        _start_background_probe()
+    available = _availability['available']
+    return True if available is None else available
+
+
+def mark_redis_unavailable():
+    """调用方遇到连接错误时调用，使后续检查在下个周期前直接返回不可用"""
+    _availability['checked_at'] = time.monotonic()
+    _availability['available'] = False
+
+
+def get_request_redis() -> Optional['Redis']:
+    """
+    获取当前请求共用的 Redis 客户端
+
+    同一请求内的速率限制、活跃度读取共用一个客户端（连接仍按命令从共享池借还），
+    请求上下文之外退化为普通共享客户端。
+    """
+    from flask import g, has_app_context
+    if not has_app_context():
+        return get_redis_client()
+    client = g.get('_redis_client')
+    if client is None:
+        client = get_redis_client()
+        g._redis_client = client
+    return client
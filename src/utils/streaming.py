@@ -0,0 +1,55 @@
+"""流式响应工具
+
+把逐块生成的文本按需增量 gzip 压缩后输出，首字节时间和内存占用不随内容总量增长。
+"""
+import zlib
+from typing import Iterable, Iterator
+
+# gzip 容器格式（16 + 最大窗口）
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# 攒够这么多压缩后字节再输出一块，避免产生大量极小的 chunk
+DEFAULT_MIN_CHUNK_SIZE = 16 * 1024
+
+
+def encode_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    """将文本块编码为 UTF-8 字节块"""
+    for chunk in chunks:
+        if chunk:
+            yield chunk.encode('utf-8')
+
+
+def gzip_stream(
+    chunks: Iterable[str],
+    level: int = 6,
+    min_chunk_size: int = DEFAULT_MIN_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    增量 gzip 压缩
+    
+    Args:
+        chunks: 文本块迭代器
+        level: 压缩级别
+        min_chunk_size: 压缩输出攒到该大小再产出；第一个输入块压缩后立即产出
+    
+    Yields:
+        gzip 数据块，拼接后是一个完整的 gzip 流
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    buffer = bytearray()
+    first = True
+    for data in encode_chunks(chunks):
+        buffer += compressor.compress(data)
+        if first:
+            # 尽早送出首块（含 gzip 头和元数据），降低首字节时间
+            buffer += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+            yield bytes(buffer)
+            buffer.clear()
+            continue
+        if len(buffer) >= min_chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += compressor.flush(zlib.Z_FINISH)
+    if buffer:
+        yield bytes(buffer)
@@ -8,6 +8,11 @@ class TestConfig(Config):
     """测试配置"""
     TESTING = True
     DATABASE_URL = os.getenv('TEST_DATABASE_URL', 'sqlite:///./test_inkpath.db')
+    # 每个测试进程独立计数，避免跨次运行累积
+    RATELIMIT_STORAGE_URI = 'memory://'
+    RATE_LIMIT_SQLITE_PATH = ':memory:'
+    # 发件箱事件在请求内处理，测试可直接断言副作用
+    OUTBOX_DISPATCH_MODE = 'inline'
 
 
 def create_test_app():
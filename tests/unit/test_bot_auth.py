@@ -244,3 +244,107 @@ def test_get_bot_info_api_invalid_key(client, test_db):
     data = response.get_json()
     assert data['status'] == 'error'
     assert data['error']['code'] == 'UNAUTHORIZED'
+
+
+def test_authenticate_bot_migrates_legacy_bcrypt_hash(test_db):
+    """测试旧版bcrypt哈希认证通过后迁移为SHA256"""
+    import bcrypt
+    bot, _ = register_bot(
+        db=test_db,
+        name="LegacyBot",
+        model="claude-sonnet-4",
+        language="zh"
+    )
+    api_key = generate_api_key()
+    bot.api_key_hash = bcrypt.hashpw(api_key.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    test_db.commit()
+    
+    authenticated_bot = authenticate_bot(test_db, api_key)
+    
+    assert authenticated_bot is not None
+    assert authenticated_bot.id == bot.id
+    assert authenticated_bot.api_key_hash == hash_api_key(api_key)
+    # 迁移后再次认证直接命中索引
+    assert authenticate_bot(test_db, api_key).id == bot.id
+
+
+def test_authenticate_bot_suspended(test_db):
+    """测试暂停的Bot无法认证"""
+    bot, api_key = register_bot(
+        db=test_db,
+        name="SuspendedBot",
+        model="claude-sonnet-4",
+        language="zh"
+    )
+    bot.status = 'suspended'
+    test_db.commit()
+    
+    assert authenticate_bot(test_db, api_key) is None
+
+
+def test_principal_cache_lru_and_ttl():
+    """测试主体缓存的容量淘汰与过期"""
+    from src.utils.auth import PrincipalCache
+    cache = PrincipalCache(max_size=2, ttl=60)
+    cache.set('a', 'bot', 1, {'id': 1})
+    cache.set('b', 'bot', 2, {'id': 2})
+    assert cache.get('a') == {'id': 1}  # a 变为最近使用
+    cache.set('c', 'bot', 3, {'id': 3})
+    
+    assert cache.get('b') is None  # b 被淘汰
+    assert cache.get('c') == {'id': 3}
+    assert cache.invalidate_principal('bot', 1) == 1
+    assert cache.get('a') is None
+    
+    expired = PrincipalCache(max_size=2, ttl=0)
+    expired.set('a', 'bot', 1, {'id': 1})
+    assert expired.get('a') is None
+    
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+
+
+def test_authenticate_bot_cached(test_db):
+    """测试Bot认证缓存命中与失效"""
+    from src.utils.auth import authenticate_bot_cached, invalidate_bot_principal, principal_cache
+    bot, api_key = register_bot(
+        db=test_db,
+        name="CachedBot",
+        model="claude-sonnet-4",
+        language="zh"
+    )
+    
+    assert authenticate_bot_cached(test_db, api_key).id == bot.id
+    hits = principal_cache.hits
+    assert authenticate_bot_cached(test_db, api_key).id == bot.id
+    assert principal_cache.hits == hits + 1
+    
+    # 暂停后失效缓存，不再认证通过
+    bot.status = 'suspended'
+    test_db.commit()
+    invalidate_bot_principal(bot.id)
+    assert authenticate_bot_cached(test_db, api_key) is None
+
+
+def test_principal_invalidation_from_other_worker(test_db):
+    """测试其他 worker 广播的主体失效会清除本 worker 的缓存"""
+    from src.utils.auth import authenticate_bot_cached, principal_cache, _on_principal_invalidation
+    bot, api_key = register_bot(
+        db=test_db,
+        name="BroadcastBot",
+        model="claude-sonnet-4",
+        language="zh"
+    )
+    
+    authenticate_bot_cached(test_db, api_key)
+    assert principal_cache.invalidate_principal('bot', bot.id) == 1
+    
+    authenticate_bot_cached(test_db, api_key)
+    _on_principal_invalidation(f"bot:{bot.id}")
+    assert principal_cache.invalidate_principal('bot', bot.id) == 0
+    
+    authenticate_bot_cached(test_db, api_key)
+    _on_principal_invalidation('*')
+    assert principal_cache.stats()['size'] == 0
+
@@ -184,6 +184,72 @@ def test_get_branch_tree(test_db, test_story, test_bot):
     assert isinstance(tree, list)
 
 
+def test_get_branch_tree_max_depth(test_db, test_story, test_bot):
+    """测试分支树的层数限制与子树加载"""
+    bot, _ = test_bot
+    
+    parent_branch = create_branch(
+        db=test_db, story_id=test_story.id, title="父分支", description="描述", creator_bot_id=bot.id
+    )
+    child_branch = create_branch(
+        db=test_db, story_id=test_story.id, title="子分支", description="描述",
+        creator_bot_id=bot.id, parent_branch_id=parent_branch.id
+    )
+    grandchild_branch = create_branch(
+        db=test_db, story_id=test_story.id, title="孙分支", description="描述",
+        creator_bot_id=bot.id, parent_branch_id=child_branch.id
+    )
+    
+    tree = get_branch_tree(test_db, test_story.id)
+    parent_node = next(n for n in tree if n['id'] == str(parent_branch.id))
+    assert parent_node['children_count'] == 1
+    assert parent_node['children'][0]['id'] == str(child_branch.id)
+    assert parent_node['children'][0]['children'][0]['id'] == str(grandchild_branch.id)
+    
+    tree = get_branch_tree(test_db, test_story.id, max_depth=1)
+    parent_node = next(n for n in tree if n['id'] == str(parent_branch.id))
+    assert parent_node['children'] == []
+    assert parent_node['children_count'] == 1
+    
+    subtree = get_branch_tree(test_db, test_story.id, max_depth=1, root_branch_id=child_branch.id)
+    assert [n['id'] for n in subtree] == [str(grandchild_branch.id)]
+    
+    # 新建分支使故事代数递增，缓存的邻接表随之失效
+    sibling_branch = create_branch(
+        db=test_db, story_id=test_story.id, title="子分支2", description="描述",
+        creator_bot_id=bot.id, parent_branch_id=parent_branch.id
+    )
+    tree = get_branch_tree(test_db, test_story.id, max_depth=2)
+    parent_node = next(n for n in tree if n['id'] == str(parent_branch.id))
+    assert {n['id'] for n in parent_node['children']} == {str(child_branch.id), str(sibling_branch.id)}
+
+
+def test_get_branch_tree_cached(test_db, test_story, test_bot):
+    """测试分支树邻接表命中缓存时不再查询数据库"""
+    from sqlalchemy import event
+    from src.utils.cache import cache_service
+    bot, _ = test_bot
+    if not cache_service.is_enabled():
+        pytest.skip("缓存不可用")
+    
+    create_branch(db=test_db, story_id=test_story.id, title="缓存分支", description="描述", creator_bot_id=bot.id)
+    get_branch_tree(test_db, test_story.id)
+    
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    engine = test_db.get_bind()
+    event.listen(engine, 'before_cursor_execute', count_statements)
+    try:
+        tree = get_branch_tree(test_db, test_story.id, max_depth=1)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statements)
+    
+    assert any(n['title'] == "缓存分支" for n in tree)
+    assert not any('FROM branches' in s for s in statements)
+
+
 def test_join_branch(test_db, test_story, test_bot):
     """测试Bot加入分支"""
     bot, _ = test_bot
@@ -271,6 +337,78 @@ def test_leave_branch(test_db, test_story, test_bot):
     assert membership is None
 
 
+def test_branch_counters_maintained_on_write(test_db, test_story, test_bot):
+    """测试续写/加入/离开时同步维护分支与故事计数"""
+    from src.services.segment_service import create_segment
+    bot1, _ = test_bot
+    
+    branch = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="计数测试分支",
+        description="描述",
+        creator_bot_id=bot1.id
+    )
+    bot2, _ = register_bot(
+        db=test_db,
+        name="BranchTestBot2",
+        model="gpt-4",
+        language="zh"
+    )
+    join_branch(test_db, branch.id, bot2.id)
+    for _ in range(2):
+        create_segment(test_db, branch.id, bot1.id, "计数测试续写内容。" * 20)
+    
+    test_db.refresh(branch)
+    test_db.refresh(test_story)
+    assert branch.segments_count == 2
+    assert branch.active_bots_count == 2
+    assert branch.last_sequence_order == 2
+    assert branch.last_segment_at is not None
+    # 主干线 + 新分支；bot1 同时在两个分支中只计一次
+    assert test_story.branches_count == 2
+    assert test_story.segments_count == 2
+    assert test_story.bots_count == 2
+    
+    leave_branch(test_db, branch.id, bot2.id)
+    test_db.refresh(branch)
+    test_db.refresh(test_story)
+    assert branch.active_bots_count == 1
+    assert test_story.bots_count == 1
+
+
+def test_reconcile_counters(test_db, test_story, test_bot):
+    """测试计数校正修复绕过写路径产生的偏差"""
+    from src.services.counter_service import reconcile_counters
+    bot, _ = test_bot
+    
+    branch = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="校正测试分支",
+        description="描述",
+        creator_bot_id=bot.id
+    )
+    # 直接写表，不经过计数维护
+    test_db.add(Segment(branch_id=branch.id, bot_id=bot.id, content="内容", sequence_order=1))
+    test_db.commit()
+    test_db.refresh(test_story)
+    updated_at = test_story.updated_at
+    
+    results = reconcile_counters(test_db)
+    
+    assert results['branches_fixed'] == 1
+    assert results['stories_fixed'] == 1
+    test_db.refresh(branch)
+    test_db.refresh(test_story)
+    assert branch.segments_count == 1
+    assert branch.last_sequence_order == 1
+    assert test_story.segments_count == 1
+    assert test_story.updated_at == updated_at
+    
+    assert reconcile_counters(test_db)['branches_fixed'] == 0
+
+
 def test_get_next_bot_in_queue_empty(test_db, test_story, test_bot):
     """测试空队列获取下一个Bot"""
     bot, _ = test_bot
@@ -319,6 +457,9 @@ def test_get_next_bot_in_queue_rotation(test_db, test_story, test_bot):
         sequence_order=1
     )
     test_db.add(segment1)
+    # 直接插入续写段时同步维护分支计数（轮次按计数器计算）
+    from src.services.counter_service import record_segments_added
+    record_segments_added(test_db, branch.id, last_sequence_order=1, story_id=test_story.id)
     test_db.commit()
     
     # 获取下一个Bot（应该是Bot2）
@@ -328,6 +469,30 @@ def test_get_next_bot_in_queue_rotation(test_db, test_story, test_bot):
     assert next_bot.id == bot2.id
 
 
+def test_get_next_bot_in_queue_follows_counter(test_db, test_story, test_bot):
+    """测试轮次按分支段数计数器轮转"""
+    from src.services.segment_service import create_segment
+    bot1, _ = test_bot
+    
+    branch = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="计数轮转分支",
+        description="描述",
+        creator_bot_id=bot1.id
+    )
+    bot2, _ = register_bot(db=test_db, name="BranchTestBot3", model="gpt-4", language="zh")
+    join_branch(test_db, branch.id, bot2.id)
+    
+    assert get_next_bot_in_queue(test_db, branch.id).id == bot1.id
+    create_segment(test_db, branch.id, bot1.id, "第一段轮转续写内容。" * 20)
+    assert get_next_bot_in_queue(test_db, branch.id).id == bot2.id
+    create_segment(test_db, branch.id, bot2.id, "第二段轮转续写内容。" * 20)
+    assert get_next_bot_in_queue(test_db, branch.id).id == bot1.id
+    
+    assert get_next_bot_in_queue(test_db, uuid.uuid4()) is None
+
+
 def test_create_branch_api(client, test_db, test_story, test_bot):
     """测试创建分支API"""
     bot, api_key = test_bot
@@ -491,3 +656,178 @@ def test_get_next_bot_api(client, test_db, test_story, test_bot):
     assert data['status'] == 'success'
     assert 'bot' in data['data']
     assert data['data']['bot']['id'] == str(bot.id)  # 应该是第一个Bot
+
+
+def test_get_branch_full_story_stream(client, test_db, test_story, test_bot):
+    """测试完整故事流式输出（JSON / NDJSON / 增量 gzip）"""
+    import gzip
+    import json
+    from src.services.segment_service import create_segment
+    bot, _ = test_bot
+    
+    branch = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="流式测试分支",
+        description="描述",
+        creator_bot_id=bot.id
+    )
+    for i in range(3):
+        create_segment(test_db, branch.id, bot.id, f"第{i+1}段流式续写内容。" * 20)
+    
+    plain = client.get(f'/api/v1/branches/{branch.id}/full-story').get_json()
+    streamed = client.get(f'/api/v1/branches/{branch.id}/full-story?stream=json').get_json()
+    assert streamed == plain
+    
+    response = client.get(
+        f'/api/v1/branches/{branch.id}/full-story?stream=ndjson',
+        headers={'Accept-Encoding': 'gzip'}
+    )
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+    assert lines[0]['type'] == 'meta'
+    assert [line['sequence_order'] for line in lines[1:-1]] == [1, 2, 3]
+    assert lines[-1] == {'type': 'end', 'segments_count': 3}
+
+
+def test_gzip_stream_yields_first_chunk_early():
+    """测试增量 gzip 在消费完输入之前就产出首块"""
+    import gzip
+    from src.utils.streaming import gzip_stream
+    
+    consumed = []
+    
+    def chunks():
+        for i in range(20):
+            consumed.append(i)
+            yield f'{{"n": {i}}}\n'
+    
+    stream = gzip_stream(chunks())
+    first = next(stream)
+    assert first[:2] == b'\x1f\x8b'
+    assert consumed == [0]
+    
+    body = first + b''.join(stream)
+    assert gzip.decompress(body).decode('utf-8') == ''.join(f'{{"n": {i}}}\n' for i in range(20))
+
+
+def test_get_branch_full_story_etag(client, test_db, test_story, test_bot):
+    """测试完整故事的 ETag 与 304"""
+    from src.services.segment_service import create_segment
+    bot, _ = test_bot
+    
+    branch = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="ETag测试分支",
+        description="描述",
+        creator_bot_id=bot.id
+    )
+    create_segment(test_db, branch.id, bot.id, "第一段校验续写内容。" * 20)
+    url = f'/api/v1/branches/{branch.id}/full-story'
+    
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    # 压缩与未压缩是不同表示
+    assert client.get(url).headers['ETag'] != etag
+    
+    response = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    
+    # 产物缓存失效（例如过期）后，条件请求不读取续写段即可应答 304
+    from sqlalchemy import event
+    from src.utils.cache import cache_service
+    cache_service.delete_pattern('full_story:*')
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    engine = test_db.get_bind()
+    event.listen(engine, 'before_cursor_execute', count_statements)
+    try:
+        response = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statements)
+    assert response.status_code == 304
+    assert not any('FROM segments' in s for s in statements)
+    
+    create_segment(test_db, branch.id, bot.id, "第二段校验续写内容。" * 20)
+    response = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_get_branch_full_story_include_ancestors(client, test_db, test_story, test_bot):
+    """测试分叉分支的物化祖先路径与继承前缀"""
+    import json
+    from src.services.segment_service import create_segment
+    bot, _ = test_bot
+    
+    root = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="根分支",
+        description="描述",
+        creator_bot_id=bot.id
+    )
+    root_segments = [
+        create_segment(test_db, root.id, bot.id, f"根分支第{i+1}段续写内容。" * 20)
+        for i in range(3)
+    ]
+    assert root.lineage == []
+    
+    child = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="分叉分支",
+        description="描述",
+        creator_bot_id=bot.id,
+        fork_at_segment_id=root_segments[1].id,
+        parent_branch_id=root.id
+    )
+    assert child.lineage == [{'branch_id': str(root.id), 'up_to_sequence': 2}]
+    child_segment = create_segment(test_db, child.id, bot.id, "分叉分支第一段续写内容。" * 20)
+    
+    grandchild = create_branch(
+        db=test_db,
+        story_id=test_story.id,
+        title="孙分支",
+        description="描述",
+        creator_bot_id=bot.id,
+        parent_branch_id=child.id
+    )
+    assert grandchild.lineage == [
+        {'branch_id': str(root.id), 'up_to_sequence': 2},
+        {'branch_id': str(child.id), 'up_to_sequence': 1},
+    ]
+    own_segment = create_segment(test_db, grandchild.id, bot.id, "孙分支第一段续写内容。" * 20)
+    
+    expected = [str(root_segments[0].id), str(root_segments[1].id), str(child_segment.id), str(own_segment.id)]
+    
+    response = client.get(f'/api/v1/branches/{grandchild.id}/full-story?include_ancestors=true')
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert [s['id'] for s in data['segments']] == expected
+    assert data['segments'][0]['branch_id'] == str(root.id)
+    assert data['segments_count'] == 4
+    
+    response = client.get(f'/api/v1/branches/{grandchild.id}/full-story?include_ancestors=true&stream=ndjson')
+    lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [l['id'] for l in lines if l['type'] == 'segment'] == expected
+    
+    # 默认只返回本分支的续写段
+    response = client.get(f'/api/v1/branches/{grandchild.id}/full-story')
+    assert [s['id'] for s in response.get_json()['data']['segments']] == [str(own_segment.id)]
+    
+    # 编辑祖先续写段后（只递增祖先分支代数），子孙分支不再返回缓存的旧内容
+    from src.utils.cache import cache_service
+    url = f'/api/v1/branches/{grandchild.id}/full-story?include_ancestors=true'
+    etag = client.get(url).headers['ETag']
+    root_segments[0].content = "编辑后的根分支续写内容。" * 20
+    test_db.commit()
+    cache_service.invalidate_segment(root_segments[0].id, root.id)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['data']['segments'][0]['content'] == "编辑后的根分支续写内容。" * 20
@@ -0,0 +1,347 @@
+"""缓存工具测试"""
+import time
+from src.utils.cache import LocalLRUCache
+
+
+def test_local_lru_cache_eviction():
+    """测试L1缓存按容量淘汰最久未使用的键"""
+    cache = LocalLRUCache(max_size=2, ttl=60)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    cache.set('c', '3')
+    
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+
+
+def test_local_lru_cache_ttl():
+    """测试L1缓存TTL不超过自身上限且会过期"""
+    cache = LocalLRUCache(max_size=10, ttl=1)
+    cache.set('a', '1', ttl=300)
+    assert cache.get('a') == '1'
+    time.sleep(1.1)
+    assert cache.get('a') is None
+
+
+def test_local_lru_cache_delete_and_clear():
+    """测试L1缓存删除与清空"""
+    cache = LocalLRUCache(max_size=10, ttl=60)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.delete('a')
+    assert cache.get('a') is None
+    cache.clear()
+    assert cache.get('b') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_redis_client_shared_pool(monkeypatch):
+    """测试Redis客户端共用进程级连接池"""
+    from src.config import Config
+    from src.utils import redis_client
+    
+    monkeypatch.setattr(Config, 'REDIS_HOST', '')
+    assert redis_client.get_redis_client() is None
+    
+    monkeypatch.setattr(Config, 'REDIS_HOST', 'redis.invalid')
+    monkeypatch.setattr(redis_client, '_pools', {})
+    client1 = redis_client.get_redis_client()
+    client2 = redis_client.get_redis_client()
+    assert client1.connection_pool is client2.connection_pool
+    assert redis_client.get_redis_client(decode_responses=False).connection_pool is not client1.connection_pool
+
+
+class _DictCache:
+    """测试用的内存缓存，替代 cache_service"""
+    
+    def __init__(self):
+        self.data = {}
+    
+    def is_enabled(self):
+        return True
+    
+    def get(self, key):
+        return self.data.get(key)
+    
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+        return True
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """测试并发调用同一键时只执行一次计算"""
+    import threading
+    from src.utils.cache import SingleFlight
+    
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+    
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return 'value'
+    
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', compute)))
+    leader.start()
+    started.wait(2)
+    assert flight.in_flight('k')
+    
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', compute))) for _ in range(5)]
+    for t in followers:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in [leader] + followers:
+        t.join(2)
+    
+    assert len(calls) == 1
+    assert results == ['value'] * 6
+    assert not flight.in_flight('k')
+
+
+def test_cached_serves_stale_value_during_grace(monkeypatch):
+    """测试过期进入宽限期后返回旧值，且仅在无刷新进行时重新计算"""
+    from src.utils import cache as cache_module
+    
+    fake = _DictCache()
+    monkeypatch.setattr(cache_module, 'cache_service', fake)
+    calls = []
+    
+    @cache_module.cached(ttl=60, key_prefix='test:stale', stale_ttl=60)
+    def compute(x):
+        calls.append(x)
+        return len(calls)
+    
+    assert compute(1) == 1
+    assert compute(1) == 1
+    assert len(calls) == 1
+    
+    # 使条目过期：有刷新在进行时直接返回旧值
+    key = next(iter(fake.data))
+    fake.data[key]['fresh_until'] = time.time() - 1
+    monkeypatch.setattr(cache_module._single_flight, 'in_flight', lambda k: True)
+    assert compute(1) == 1
+    assert len(calls) == 1
+    
+    # 无刷新进行时由当前调用方重新计算
+    monkeypatch.undo()
+    monkeypatch.setattr(cache_module, 'cache_service', fake)
+    assert compute(1) == 2
+    assert fake.data[key]['fresh_until'] > time.time()
+
+
+def test_circuit_breaker_opens_and_recovers():
+    """测试熔断器连续失败后断开，恢复时间后放行单个探测并在成功时闭合"""
+    from src.utils.cache import CircuitBreaker
+    
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.2)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    
+    time.sleep(0.25)
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 探测进行中，不放行其他请求
+    assert not breaker.allow_request()
+    
+    # 探测失败重新断开
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    
+    time.sleep(0.25)
+    assert breaker.allow_request()
+    assert breaker.record_success() is True
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()['trips'] == 2
+
+
+def test_cache_service_recovers_after_redis_error():
+    """测试后端短暂故障后缓存服务自动恢复"""
+    from src.utils.cache import CacheService, CircuitBreaker, MemoryCacheBackend
+    
+    class FlakyBackend(MemoryCacheBackend):
+        fail = True
+        
+        def get(self, key):
+            if self.fail:
+                raise ConnectionError('down')
+            return super().get(key)
+    
+    backend = FlakyBackend()
+    service = CacheService(backend=backend)
+    service.breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.2)
+    
+    assert service.get('k') is None
+    assert service.breaker.state == CircuitBreaker.OPEN
+    assert not service.is_enabled()
+    
+    backend.fail = False
+    backend.setex('k', 60, '{"a": 1}')
+    time.sleep(0.25)
+    assert service.is_enabled()
+    assert service.get('k') == {'a': 1}
+    assert service.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_invalidation_handlers_across_workers():
+    """测试失效频道上的自定义消息分发到其他 worker 的回调"""
+    import queue
+    from src.utils.cache import CacheService, MemoryCacheBackend, INVALIDATE_ALL
+    
+    subscribers = []
+    
+    class FakePubSub:
+        def __init__(self):
+            self.messages = queue.Queue()
+        
+        def subscribe(self, channel):
+            subscribers.append(self)
+        
+        def get_message(self, timeout=None):
+            try:
+                return {'data': self.messages.get(timeout=timeout)}
+            except queue.Empty:
+                return None
+    
+    class SharedBackend(MemoryCacheBackend):
+        shared = True
+        
+        def publish(self, channel, message):
+            for subscriber in list(subscribers):
+                subscriber.messages.put(message.encode('utf-8'))
+        
+        def pubsub(self):
+            return FakePubSub()
+    
+    backend = SharedBackend()
+    worker_a = CacheService(backend=backend)
+    worker_b = CacheService(backend=backend)
+    received = []
+    worker_a.register_invalidation_handler('principal:', received.append)
+    worker_b.register_invalidation_handler('principal:', received.append)
+    worker_a.ensure_invalidation_listener()
+    worker_b.ensure_invalidation_listener()
+    
+    deadline = time.monotonic() + 2
+    while len(subscribers) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    worker_a.publish_invalidation('principal:bot:123')
+    deadline = time.monotonic() + 2
+    while 'bot:123' not in received and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    # 只有另一个 worker 收到（发送方跳过自己的消息）
+    assert received.count('bot:123') == 1
+    assert INVALIDATE_ALL in received  # 启动监听时清空继承的状态
+
+
+def test_memory_backend_generations_and_locks():
+    """测试进程内后端上的代数失效与锁"""
+    from src.utils.cache import CacheService, MemoryCacheBackend, NullCacheBackend
+    
+    service = CacheService(backend=MemoryCacheBackend(max_size=100, max_ttl=60))
+    assert service.is_enabled()
+    assert service.stats()['backend'] == 'memory'
+    
+    service.set('story:x', {'title': 'a'}, ttl=300)
+    assert service.get('story:x') == {'title': 'a'}
+    assert service.get_generation('branch', 'b1') == 0
+    assert service.bump_generation('branch', 'b1') == 1
+    assert service.get_generation('branch', 'b1') == 1
+    assert service.delete_pattern('story:*') == 1
+    assert service.get('story:x') is None
+    
+    token = service.acquire_lock('job', timeout=5)
+    assert token
+    assert service.acquire_lock('job', timeout=5) is None
+    service.release_lock('job', 'other-token')
+    assert service.acquire_lock('job', timeout=5) is None
+    service.release_lock('job', token)
+    assert service.acquire_lock('job', timeout=5)
+    
+    null_service = CacheService(backend=NullCacheBackend())
+    assert not null_service.is_enabled()
+    assert null_service.set('k', 1) is False
+    assert null_service.get('k') is None
+    assert null_service.bump_generation('branch', 'b1') == 0
+
+
+def test_bump_generation_changes_only_its_namespace(monkeypatch):
+    """测试递增代数只改变对应命名空间的缓存键"""
+    import src.utils.cache as cache_module
+    from src.utils.cache import CacheService, MemoryCacheBackend, cache_key
+    
+    service = CacheService(backend=MemoryCacheBackend(max_size=100, max_ttl=60))
+    monkeypatch.setattr(cache_module, 'cache_service', service)
+    
+    before = {
+        'segments': cache_key('segments:branch', 'b1', 1, 20),
+        'segments_other': cache_key('segments:branch', 'b2', 1, 20),
+        'story': cache_key('story', 's1'),
+        'list': cache_key('stories:list', None, 20, 0),
+        'plain': cache_key('misc', 'b1'),
+    }
+    assert 'g0' in before['segments']
+    
+    service.bump_generation('branch', 'b1')
+    assert cache_key('segments:branch', 'b1', 1, 20) != before['segments']
+    assert 'g1' in cache_key('comments:branch', 'b1')
+    # 其他分支、其他命名空间与未登记的前缀不受影响
+    assert cache_key('segments:branch', 'b2', 1, 20) == before['segments_other']
+    assert cache_key('story', 's1') == before['story']
+    assert cache_key('stories:list', None, 20, 0) == before['list']
+    assert cache_key('misc', 'b1') == before['plain']
+    
+    # 全局命名空间
+    service.bump_generation('stories')
+    assert cache_key('stories:list', None, 20, 0) != before['list']
+    assert cache_key('story', 's1') == before['story']
+
+
+def test_memory_backend_lru_and_ttl_cap():
+    """测试进程内后端按容量淘汰并限制TTL上限"""
+    from src.utils.cache import MemoryCacheBackend
+    
+    backend = MemoryCacheBackend(max_size=2, max_ttl=1)
+    backend.setex('a', 300, '1')
+    backend.setex('b', 300, '2')
+    backend.get('a')
+    backend.setex('c', 300, '3')
+    assert backend.get('b') is None
+    assert backend.get('a') == '1'
+    time.sleep(1.1)
+    assert backend.get('a') is None
+
+
+def test_cache_serializer_formats_and_compression():
+    """测试序列化格式标记、压缩阈值与旧版json值兼容"""
+    from src.utils.cache import CacheSerializer
+    
+    value = {'segments': [{'id': i, 'content': '续写内容' * 50} for i in range(20)], 'total': 20}
+    
+    for fmt in ('json', 'orjson'):
+        serializer = CacheSerializer(fmt=fmt, compress_threshold=1024)
+        small = serializer.dumps({'a': 1})
+        assert small[:1] in (CacheSerializer.JSON, CacheSerializer.ORJSON)
+        assert serializer.loads(small) == {'a': 1}
+        
+        large = serializer.dumps(value)
+        assert large[:1] == CacheSerializer.ZLIB
+        assert len(large) < len(CacheSerializer(fmt=fmt, compress_threshold=0).dumps(value))
+        assert serializer.loads(large) == value
+    
+    # 旧版值为无标记的 json 字符串
+    assert CacheSerializer().loads('{"ids": ["x"]}') == {'ids': ['x']}
+    # 超出 orjson 范围的整数退回 json
+    serializer = CacheSerializer(fmt='orjson', compress_threshold=0)
+    assert serializer.loads(serializer.dumps({'n': 2 ** 70})) == {'n': 2 ** 70}
@@ -207,3 +207,26 @@ def test_check_bot_timeouts_api_unauthorized(client):
     data = response.get_json()
     assert data['status'] == 'error'
     assert data['error']['code'] == 'UNAUTHORIZED'
+
+
+def test_cleanup_expired_data_purges_processed_outbox_events(test_db):
+    """测试清理任务按保留期删除已处理的发件箱事件"""
+    from src.models.outbox_event import OutboxEvent
+    from src.services.cron_service import cleanup_expired_data
+    now = datetime.utcnow()
+    old = now - timedelta(days=60)
+    test_db.add_all([
+        OutboxEvent(event_type='segment.created', payload={}, status='done', processed_at=old),
+        OutboxEvent(event_type='segment.created', payload={}, status='done', processed_at=now),
+        OutboxEvent(event_type='segment.created', payload={}, status='failed', created_at=old),
+        OutboxEvent(event_type='segment.created', payload={}, status='failed', created_at=now),
+        OutboxEvent(event_type='segment.created', payload={}, status='pending', created_at=old),
+    ])
+    test_db.commit()
+    
+    results = cleanup_expired_data(test_db)
+    
+    assert results['errors'] == []
+    assert results['cleaned_items'] == [{'type': 'outbox_events', 'deleted': {'done': 1, 'failed': 1}}]
+    remaining = sorted(e.status for e in test_db.query(OutboxEvent).all())
+    assert remaining == ['done', 'failed', 'pending']
@@ -20,3 +20,14 @@ def test_health_check(client):
     assert data['status'] == 'success'
     assert 'message' in data
     assert 'version' in data
+
+
+def test_health_metrics(client):
+    """测试缓存统计端点"""
+    response = client.get('/api/v1/health/metrics')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert 'hits' in data['data']['auth_cache']
+    assert 'misses' in data['data']['auth_cache']
+    assert 'cache_l1' in data['data']
+    assert data['data']['cache']['breaker']['state'] in ('closed', 'open', 'half_open')
@@ -392,3 +392,203 @@ def test_segment_rate_limit_per_branch(client, test_db, test_story, test_bot, re
         json={'content': content5}
     )
     assert response5.status_code == 201
+
+
+class _FakeScriptRedis:
+    """用 Python 模拟滑动窗口脚本的 Redis 替身"""
+    
+    def __init__(self):
+        self.windows = {}
+    
+    def register_script(self, source):
+        def run(keys, args, client=None):
+            now, window, limit, member = int(args[0]), int(args[1]), int(args[2]), args[3]
+            entries = [t for t in client.windows.get(keys[0], []) if t > now - window]
+            allowed = 0
+            if len(entries) < limit:
+                entries.append(now)
+                allowed = 1
+            client.windows[keys[0]] = entries
+            return [allowed, limit - len(entries), min(entries) + window]
+        return run
+
+
+def test_parse_rate_limit():
+    """测试解析限制字符串"""
+    from src.utils.rate_limit_helper import parse_rate_limit
+    
+    assert parse_rate_limit('5 per hour') == (5, 3600)
+    assert parse_rate_limit('200 per day') == (200, 86400)
+    assert parse_rate_limit('10 per 2 minutes') == (10, 120)
+
+
+def test_check_rate_limit_sliding_window_headers(monkeypatch):
+    """测试手动限流原子检查、429响应与 X-RateLimit-* 头"""
+    from flask import Flask, g
+    from src.utils import rate_limit_helper
+    
+    fake = _FakeScriptRedis()
+    monkeypatch.setattr(rate_limit_helper, 'get_redis_connection', lambda: fake)
+    monkeypatch.setattr(rate_limit_helper, 'is_redis_available', lambda: True)
+    monkeypatch.setattr(rate_limit_helper, '_sliding_window_script', None)
+    
+    app = Flask(__name__)
+    rate_limit_helper.init_rate_limit_headers(app)
+    
+    @app.route('/join')
+    def join():
+        result = rate_limit_helper.check_rate_limit('branch:join', bot_id='bot-1')
+        if result:
+            return result
+        return 'ok'
+    
+    client = app.test_client()
+    for i in range(5):
+        response = client.get('/join')
+        assert response.status_code == 200
+        assert response.headers['X-RateLimit-Limit'] == '5'
+        assert response.headers['X-RateLimit-Remaining'] == str(4 - i)
+    
+    response = client.get('/join')
+    assert response.status_code == 429
+    assert response.get_json()['error']['code'] == 'RATE_LIMIT_EXCEEDED'
+    assert response.headers['X-RateLimit-Remaining'] == '0'
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_local_rate_limit_store_shared_between_connections(tmp_path):
+    """测试本机SQLite存储在不同连接（模拟不同worker）间共享计数"""
+    from src.utils.rate_limit_store import SQLiteRateLimitStore
+    
+    path = str(tmp_path / 'limits.db')
+    worker1 = SQLiteRateLimitStore(path)
+    worker2 = SQLiteRateLimitStore(path)
+    
+    assert worker1.incr('k', 60) == 1
+    assert worker2.incr('k', 60) == 2
+    assert worker1.get('k') == 2
+    assert worker2.get_expiry('k') > time.time()
+    
+    assert worker1.hit_sliding_window('w', 2, 60)[:2] == (True, 1)
+    assert worker2.hit_sliding_window('w', 2, 60)[:2] == (True, 0)
+    allowed, remaining, reset = worker1.hit_sliding_window('w', 2, 60)
+    assert not allowed and remaining == 0 and reset > time.time()
+    
+    worker2.clear('k')
+    assert worker1.get('k') == 0
+
+
+def test_local_rate_limit_store_prunes_abandoned_sliding_window_keys(tmp_path, monkeypatch):
+    """测试清理会删除不再被访问的 key 的过期滑动窗口记录"""
+    from src.utils import rate_limit_store
+    from src.utils.rate_limit_store import SQLiteRateLimitStore
+    
+    store = SQLiteRateLimitStore(str(tmp_path / 'limits.db'))
+    store.hit_sliding_window('abandoned', 5, 60)
+    conn = store._connection()
+    conn.execute('UPDATE rate_limit_hits SET ts = ts - ?', (store._hits_retention() + 1,))
+    
+    monkeypatch.setattr(rate_limit_store, '_CLEANUP_PROBABILITY', 1.0)
+    store.hit_sliding_window('active', 5, 60)
+    
+    keys = [row[0] for row in conn.execute('SELECT key FROM rate_limit_hits')]
+    assert keys == ['active']
+
+
+def test_failover_storage_logs_once_per_state_change(monkeypatch, caplog):
+    """测试 Redis 连续出错时只在切换状态时记录一次日志"""
+    import logging
+    from src.utils import rate_limit_store
+    
+    class Broken:
+        def get(self, key):
+            raise ConnectionError('down')
+    
+    class Local:
+        def get(self, key):
+            return 7
+    
+    storage = rate_limit_store.FailoverStorage.__new__(rate_limit_store.FailoverStorage)
+    storage.primary, storage.fallback, storage._degraded = Broken(), Local(), False
+    monkeypatch.setattr(rate_limit_store, 'is_redis_available', lambda: True)
+    monkeypatch.setattr(rate_limit_store, 'mark_redis_unavailable', lambda: None)
+    
+    with caplog.at_level(logging.WARNING, logger=rate_limit_store.__name__):
+        assert storage.get('k') == 7
+        assert storage.get('k') == 7
+    assert len([r for r in caplog.records if r.levelno == logging.WARNING]) == 1
+
+
+def test_check_rate_limit_falls_back_to_local_store(tmp_path, monkeypatch):
+    """测试Redis未配置时手动限流使用本机存储而不是跳过"""
+    from flask import Flask
+    from src.utils import rate_limit_helper
+    
+    monkeypatch.setattr(rate_limit_helper, 'is_redis_available', lambda: False)
+    app = Flask(__name__)
+    app.config['RATE_LIMIT_SQLITE_PATH'] = str(tmp_path / 'limits.db')
+    
+    with app.test_request_context('/'):
+        results = [rate_limit_helper.check_rate_limit('branch:create', bot_id='bot-1') for _ in range(2)]
+    assert results[0] is None
+    assert results[1][1] == 429
+
+
+def test_check_rate_limit_charges_cost(tmp_path, monkeypatch):
+    """测试批量请求按条数消耗额度，剩余额度不足时整批拒绝"""
+    from flask import Flask
+    from src.utils import rate_limit_helper
+    
+    monkeypatch.setattr(rate_limit_helper, 'is_redis_available', lambda: False)
+    app = Flask(__name__)
+    app.config['RATE_LIMIT_SQLITE_PATH'] = str(tmp_path / 'limits.db')
+    
+    kwargs = {'bot_id': 'bot-1', 'branch_id': 'branch-1'}
+    with app.test_request_context('/'):
+        assert rate_limit_helper.check_rate_limit('segment:create', cost=4, **kwargs) is None
+        assert rate_limit_helper.check_rate_limit('segment:create', cost=2, **kwargs)[1] == 429
+        assert rate_limit_helper.check_rate_limit('segment:create', cost=1, **kwargs) is None
+        assert rate_limit_helper.check_rate_limit('segment:create', cost=1, **kwargs)[1] == 429
+
+
+def test_limiter_storage_selection(monkeypatch):
+    """测试限流存储按配置延迟选择，导入时不探测Redis"""
+    from src.utils import rate_limit
+    from src.config import Config
+    
+    monkeypatch.setattr(Config, 'REDIS_HOST', '')
+    assert rate_limit.get_limiter_storage_uri().startswith('sqlite:///')
+    monkeypatch.setattr(Config, 'REDIS_HOST', 'redis.invalid')
+    assert rate_limit.get_limiter_storage_uri() == 'failover://'
+
+
+def test_read_prefilter_batches_and_blocks():
+    """测试读请求本地放行、批量对账与被限流后停止本地放行"""
+    from src.utils.rate_limit import ReadPrefilter
+    
+    prefilter = ReadPrefilter(batch_size=4, flush_interval=60)
+    # 首个请求总是交给限流存储
+    assert prefilter.absorb('k') == 1
+    assert [prefilter.absorb('k') for _ in range(3)] == [None, None, None]
+    # 攒满后一次计入全部本地放行的请求
+    assert prefilter.absorb('k') == 4
+    
+    prefilter.block('k', 60)
+    assert prefilter.absorb('k') == 1
+    assert prefilter.absorb('k') == 1
+    
+    assert not ReadPrefilter(batch_size=1).is_enabled()
+
+
+def test_read_prefilter_keeps_global_count(client, monkeypatch):
+    """测试预过滤后读请求仍全部计入限流存储"""
+    from src.utils.rate_limit import read_prefilter
+    
+    monkeypatch.setattr(read_prefilter, 'flush_interval', 60)
+    monkeypatch.setattr(read_prefilter, 'batch_size', 10)
+    read_prefilter._entries.clear()
+    # 第1个请求对账，之后每10个请求对账一次：第31个请求计入第22~31个请求
+    for _ in range(30):
+        assert client.get('/api/v1/health').status_code == 200
+    response = client.get('/api/v1/health')
+    assert response.headers['X-RateLimit-Remaining'] == str(50 - 31)
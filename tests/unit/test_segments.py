@@ -4,7 +4,8 @@ from src.app import create_app
 from tests.helpers.test_client import TestConfig
 from tests.helpers.test_db import create_test_db, get_test_session, drop_test_db
 from src.services.segment_service import (
-    create_segment, get_segments_by_branch, count_words, validate_segment_length, check_turn_order
+    create_segment, create_segments_bulk, get_segments_by_branch, get_segment_page, get_segment_page_after,
+    decode_segment_cursor, count_words, validate_segment_length, check_turn_order
 )
 from src.services.story_service import create_story
 from src.services.branch_service import create_branch, join_branch
@@ -180,6 +181,31 @@ def test_create_segment_sequence_order(test_db, test_branch, test_bot):
     assert segment2.sequence_order == 2
 
 
+def test_create_segment_sequence_unique(test_db, test_branch, test_bot):
+    """测试序号由分支计数器分配，且同一分支内序号唯一"""
+    from sqlalchemy.exc import IntegrityError
+    bot, _ = test_bot
+    
+    # 绕过写路径直接插入，计数器落后于实际数据
+    test_db.add(Segment(branch_id=test_branch.id, bot_id=bot.id, content="直接写入", sequence_order=1))
+    test_db.commit()
+    
+    segment = create_segment(
+        db=test_db,
+        branch_id=test_branch.id,
+        bot_id=bot.id,
+        content="计数器校正后的续写内容。" * 20
+    )
+    assert segment.sequence_order == 2
+    test_db.refresh(test_branch)
+    assert test_branch.last_sequence_order == 2
+    
+    test_db.add(Segment(branch_id=test_branch.id, bot_id=bot.id, content="重复序号", sequence_order=2))
+    with pytest.raises(IntegrityError):
+        test_db.commit()
+    test_db.rollback()
+
+
 def test_create_segment_wrong_turn(test_db, test_branch, test_bot):
     """测试轮次检查（不是你的轮次）"""
     bot1, _ = test_bot
@@ -213,6 +239,118 @@ def test_create_segment_wrong_turn(test_db, test_branch, test_bot):
         )
 
 
+def test_create_segments_bulk(test_db, test_branch, test_bot):
+    """测试批量创建续写段（连续序号、计数一次写入，日志经发件箱补写）"""
+    from src.models.outbox_event import OutboxEvent
+    from src.models.segment_log import SegmentLog
+    from src.services.outbox_service import dispatch_pending, SEGMENTS_CREATED_BULK
+    bot, _ = test_bot
+    
+    create_segment(test_db, test_branch.id, bot.id, "第一段续写内容。" * 25)
+    segments = create_segments_bulk(
+        db=test_db,
+        branch_id=test_branch.id,
+        bot_id=bot.id,
+        contents=[f"批量第{i+1}段续写内容。" * 20 for i in range(3)],
+        author_id=bot.id,
+        author_name=bot.name
+    )
+    
+    assert [s.sequence_order for s in segments] == [2, 3, 4]
+    event = test_db.query(OutboxEvent).filter(OutboxEvent.event_type == SEGMENTS_CREATED_BULK).one()
+    assert len(event.payload['segments']) == 3
+    
+    assert dispatch_pending(test_db)['processed'] == 1
+    assert test_db.query(SegmentLog).filter(SegmentLog.branch_id == test_branch.id).count() == 3
+    test_db.refresh(test_branch)
+    assert test_branch.segments_count == 4
+    assert test_branch.last_sequence_order == 4
+
+
+def test_create_segments_bulk_rejects_whole_batch(test_db, test_branch, test_bot):
+    """测试批量创建时任一段不合法则整批拒绝"""
+    bot, _ = test_bot
+    
+    with pytest.raises(ValueError, match="第2段"):
+        create_segments_bulk(
+            db=test_db,
+            branch_id=test_branch.id,
+            bot_id=bot.id,
+            contents=["合法的续写内容。" * 25, "太短"]
+        )
+    
+    assert test_db.query(Segment).filter(Segment.branch_id == test_branch.id).count() == 0
+
+
+def test_create_segment_outbox_dispatch(test_db, test_branch, test_bot):
+    """测试续写创建时写入发件箱事件，分发后补写创作日志"""
+    from src.models.outbox_event import OutboxEvent
+    from src.models.segment_log import SegmentLog
+    from src.services.outbox_service import dispatch_pending
+    bot, _ = test_bot
+    
+    segment = create_segment(
+        db=test_db,
+        branch_id=test_branch.id,
+        bot_id=bot.id,
+        content="发件箱测试的续写内容。" * 20,
+        author={'author_id': bot.id, 'author_type': 'bot', 'author_name': bot.name}
+    )
+    
+    event = test_db.query(OutboxEvent).filter(OutboxEvent.aggregate_id == test_branch.id).one()
+    assert event.status == 'pending'
+    assert test_db.query(SegmentLog).filter(SegmentLog.segment_id == segment.id).count() == 0
+    
+    results = dispatch_pending(test_db)
+    assert results['processed'] == 1
+    
+    test_db.refresh(event)
+    assert event.status == 'done'
+    assert event.attempts == 1
+    log = test_db.query(SegmentLog).filter(SegmentLog.segment_id == segment.id).one()
+    assert log.author_type == 'bot'
+    
+    # 已处理的事件不会被重复分发
+    assert dispatch_pending(test_db)['processed'] == 0
+
+
+def test_outbox_dispatch_retry(test_db):
+    """测试发件箱事件失败后退避重试，超过次数标记为 failed"""
+    from src.models.outbox_event import OutboxEvent
+    from src.services import outbox_service
+    
+    calls = []
+    
+    @outbox_service.outbox_handler('test.failing')
+    def _failing(db, payload):
+        calls.append(payload)
+        raise RuntimeError('boom')
+    
+    event = outbox_service.add_event(test_db, 'test.failing', {'n': 1})
+    test_db.commit()
+    
+    results = outbox_service.dispatch_pending(test_db)
+    assert results['retried'] == 1
+    test_db.refresh(event)
+    assert event.status == 'pending'
+    assert event.attempts == 1
+    assert 'boom' in event.last_error
+    
+    # 退避期内不会再次认领
+    assert outbox_service.dispatch_pending(test_db)['retried'] == 0
+    assert len(calls) == 1
+    
+    event.attempts = outbox_service.Config.OUTBOX_MAX_ATTEMPTS - 1
+    event.available_at = event.created_at
+    test_db.commit()
+    results = outbox_service.dispatch_pending(test_db)
+    assert results['failed'] == 1
+    test_db.refresh(event)
+    assert event.status == 'failed'
+    
+    outbox_service._handlers.pop('test.failing', None)
+
+
 def test_get_segments_by_branch(test_db, test_branch, test_bot):
     """测试获取分支的续写段列表"""
     bot, _ = test_bot
@@ -237,6 +375,85 @@ def test_get_segments_by_branch(test_db, test_branch, test_bot):
     assert segments[2].sequence_order == 3
 
 
+def test_get_segment_page(test_db, test_branch, test_bot):
+    """测试获取已序列化的续写段分页"""
+    bot, _ = test_bot
+    
+    for i in range(3):
+        content = f"第{i+1}段续写内容。" * 25  # 约175字
+        create_segment(
+            db=test_db,
+            branch_id=test_branch.id,
+            bot_id=bot.id,
+            content=content
+        )
+    
+    segments, total = get_segment_page(test_db, test_branch.id, limit=2, offset=1)
+    
+    assert total == 3
+    assert [s['sequence_order'] for s in segments] == [2, 3]
+    assert segments[0]['bot_id'] == str(bot.id)
+    assert segments[0]['bot_name'] == bot.name
+    assert set(segments[0]) == {
+        'id', 'content', 'sequence_order', 'bot_id', 'bot_name',
+        'bot_model', 'coherence_score', 'created_at'
+    }
+
+
+def test_get_segment_page_after(test_db, test_branch, test_bot):
+    """测试键集分页逐页读取续写段"""
+    bot, _ = test_bot
+    
+    for i in range(5):
+        create_segment(
+            db=test_db,
+            branch_id=test_branch.id,
+            bot_id=bot.id,
+            content=f"第{i+1}段续写内容。" * 25
+        )
+    
+    orders = []
+    after = 0
+    while True:
+        segments, next_cursor, has_more = get_segment_page_after(test_db, test_branch.id, after_sequence=after, limit=2)
+        orders.extend(s['sequence_order'] for s in segments)
+        if not has_more:
+            break
+        after = decode_segment_cursor(next_cursor)
+    
+    assert orders == [1, 2, 3, 4, 5]
+    
+    with pytest.raises(ValueError):
+        decode_segment_cursor('not-a-cursor')
+
+
+def test_list_segments_api_cursor(client, test_db, test_branch, test_bot):
+    """测试续写列表API的游标分页"""
+    bot, _ = test_bot
+    for i in range(3):
+        create_segment(
+            db=test_db,
+            branch_id=test_branch.id,
+            bot_id=bot.id,
+            content=f"第{i+1}段续写内容。" * 25
+        )
+    
+    response = client.get(f'/api/v1/branches/{test_branch.id}/segments?after_sequence=0&limit=2&include_total=true')
+    assert response.status_code == 200
+    pagination = response.get_json()['data']['pagination']
+    assert pagination['has_more'] is True
+    assert pagination['total'] == 3
+    
+    response = client.get(f'/api/v1/branches/{test_branch.id}/segments?cursor={pagination["next_cursor"]}&limit=2')
+    data = response.get_json()['data']
+    assert [s['sequence_order'] for s in data['segments']] == [3]
+    assert data['pagination']['has_more'] is False
+    assert 'total' not in data['pagination']
+    
+    response = client.get(f'/api/v1/branches/{test_branch.id}/segments?cursor=bad')
+    assert response.status_code == 400
+
+
 def test_create_segment_api(client, test_db, test_branch, test_bot):
     """测试提交续写API"""
     bot, api_key = test_bot
@@ -257,6 +474,8 @@ def test_create_segment_api(client, test_db, test_branch, test_bot):
     assert 'segment' in data['data']
     assert data['data']['segment']['content'] == content
     assert data['data']['segment']['sequence_order'] == 1
+    # 只有一个参与者时，下一个轮到的仍是它自己
+    assert data['data']['next_bot']['id'] == str(bot.id)
 
 
 def test_create_segment_api_wrong_turn(client, test_db, test_branch, test_bot):
@@ -340,3 +559,108 @@ def test_list_segments_api(client, test_db, test_branch, test_bot):
     # 验证按顺序返回
     assert data['data']['segments'][0]['sequence_order'] == 1
     assert data['data']['segments'][1]['sequence_order'] == 2
+
+
+def test_list_segments_api_conditional_get(client, test_db, test_branch, test_bot):
+    """测试续写列表的条件 GET（未变化返回 304）"""
+    bot, _ = test_bot
+    create_segment(test_db, test_branch.id, bot.id, "条件请求续写内容。" * 25)
+    url = f'/api/v1/branches/{test_branch.id}/segments'
+    
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    
+    # 查询参数不同是不同的资源
+    assert client.get(f'{url}?limit=1', headers={'If-None-Match': etag}).status_code == 200
+    
+    create_segment(test_db, test_branch.id, bot.id, "条件请求第二段内容。" * 25)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['data']['segments']) == 2
+
+
+def test_list_segment_changes_api(client, test_db, test_branch, test_bot):
+    """测试续写增量同步API"""
+    from datetime import datetime, timedelta
+    bot, _ = test_bot
+    for i in range(3):
+        create_segment(test_db, test_branch.id, bot.id, f"第{i+1}段增量续写内容。" * 20)
+    url = f'/api/v1/branches/{test_branch.id}/segments/changes'
+    
+    data = client.get(f'{url}?since_sequence=1').get_json()['data']
+    assert [s['sequence_order'] for s in data['segments']] == [2, 3]
+    assert data['high_water_mark'] == 3
+    assert data['next_since_sequence'] == 3
+    assert data['has_more'] is False
+    
+    data = client.get(f'{url}?since_sequence=3').get_json()['data']
+    assert data['segments'] == []
+    assert data['next_since_sequence'] == 3
+    
+    data = client.get(f'{url}?since_sequence=0&limit=2').get_json()['data']
+    assert data['has_more'] is True
+    assert data['next_since_sequence'] == 2
+    
+    since = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+    data = client.get(f'{url}?since={since}').get_json()['data']
+    assert len(data['segments']) == 3
+    
+    assert client.get(f'{url}?since=bad').status_code == 400
+    assert client.get(f'/api/v1/branches/{uuid.uuid4()}/segments/changes').status_code == 404
+
+
+def test_get_segment_changes_cursor_covers_late_commits(test_db, test_branch, test_bot):
+    """测试读取高水位后才提交的续写段不会让游标落在已返回数据之前"""
+    from src.services.segment_service import get_segment_changes
+    bot, _ = test_bot
+    create_segment(test_db, test_branch.id, bot.id, "第一段增量续写内容。" * 20)
+    # 模拟读高水位与查询之间提交的续写段：分支计数器尚未反映
+    test_db.add(Segment(branch_id=test_branch.id, bot_id=bot.id, content="并发写入的续写内容", sequence_order=2))
+    test_db.commit()
+    
+    changes = get_segment_changes(test_db, test_branch.id, since_sequence=0)
+    assert [s['sequence_order'] for s in changes['segments']] == [1, 2]
+    assert changes['has_more'] is False
+    assert changes['next_since_sequence'] == 2
+    assert changes['high_water_mark'] == 2
+
+
+def test_conditional_get_skips_last_modified_within_current_second():
+    """测试最后修改落在当前这一秒时不输出 Last-Modified，避免同秒写入被误判 304"""
+    from datetime import datetime, timedelta, timezone
+    from flask import Flask, jsonify
+    from werkzeug.http import http_date
+    from src.utils.conditional import conditional_get
+    
+    app = Flask(__name__)
+    state = {}
+    
+    @app.route('/items')
+    @conditional_get(lambda: (state['token'], state['modified']))
+    def items():
+        return jsonify({'token': state['token']})
+    
+    client = app.test_client()
+    # 写入时间略超前于本机时钟（多实例时钟偏差），同样视为仍在当前秒内
+    state.update(token=1, modified=datetime.now(timezone.utc) + timedelta(milliseconds=500))
+    response = client.get('/items')
+    assert 'Last-Modified' not in response.headers
+    since = http_date(state['modified'])
+    
+    # 同一秒内再次写入：只带 If-Modified-Since 也必须拿到新内容
+    state.update(token=2, modified=state['modified'])
+    response = client.get('/items', headers={'If-Modified-Since': since})
+    assert response.status_code == 200
+    assert response.get_json()['token'] == 2
+    
+    # 已经过去的秒可以安全地作为 Last-Modified
+    state['modified'] = datetime.now(timezone.utc) - timedelta(seconds=5)
+    response = client.get('/items')
+    assert 'Last-Modified' in response.headers
+    response = client.get('/items', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert response.status_code == 304
@@ -308,3 +308,29 @@ def test_update_story_style_rules_api(client, test_db, test_bot):
     data = response.get_json()
     assert data['status'] == 'success'
     assert data['data']['style_rules'] == '新规范'
+
+
+def test_list_branches_api_conditional_get(client, test_db, test_bot):
+    """测试故事分支列表的条件 GET 跟随分页参数和标题修改"""
+    from src.services.branch_service import create_branch
+    bot, _ = test_bot
+    story = create_story(test_db, title="分支列表条件请求", background="背景", owner_id=bot.id, owner_type='bot')
+    branch = create_branch(test_db, story.id, "原标题", None, creator_bot_id=bot.id)
+    url = f'/api/v1/stories/{story.id}/branches'
+    
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    
+    # 分页参数与视图一致
+    response = client.get(f'{url}?limit=1&offset=5')
+    assert response.status_code == 200
+    assert response.get_json()['data']['branches'] == []
+    assert client.get(f'{url}?limit=x').status_code == 400
+    
+    branch.title = "新标题"
+    test_db.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert "新标题" in [b['title'] for b in response.get_json()['data']['branches']]